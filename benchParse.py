@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import random
+import time
+
+import iwLogsToGraph
+import logReader
+from iwLogsToGraph import (ALLOWED_SEG_COUNT, END_COMMIT, FIND_MERGES, FLUSH, FULL_FLUSH, GET_READER, INDEXED_DOCS,
+                           MERGE_END, MERGE_START, MERGING, SEG_SIZE, START_COMMIT, parseDateTime, parseThreadName,
+                           reFindMerges, reGetReader, reIndexedDocCount, reMergeEnd, reMergeSize, reMergeSizeWithDel,
+                           reMergeStart, reShardName)
+
+"""
+Measures how many infoStream lines per second iwLogsToGraph classifies, on a synthetic
+Elasticsearch log, with every regex run on every line versus the substring pre-filter, and
+with keyword searches over the memory-mapped log so only lines that hit are parsed.
+"""
+
+NOISE = (
+    'IW: nrtIsCurrent: infoVersion matches: false; DW changes: true; BD changes: false',
+    'DW: anyChanges? numDocsInRam=0 deletes=false hasTickets:false pendingChangesInFullFlush: false',
+    'DWPT: new segment has 0 deleted docs',
+    'DWPT: flushedFiles=[_a.fdx, _a.fdt, _a_Lucene50_0.tip, _a.nvd, _a_Lucene50_0.doc]',
+    'BD: applyDeletes: no segments; skipping',
+    'BD: prune sis=segments: _a(6.6.1):c2003 minGen=12 packetCount=0',
+    'IFD: delete "_a.si"',
+    'IFD: now checkpoint "_a(6.6.1):c2003 _b(6.6.1):c1396" [2 segments ; isCommit = false]',
+    'IW: publishFlushedSegment seg-private updates=null',
+    'DWFC: addFlushableState DocumentsWriterPerThread [pendingDeletes=gen=0, segment=_b, aborted=false]',
+    'CMS: merge thread Lucene Merge Thread #3 start',
+    'CMS:   too many merges; stalling...',
+    'IW: commitMerge: _a(6.6.1):c2003 index=_b(6.6.1):c1396 _c(6.6.1):c1858',
+    'TMP:   maybe=_c(6.6.1):c1396 _g(6.6.1):c1647 score=0.8721 skew=0.313 nonDelRatio=1.000 tooLarge=false',
+)
+
+
+def segName(n):
+    s = ''
+    while True:
+        s = 'abcdefghijklmnopqrstuvwxyz0123456789'[n % 36] + s
+        n //= 36
+        if n == 0:
+            return '_' + s
+
+
+def writeSyntheticLog(path, sizeMB, seed=17):
+    # About one line in eight carries an event, in the ratios of a busy indexing node
+    r = random.Random(seed)
+    limit = sizeMB * 1024 * 1024
+    size = 0
+    msec = 0
+    seg = 0
+    with open(path, 'w') as f:
+        while size < limit:
+            lines = []
+            for i in range(1000):
+                msec += r.randint(0, 40)
+                stamp = '2018-07-07 %02d:%02d:%02d,%03d' % (
+                    msec // 3600000 % 24, msec // 60000 % 60, msec // 1000 % 60, msec % 1000)
+                shard = r.randint(0, 4)
+                if r.random() < 0.5:
+                    thread = 'elasticsearch[node1][[idx][%d]: Lucene Merge Thread #%d]' % (shard, r.randint(1, 9))
+                else:
+                    thread = 'elasticsearch[node1][bulk][T#%d]' % r.randint(1, 8)
+                p = r.random()
+                if p < 0.875:
+                    msg = NOISE[r.randrange(len(NOISE))]
+                elif p < 0.95:
+                    seg += 1
+                    msg = 'TMP:   seg=%s(6.6.1):c%d/%d:delGen=1 size=%.3f MB [floor]' % (
+                        segName(seg), r.randint(1000, 9000), r.randint(1, 900), r.random() * 50)
+                elif p < 0.96:
+                    msg = 'TMP: findMerges: %d segments' % r.randint(10, 40)
+                elif p < 0.97:
+                    msg = 'TMP:   allowedSegmentCount=24 vs count=%d (eligible count=%d)' % (
+                        r.randint(10, 40), r.randint(10, 40))
+                elif p < 0.98:
+                    msg = 'DWPT: flush postings as segment %s numDocs=%d' % (segName(seg), r.randint(1000, 9000))
+                elif p < 0.985:
+                    msg = 'IW: getReader took %d msec' % r.randint(1, 300)
+                elif p < 0.99:
+                    msg = 'IW: flush at getReader'
+                elif p < 0.995:
+                    msg = 'IW: merge seg=%s %s %s' % (segName(seg + 1), segName(seg), segName(seg - 1))
+                else:
+                    msg = 'IW: merged segment size=%.3f MB vs estimate=%.3f MB' % (r.random() * 500, r.random() * 500)
+                lines.append('[%s][TRACE][lucene.iw                ] [node1][idx][%d] %s %s\n' % (
+                    stamp, shard, thread, msg))
+            chunk = ''.join(lines)
+            f.write(chunk)
+            size += len(chunk)
+
+
+def parseLineAllRegexes(line):
+    # iwLogsToGraph.parseLine before the pre-filter: every regex on every line
+    t = parseDateTime(line)
+
+    m = reShardName.search(line)
+    if m is None:
+        return t, None, None, 0, 0, 0, 0.0
+    shardTup = tuple(x.decode('utf-8', 'replace') for x in m.groups())
+
+    threadName = parseThreadName(line)
+    if threadName is None:
+        return t, shardTup, None, 0, 0, 0, 0.0
+    threadName = threadName.decode('utf-8', 'replace')
+
+    flags = 0
+    n = 0
+    dels = 0
+    mb = 0.0
+
+    if line.find(b'startCommit(): start') != -1:
+        flags |= START_COMMIT
+
+    if line.find(b'commit: wrote segments file') != -1:
+        flags |= END_COMMIT
+
+    if line.find(b'flush postings as segment') != -1:
+        flags |= FLUSH
+
+    if line.find(b'prepareCommit: flush') != -1 or line.find(b'flush at getReader') != -1:
+        flags |= FULL_FLUSH
+
+    m = reIndexedDocCount.search(line)
+    if m is not None:
+        flags |= INDEXED_DOCS
+        n = int(m.group(1))
+        mb = float(m.group(2))
+
+    m = reGetReader.search(line)
+    if m is not None:
+        flags |= GET_READER
+        n = int(m.group(1))
+
+    if reMergeStart.search(line) is not None:
+        flags |= MERGE_START
+
+    m = reMergeEnd.search(line)
+    if m is not None:
+        flags |= MERGE_END
+        mb = float(m.group(1))
+
+    m = reFindMerges.search(line)
+    if m is not None:
+        flags |= FIND_MERGES
+        n = int(m.group(1))
+    else:
+        m = reMergeSize.search(line)
+        if m is not None:
+            flags |= SEG_SIZE
+            n = int(m.group(1))
+            mb = float(m.group(2))
+        else:
+            m = reMergeSizeWithDel.search(line)
+            if m is not None:
+                flags |= SEG_SIZE
+                n = int(m.group(1))
+                dels = int(m.group(2))
+                mb = float(m.group(4))
+
+        if flags & SEG_SIZE:
+            if line.find(b' [merging]') != -1:
+                flags |= MERGING
+        elif line.find(b'allowedSegmentCount=') != -1:
+            flags |= ALLOWED_SEG_COUNT
+
+    return t, shardTup, threadName, flags, n, dels, mb
+
+
+def bench(path, parse):
+    lineCount = 0
+    eventCount = 0
+    t0 = time.time()
+    for line in logReader.iterChunkLines(path, 0, os.path.getsize(path)):
+        rec = parse(line.strip())
+        lineCount += 1
+        if rec[3] != 0:
+            eventCount += 1
+    return lineCount, eventCount, time.time() - t0
+
+
+def benchMapped(path):
+    eventCount = 0
+    t0 = time.time()
+    for start, end in logReader.chunkRanges(path):
+        for rec in iwLogsToGraph.chunkRecords(path, start, end):
+            if rec[3] != 0:
+                eventCount += 1
+    return eventCount, time.time() - t0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks infoStream line classification.')
+    parser.add_argument('--log', type=str, default='synthetic-iw.log',
+                        help='Synthetic log to use, written first if it does not exist')
+    parser.add_argument('--mb', type=int, default=2048, help='Size of the synthetic log to write')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.log):
+        print('Writing %d MB synthetic log %s...' % (args.mb, args.log))
+        writeSyntheticLog(args.log, args.mb)
+
+    results = []
+    for name, parse in (('all regexes', parseLineAllRegexes), ('pre-filter', iwLogsToGraph.parseLine)):
+        lineCount, eventCount, sec = bench(args.log, parse)
+        results.append(lineCount / sec)
+        print('%-12s %d lines (%d events) in %.1f sec: %.0f lines/sec' % (name, lineCount, eventCount, sec,
+                                                                        lineCount / sec))
+    eventCount, sec = benchMapped(args.log)
+    results.append(lineCount / sec)
+    print('%-12s %d lines (%d events) in %.1f sec: %.0f lines/sec' % ('mapped', lineCount, eventCount, sec,
+                                                                    lineCount / sec))
+    print('speedup %.2fx pre-filter, %.2fx mapped' % (results[1] / results[0], results[2] / results[0]))
@@ -1,7 +1,23 @@
-import time
-import sys
+import array
+import base64
+import bisect
+import heapq
+import io
+import itertools
+import json
+import math
+import multiprocessing
+import os
 import re
-import datetime
+import sys
+
+import numpy as np
+import pandas as pd
+
+import logCache
+import logIndex
+import logReader
+import logTime
 
 # see http://home.apache.org/~mikemccand/lucenebench/iw.html as an example
 
@@ -13,63 +29,52 @@ import datetime
 #   - flush sizes/frequency
 #   - commit frequency
 
-reDateTime = re.compile('(\d\d\d\d)-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)(,\d\d\d)?')
-reFindMerges = re.compile('findMerges: (\d+) segments')
-reMergeSize = re.compile(r'[cC](\d+) size=(.*?) MB')
-reMergeSizeWithDel = re.compile(r'[cC](\d+)/(\d+):delGen=(\d+) size=(.*?) MB')
-reMergeStart = re.compile(r'merge seg=(.*?) ')
-reMergeEnd = re.compile(r'merged segment size=(.*?) MB')
-reGetReader = re.compile(r'getReader took (\d+) msec')
+# Lines are matched as bytes, straight from the mapped log; only captured groups are decoded:
+reDateTime = re.compile(rb'\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d(,\d\d\d)?')
+reFindMerges = re.compile(rb'findMerges: (\d+) segments')
+reMergeSize = re.compile(rb'[cC](\d+) size=(.*?) MB')
+reMergeSizeWithDel = re.compile(rb'[cC](\d+)/(\d+):delGen=(\d+) size=(.*?) MB')
+reMergeStart = re.compile(rb'merge seg=(.*?) ')
+reMergeEnd = re.compile(rb'merged segment size=(.*?) MB')
+reGetReader = re.compile(rb'getReader took (\d+) msec')
+reStalled = re.compile(rb'stalled for (\d+) ms')
+reFlushedSize = re.compile(rb'newFlushedSize(?:\(includes docstores\))?=(.*?) MB')
 # Straight lucene log:
-reThreadName = re.compile(r'^IW \d+ \[.*?; (.*?)\]:')
+reThreadName = re.compile(rb'^IW \d+ \[.*?; (.*?)\]:')
 
 # Two variations from Elasticsearch:
-reThreadNameES = re.compile(r' elasticsearch\[.*?\](\[.*?\]\[.*?\])')
-reThreadNameES2 = re.compile(r' elasticsearch\[.*?\]\[\[.*?\]\[.*?\]: (.*?)\] ')
+reThreadNameES = re.compile(rb' elasticsearch\[.*?\](\[.*?\]\[.*?\])')
+reThreadNameES2 = re.compile(rb' elasticsearch\[.*?\]\[\[.*?\]\[.*?\]: (.*?)\] ')
 
-reIndexedDocCount = re.compile(r'^Indexer: (\d+) docs: ([0-9\.]+) sec')
-reShardName = re.compile(r'\[lucene.iw\s*\] \[(.*?)\]\[(.*?)\]\[(\d+)\]')
+reIndexedDocCount = re.compile(rb'^Indexer: (\d+) docs: ([0-9\.]+) sec')
+reShardName = re.compile(rb'\[lucene.iw\s*\] \[(.*?)\]\[(.*?)\]\[(\d+)\]')
 
 
 def parseDateTime(line):
+    # Float epoch msec of the line's timestamp
     m = reDateTime.search(line)
     if m is None:
         return None
+    return logTime.stampMillis(m.group(0))
 
-    # year, month, day, hours, minutes, seconds:
-    t = list(m.groups())
-    if len(t) == 7:
-        if t[-1] is None:
-            t = [int(x) for x in t[:6]]
-        else:
-            t2 = [int(x) for x in t[:6]]
-            # ES logs have msec:
-            t2[-1] += float(t[6][1:]) / 1000.0
-            t = t2
-    elif len(t) == 6:
-        t = [int(x) for x in t[:3]]
-
-    # print('LINE %s ->\n  %s' % (line, t))
-    return t
 
-
-class RollingTimeWindow:
-
-    def __init__(self, windowTime):
-        self.window = []
-        self.windowTime = windowTime
-        self.pruned = False
-
-    def add(self, t, value):
-        self.window.append((t, value))
-        while len(self.window) > 0 and t - self.window[0][0] > self.windowTime:
-            del self.window[0]
-            self.pruned = True
+def windowStarts(t, windowTime):
+    # Index of the oldest time still within windowTime of each time, as a window sliding over the
+    # times in log order would hold; a time earlier than one before it is taken as that one
+    t = np.maximum.accumulate(t)
+    return np.searchsorted(t, t - windowTime, side='left')
 
 
 # WARNING: thread [[entry_20140702][0] missing from mergeThreads
 # WARNING: thread [[entry_20140702][1] missing from mergeThreads
 
+def parseShardName(line):
+    m = reShardName.search(line)
+    if m is None:
+        return None
+    return tuple(x.decode('utf-8', 'replace') for x in m.groups())
+
+
 def parseThreadName(line):
     for r in reThreadNameES2, reThreadNameES, reThreadName:
         m = r.search(line)
@@ -77,186 +82,908 @@ def parseThreadName(line):
             return m.group(1)
 
 
-def main():
-    segCounts = []
-    pendingSegCounts = {}
-    merges = []
-    segsPerFullFlush = []
-
-    inFindMerges = False
-    maxSegs = 0
-    maxRunningMerges = 0
-    runningMerges = 0
-    mergeThreads = {}
-    commitCount = 0
-    flushCount = 0
-    minTime = None
-    maxTime = None
-    startFlushCount = None
-    getReaderTimes = []
-    commitTimes = []
-    runningCommits = {}
-    indexDocTimes = []
-    allShards = {}
-    lineCount = 0
+# What a line says, as bits of a record's flags:
+START_COMMIT = 1
+END_COMMIT = 2
+FLUSH = 4
+FULL_FLUSH = 8
+INDEXED_DOCS = 16
+GET_READER = 32
+MERGE_START = 64
+MERGE_END = 128
+FIND_MERGES = 256
+SEG_SIZE = 512
+MERGING = 1024
+ALLOWED_SEG_COUNT = 2048
+FLUSHED_SIZE = 4096
+STALLED = 8192
+
+# Substrings a line must contain to possibly carry each event; most lines contain none of them
+LINE_KEYWORDS = (
+    (b'startCommit(): start', START_COMMIT),
+    (b'commit: wrote segments file', END_COMMIT),
+    (b'flush postings as segment', FLUSH),
+    (b'prepareCommit: flush', FULL_FLUSH),
+    (b'flush at getReader', FULL_FLUSH),
+    (b'Indexer: ', INDEXED_DOCS),
+    (b'getReader took ', GET_READER),
+    (b'merge seg=', MERGE_START),
+    (b'merged segment size=', MERGE_END),
+    (b'findMerges: ', FIND_MERGES),
+    (b' size=', SEG_SIZE),
+    (b'allowedSegmentCount=', ALLOWED_SEG_COUNT),
+    (b'newFlushedSize', FLUSHED_SIZE),
+    (b'stalled for ', STALLED),
+)
+LINE_KEYWORD_STRINGS = tuple(keyword for keyword, flag in LINE_KEYWORDS)
+
+
+def parseLine(line):
+    # Everything main() needs from one line, without any parse state so it can be cached:
+    #   (t, shardTup, threadName, flags, n, dels, mb)
+    # n is the getReader msec, stalled msec, findMerges segment count, segment doc count or indexed doc count,
+    # dels a segment's deleted docs, mb a segment's, flushed segment's or finished merge's size, or
+    # indexing seconds
+    t = parseDateTime(line)
+
+    # Most lines carry none of the events below, so cheap substring checks first find the
+    # events a line may carry, and only their regexes are run:
+    candidates = 0
+    for keyword, flag in LINE_KEYWORDS:
+        if line.find(keyword) != -1:
+            candidates |= flag
+    if candidates == 0:
+        return t, None, None, 0, 0, 0, 0.0
+
+    m = reShardName.search(line)
+    if m is None:
+        return t, None, None, 0, 0, 0, 0.0
+    shardTup = tuple(x.decode('utf-8', 'replace') for x in m.groups())
+
+    threadName = parseThreadName(line)
+    if threadName is None:
+        return t, shardTup, None, 0, 0, 0, 0.0
+    threadName = threadName.decode('utf-8', 'replace')
+
+    # The substring checks are exact for these:
+    flags = candidates & (START_COMMIT | END_COMMIT | FLUSH | FULL_FLUSH)
+    n = 0
+    dels = 0
+    mb = 0.0
+
+    if candidates & INDEXED_DOCS:
+        m = reIndexedDocCount.search(line)
+        if m is not None:
+            flags |= INDEXED_DOCS
+            n = int(m.group(1))
+            mb = float(m.group(2))
 
-    i = 1
-    onlyShard = None
-    while i < len(sys.argv):
-        if sys.argv[i] == '-shard':
-            onlyShard = tuple(sys.argv[i + 1].split(':'))
-            del sys.argv[i:i + 2]
-        else:
-            i += 1
+    if candidates & GET_READER:
+        m = reGetReader.search(line)
+        if m is not None:
+            flags |= GET_READER
+            n = int(m.group(1))
 
-    if onlyShard is not None:
-        print('only: %s' % ':'.join(onlyShard))
+    if candidates & STALLED:
+        # ConcurrentMergeScheduler held an indexing thread back while too many merges were pending
+        m = reStalled.search(line)
+        if m is not None:
+            flags |= STALLED
+            n = int(m.group(1))
 
-    with open(sys.argv[1]) as f:
-        for line in f.readlines():
-            line = line.strip()
+    if candidates & MERGE_START and reMergeStart.search(line) is not None:
+        flags |= MERGE_START
 
-            t = parseDateTime(line)
-            if t is not None:
-                if minTime is None:
-                    minTime = t
-                maxTime = t
+    if candidates & MERGE_END:
+        m = reMergeEnd.search(line)
+        if m is not None:
+            flags |= MERGE_END
+            mb = float(m.group(1))
 
-            m = reShardName.search(line)
+    if candidates & FLUSHED_SIZE:
+        m = reFlushedSize.search(line)
+        if m is not None:
+            flags |= FLUSHED_SIZE
+            mb = float(m.group(1))
+
+    m = None
+    if candidates & FIND_MERGES:
+        m = reFindMerges.search(line)
+    if m is not None:
+        flags |= FIND_MERGES
+        n = int(m.group(1))
+    else:
+        if candidates & SEG_SIZE:
+            m = reMergeSize.search(line)
             if m is not None:
-                shardTup = m.groups()
+                flags |= SEG_SIZE
+                n = int(m.group(1))
+                mb = float(m.group(2))
             else:
-                print('NO SHARD: %s' % line)
-                continue
+                m = reMergeSizeWithDel.search(line)
+                if m is not None:
+                    flags |= SEG_SIZE
+                    n = int(m.group(1))
+                    dels = int(m.group(2))
+                    mb = float(m.group(4))
+
+        if flags & SEG_SIZE:
+            if line.find(b' [merging]') != -1:
+                flags |= MERGING
+        elif candidates & ALLOWED_SEG_COUNT:
+            flags |= ALLOWED_SEG_COUNT
+
+    return t, shardTup, threadName, flags, n, dels, mb
+
+
+CACHE_COLUMNS = (('t', 'd'), ('shard', 'i'), ('thread', 'i'), ('flags', 'h'),
+                 ('n', 'q'), ('dels', 'q'), ('mb', 'd'))
+CACHE_VERSION = 4
+
+
+def chunkRecords(path, start, end):
+    # parseLine() records of the lines in one chunk of the log that say something, between
+    # time-only records for the chunk's first and last timestamps (which main() still needs).
+    # Only lines where a keyword search over the mapped log hits are parsed at all.
+    with logReader.mappedLog(path) as mm:
+        start, end = logReader.alignChunk(mm, start, end)
+        return bufferRecords(mm, start, end)
+
+
+def bufferRecords(mm, start, end):
+    # chunkRecords() of the whole lines in [start, end) of a mapped log, or of bytes read from one
+    records = []
+    warnings = []
+    for offset, line in logReader.iterLinesWithout(mm, start, end, b'[lucene.iw'):
+        warnings.append((offset, 'NO SHARD: %s' % line.strip().decode('utf-8', 'replace')))
+
+    for offset, line in logReader.iterKeywordLines(mm, start, end, LINE_KEYWORD_STRINGS):
+        rec = parseLine(line.strip())
+        t, shardTup, threadName, flags, n, dels, mb = rec
+        if flags != 0:
+            records.append(rec)
+        elif shardTup is not None and threadName is None:
+            warnings.append((offset, 'NO THREAD: %s' % line.strip().decode('utf-8', 'replace')))
+
+    m = reDateTime.search(mm, start, end)
+    if m is not None:
+        firstTime = parseDateTime(m.group(0))
+        lastTime = logReader.lastLine(mm, start, end, parseDateTime)
+        records.insert(0, (firstTime, None, None, 0, 0, 0, 0.0))
+        records.append((lastTime, None, None, 0, 0, 0, 0.0))
+
+    warnings.sort()
+    for offset, warning in warnings:
+        print(warning)
+    return records
+
+
+def windowRange(path, timeFrom, timeTo):
+    # Byte range of the log's lines from timeFrom up to and including timeTo (either may be None),
+    # found through the log's sidecar index
+    index = logIndex.load(path, 'iwLogsToGraph', {}, parseDateTime, parseShardName)
+    with logReader.mappedLog(path) as mm:
+        start = 0
+        end = len(mm)
+        if timeFrom is not None:
+            lo, hi = index.bounds(timeFrom, len(mm))
+            start = logReader.bisectTime(mm, timeFrom, parseDateTime, lo, hi)
+        if timeTo is not None:
+            lo, hi = index.bounds(timeTo, len(mm), right=True)
+            end = logReader.bisectTime(mm, timeTo, parseDateTime, max(lo, start), max(hi, start), right=True)
+    return start, end
+
+
+def readRecords(path, useCache=True, jobs=1, timeFrom=None, timeTo=None, pool=None):
+    # parseLine() records of the log's lines that say something, plus its first and last timestamps.
+    # The lines are parsed in chunks by jobs processes (of pool, if given), or replayed from the log's
+    # cache when up to date.  With a time window only its lines are parsed, and nothing is cached.
+    if timeFrom is not None or timeTo is not None:
+        start, end = windowRange(path, timeFrom, timeTo)
+        for records in logReader.mapChunks(path, chunkRecords, jobs, start=start, end=end, pool=pool):
+            yield from records
+        return
+
+    if useCache:
+        cache = logCache.load(path, 'iwLogsToGraph', {'version': CACHE_VERSION})
+        if cache is not None:
+            print('Using cache for %s' % path)
+            yield from replayRecords(cache)
+            return
+
+    writer = None
+    if useCache:
+        writer = logCache.CacheWriter(path, 'iwLogsToGraph', {'version': CACHE_VERSION}, CACHE_COLUMNS)
+    shardIds = {}
+    threadIds = {}
+    firstTime = None
+    lastTime = None
+    try:
+        for records in logReader.mapChunks(path, chunkRecords, jobs, pool=pool):
+            for rec in records:
+                t, shardTup, threadName, flags, n, dels, mb = rec
+                if t is not None:
+                    if firstTime is None:
+                        firstTime = t
+                    lastTime = t
+                if writer is not None and flags != 0:
+                    cols = writer.columns
+                    # NaN stands for no timestamp
+                    cols['t'].append(float('nan') if t is None else t)
+                    cols['shard'].append(shardIds.setdefault(shardTup, len(shardIds)))
+                    cols['thread'].append(threadIds.setdefault(threadName, len(threadIds)))
+                    cols['flags'].append(flags)
+                    cols['n'].append(n)
+                    cols['dels'].append(dels)
+                    cols['mb'].append(mb)
+                yield rec
+    except BaseException:
+        if writer is not None:
+            writer.discard()
+        raise
+
+    if writer is not None:
+        writer.commit({'shards': list(shardIds), 'threads': list(threadIds),
+                       'firstTime': firstTime, 'lastTime': lastTime})
+
+
+def replayRecords(cache):
+    shards = [tuple(shardTup) for shardTup in cache.meta['shards']]
+    threads = cache.meta['threads']
+    if cache.meta['firstTime'] is not None:
+        yield cache.meta['firstTime'], None, None, 0, 0, 0, 0.0
+    for t, shard, thread, flags, n, dels, mb in zip(*[cache.iterColumn(name) for name, typecode in CACHE_COLUMNS]):
+        if math.isnan(t):
+            t = None
+        yield t, shards[shard], threads[thread], flags, n, dels, mb
+    if cache.meta['lastTime'] is not None:
+        yield cache.meta['lastTime'], None, None, 0, 0, 0, 0.0
+
+
+def logRecords(logSets, useCache=True, jobs=1, timeFrom=None, timeTo=None):
+    # readRecords() of several logs, each a log and the files it was rotated to (see
+    # logReader.findLogSets), merged into timestamp order.  The logs are read side by side, sharing
+    # one pool of jobs processes.
+    if len(logSets) == 1 or jobs <= 1:
+        pool = None
+    else:
+        pool = multiprocessing.Pool(jobs)
+    try:
+        streams = [itertools.chain.from_iterable(readRecords(path, useCache, jobs, timeFrom, timeTo, pool)
+                                                 for path in logFiles)
+                   for logFiles in logSets]
+        yield from mergeRecords(streams)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def mergeRecords(streams):
+    # The records of several streams, each in log order, merged into timestamp order by a k-way heap
+    # merge; a record without a timestamp stays right after the one before it in its stream
+    if len(streams) == 1:
+        return streams[0]
+    return (rec for t, rec in heapq.merge(*[timedRecords(records) for records in streams], key=lambda x: x[0]))
+
+
+def timedRecords(records):
+    # (time, record): the record's timestamp, else the last one before it
+    last = -math.inf
+    for rec in records:
+        if rec[0] is not None:
+            last = rec[0]
+        yield last, rec
+
+
+class Table:
+    # One kind of event's rows, accumulated in typed columns while the log is read
+
+    def __init__(self, columns):
+        self.columns = [(name, array.array(typecode)) for name, typecode in columns]
+
+    def add(self, *row):
+        for (name, values), value in zip(self.columns, row):
+            values.append(value)
+
+    def __len__(self):
+        return len(self.columns[0][1])
+
+    def column(self, name):
+        for columnName, values in self.columns:
+            if columnName == name:
+                return values
+
+    def rows(self, start):
+        # Rows from start on, as tuples
+        return zip(*[values[start:] for name, values in self.columns])
+
+    def frame(self):
+        return pd.DataFrame(dict((name, np.frombuffer(values, dtype=values.typecode)) for name, values in self.columns))
+
+
+# The tables readTables() builds.  Times are int64 epoch msec; seq is the record that started the row's
+# event, so events finishing out of order can be put back in log order.
+TABLE_COLUMNS = {
+    # Completed findMerges blocks
+    'segCounts': (('seq', 'q'), ('t', 'q'), ('shard', 'q'), ('segCount', 'q'), ('mergeMB', 'd'),
+                  ('mergeSegCount', 'q'), ('indexMB', 'd'), ('indexDocs', 'd'), ('delDocs', 'q'), ('endSeq', 'q')),
+    # Every merge start, and the merges that finished
+    'mergeStarts': (('seq', 'q'), ('t', 'q')),
+    'merges': (('seq', 'q'), ('t', 'q'), ('endSeq', 'q'), ('endT', 'q'), ('mb', 'd'), ('shard', 'q')),
+    'flushes': (('seq', 'q'),),
+    # Flushed segments' sizes, when DWPT infoStream is enabled
+    'flushSizes': (('seq', 'q'), ('t', 'q'), ('mb', 'd')),
+    # Indexing stalls the merge scheduler reported when they ended, when CMS infoStream is enabled
+    'stalls': (('seq', 'q'), ('t', 'q'), ('msec', 'q'), ('shard', 'q')),
+    'fullFlushes': (('seq', 'q'), ('t', 'q')),
+    # Every commit start, and the commits that finished
+    'commitStarts': (('seq', 'q'), ('t', 'q')),
+    'commits': (('seq', 'q'), ('t', 'q'), ('endT', 'q')),
+    'refreshes': (('t', 'q'), ('msec', 'q')),
+    'indexedDocs': (('sec', 'd'), ('docs', 'q')),
+}
+
+
+def readTables(records, onlyShard=None):
+    # Pairs the log's records up into events, returned as pandas tables (see TABLE_COLUMNS) along with
+    # the log's first and last times and its shard names
+    reader = TableReader(onlyShard)
+    reader.add(records)
+    return reader.frames(), reader.minTime, reader.maxTime, list(reader.shardIds)
+
+
+class TableReader:
+    # The state machine pairing records up into events, fed records as they are read; the events
+    # still open are kept, so -follow can feed it what the log says next
+
+    def __init__(self, onlyShard=None):
+        self.onlyShard = onlyShard
+        self.tables = dict((name, Table(columns)) for name, columns in TABLE_COLUMNS.items())
+        self.pendingSegCounts = {}
+        self.mergeThreads = {}
+        self.runningCommits = {}
+        self.shardIds = {}
+        self.minTime = None
+        self.maxTime = None
+        self.seq = -1
+
+    def add(self, records):
+        tables = self.tables
+        segCounts = tables['segCounts']
+        pendingSegCounts = self.pendingSegCounts
+        mergeThreads = self.mergeThreads
+        runningCommits = self.runningCommits
+        shardIds = self.shardIds
+        onlyShard = self.onlyShard
+        seq = self.seq
+
+        for t, shardTup, threadName, flags, n, dels, mb in records:
+            seq += 1
+            if (seq + 1) % 10000 == 0:
+                print('%d records...' % (seq + 1))
 
-            if onlyShard is not None and shardTup != onlyShard:
+            if t is not None:
+                t = int(t)
+                if self.minTime is None:
+                    self.minTime = t
+                self.maxTime = t
+
+            if shardTup is None or threadName is None:
                 continue
 
-            threadName = parseThreadName(line)
-            if threadName is None:
-                print('NO THREAD: %s' % line)
+            if onlyShard is not None and shardTup != onlyShard:
                 continue
 
-            if line.find('startCommit(): start') != -1:
-                commitCount += 1
-                runningCommits[threadName] = len(commitTimes)
-                commitTimes.append(t)
+            if flags & START_COMMIT:
+                # Might restart on the same thread, dropping the earlier commit:
+                runningCommits[threadName] = (seq, t)
+                tables['commitStarts'].add(seq, t)
 
-            if line.find('commit: wrote segments file') != -1:
+            if flags & END_COMMIT:
                 # Might not be present if IW infoStream was enabled "mid flight":
                 if threadName in runningCommits:
-                    commitTimes[runningCommits[threadName]].append(t)
-                    del runningCommits[threadName]
+                    tables['commits'].add(*runningCommits.pop(threadName), t)
 
-            if line.find('flush postings as segment') != -1:
-                flushCount += 1
+            if flags & FLUSH:
+                tables['flushes'].add(seq)
 
-            if line.find('prepareCommit: flush') != -1 or line.find('flush at getReader') != -1:
-                if startFlushCount is not None:
-                    # print('%s: %d' % (startFlushTime, flushCount - startFlushCount))
-                    segsPerFullFlush.append(startFlushTime + [flushCount - startFlushCount])
-                startFlushCount = flushCount
-                startFlushTime = t
+            if flags & FLUSHED_SIZE:
+                tables['flushSizes'].add(seq, t, mb)
 
-            m = reIndexedDocCount.search(line)
-            if m is not None:
-                docCount, t = m.groups()
-                indexDocTimes.append((int(docCount), float(t)))
+            if flags & STALLED:
+                tables['stalls'].add(seq, t, n, shardIds.setdefault(shardTup, len(shardIds)))
 
-            m = reGetReader.search(line)
-            if m is not None:
-                getReaderTimes.append(t + [int(m.group(1))])
+            if flags & FULL_FLUSH:
+                tables['fullFlushes'].add(seq, t)
 
-            m = reMergeStart.search(line)
-            if m is not None:
-                # A merge kicked off
-                key = shardTup + (threadName,)
-                mergeThreads[key] = len(merges)
-                merges.append(['start', key] + t)
-                runningMerges += 1
-                # print("mergeStart: %s, running=%d" % (threadName, runningMerges))
-                maxRunningMerges = max(maxRunningMerges, runningMerges)
-
-            m = reMergeEnd.search(line)
-            if m is not None:
-                # A merge finished
-                key = shardTup + (threadName,)
-                mergeSize = float(m.group(1))
+            if flags & INDEXED_DOCS:
+                tables['indexedDocs'].add(mb, n)
 
-                # print("mergeFinish: %s" % threadName)
+            if flags & GET_READER:
+                tables['refreshes'].add(t, n)
 
-                # Might not be present if IW infoStream was enabled "mid flight":
+            key = shardTup + (threadName,)
+
+            if flags & MERGE_START:
+                # A merge kicked off
+                mergeThreads[key] = (seq, t)
+                tables['mergeStarts'].add(seq, t)
+
+            if flags & MERGE_END:
+                # A merge finished; might not have started if IW infoStream was enabled "mid flight":
                 if key in mergeThreads:
-                    merges[mergeThreads[key]].append(mergeSize)
-                    del mergeThreads[key]
-                    merges.append(['end', key] + t + [mergeSize])
-                    runningMerges -= 1
+                    shard = shardIds.setdefault(shardTup, len(shardIds))
+                    tables['merges'].add(*mergeThreads.pop(key), seq, t, mb, shard)
                 else:
                     print('WARNING: thread %s missing from mergeThreads' % threadName)
 
-            m = reFindMerges.search(line)
-            key = shardTup + (threadName,)
-            # if m is not None and line.find('[es1][bulk]') != -1:
-            if m is not None:
-                segCount = int(m.group(1))
-                # mergeMB, mergeSegCount, indexSizeMB, indexSizeDocs, delDocCount
-                maxSegs = max(maxSegs, segCount)
-                pendingSegCounts[key] = [0.0, 0, 0.0, 0.0, 0, len(segCounts)]
-                segCounts.append(list(t) + [segCount])
-                # print('start segCount %s' % (segCounts[-1]))
+            if flags & FIND_MERGES:
+                # segCount, mergeMB, mergeSegCount, indexMB, indexDocs, delDocs of the segments listed next
+                pendingSegCounts[key] = [seq, t, shardIds.setdefault(shardTup, len(shardIds)), n, 0.0, 0, 0.0, 0.0, 0]
             elif key in pendingSegCounts:
-                sizeDocs = None
-                m = reMergeSize.search(line)
-                if m is not None:
-                    # print('line: %s' % line.rstrip())
-                    sizeDocs = int(m.group(1))
-                    sizeMB = float(m.group(2))
-                    delDocs = 0
-                else:
-                    m = reMergeSizeWithDel.search(line)
-                    if m is not None:
-                        sizeDocs = int(m.group(1))
-                        delDocs = int(m.group(2))
-                        sizeMB = float(m.group(4))
-
-                if sizeDocs is not None:
+                if flags & SEG_SIZE:
                     l = pendingSegCounts[key]
-                    l[2] += sizeMB
-                    l[3] += sizeDocs
-                    l[4] += delDocs
-                    if line.find(' [merging]') != -1:
-                        l[0] += sizeMB
-                        l[1] += 1
-                elif line.find('allowedSegmentCount=') != -1:
-                    idx = pendingSegCounts[key][5]
-                    segCounts[idx].extend(pendingSegCounts[key][:5])
-                    allShards[shardTup] = pendingSegCounts[key][2]
-                    # print('finish segCount %s' % (segCounts[idx]))
-                    # print('  index MB %s' % segCounts[idx][9])
-                    del pendingSegCounts[key]
-
-            lineCount += 1
-            if False and lineCount == 200000:
-                break
-            if lineCount % 10000 == 0:
-                print('%d lines...' % lineCount)
-
-    now = datetime.datetime.now()
-    globalStartTime = toDateTime(minTime)
-    globalEndTime = toDateTime(maxTime)
-    totSec = (globalEndTime - globalStartTime).total_seconds()
-    print('elapsed time %s: %s - %s' % (globalEndTime - globalStartTime, globalStartTime, globalEndTime))
-    print('max concurrent merges %s' % maxRunningMerges)
-    print('commit count %s (avg every %.1f sec)' % \
-          (commitCount, totSec / commitCount))
-    print('flush count %s (avg every %.1f sec)' % \
-          (flushCount, totSec / flushCount))
-    print('total shard count: %s' % len(allShards))
-    l = list(allShards.items())
-    l.sort(key=lambda x: (-x[1], x[0]))
-    for tup, mb in l:
-        print('  %.3f GB: %s' % (mb / 1024., ':'.join(tup)))
+                    l[6] += mb
+                    l[7] += n
+                    l[8] += dels
+                    if flags & MERGING:
+                        l[4] += mb
+                        l[5] += 1
+                elif flags & ALLOWED_SEG_COUNT:
+                    segCounts.add(*pendingSegCounts.pop(key), seq)
+
+        self.seq = seq
+
+    def frames(self):
+        frames = dict((name, table.frame()) for name, table in self.tables.items())
+        for name in 'segCounts', 'merges', 'commits':
+            frames[name] = frames[name].sort_values('seq', kind='stable', ignore_index=True)
+        return frames
+
+
+ROWS_PER_WRITE = 65536
+
+# Rows kept per chart by default (-points); longer series are decimated, 0 keeps every row
+CHART_POINTS = 10000
+
+
+def chartRows(fmt, *columns, keep=None):
+    # Chart rows, as chunks of the body of its JS string literal, formatted from array columns; keep
+    # selects the rows to write
+    if keep is not None:
+        columns = [np.asarray(c)[keep] for c in columns]
+    for i in range(0, len(columns[0]), ROWS_PER_WRITE):
+        yield ''.join([fmt % row for row in zip(*[np.asarray(c)[i:i + ROWS_PER_WRITE].tolist() for c in columns])])
+
+
+def lttb(x, y, points):
+    # Indices of the points of the series largest-triangle-three-buckets keeps, at most points of them:
+    # the first and last, and from each bucket in between the point making the largest triangle with
+    # the one kept before it and the next bucket's average
+    n = len(x)
+    if points <= 0 or n <= points or points < 3:
+        return None
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    counts = np.diff(np.append(edges, n))
+    avgX = np.add.reduceat(x, edges) / counts
+    avgY = np.add.reduceat(y, edges) / counts
+    keep = np.empty(points, dtype=np.int64)
+    keep[0] = a = 0
+    keep[-1] = n - 1
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - avgX[i + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avgY[i + 1] - y[a]))
+        # NaN areas (undefined percentages) never win:
+        a = lo + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        keep[i + 1] = a
+    return keep
+
+
+def minMaxRows(columns, points):
+    # Indices of the rows to keep, at most points of them: the first and last, and in each bucket of
+    # rows those holding each column's min and max, so peaks of step-shaped series survive exactly
+    n = len(columns[0])
+    if points <= 0 or n <= points:
+        return None
+    bucketCount = max(1, (points - 2) // (2 * len(columns)))
+    bucket = np.arange(n) * bucketCount // n
+    starts = np.searchsorted(bucket, np.arange(bucketCount))
+    ends = np.append(starts[1:], n) - 1
+    keep = [np.array([0, n - 1])]
+    for c in columns:
+        # Sorted by value within each bucket:
+        order = np.lexsort((np.asarray(c), bucket))
+        keep.append(order[starts])
+        keep.append(order[ends])
+    return np.unique(np.concatenate(keep))
+
+
+def clusterRows(fmt, t, delta, rowNodes, nodeCount, points=0):
+    # Chart rows of the running sum of delta over all rows, then over each node's rows; past points rows,
+    # each of these columns keeps its share of the rows holding bucket mins and maxes
+    def column(node):
+        if node is None:
+            values = np.cumsum(delta)
+        else:
+            values = np.cumsum(np.where(rowNodes == node, delta, 0))
+        # Sums of floats that went back to nothing are 0, not -0.00:
+        return np.round(values, 6) + 0
+    nodes = [None] + list(range(nodeCount))
+    keep = None
+    if 0 < points < len(t):
+        share = max(1, points // len(nodes))
+        keep = np.unique(np.concatenate([minMaxRows([column(node)], share) for node in nodes]))
+    if keep is None:
+        return chartRows(fmt, t, *[column(node) for node in nodes])
+    return chartRows(fmt, np.asarray(t)[keep], *[column(node)[keep] for node in nodes])
+
+
+def runningMergeStates(merges):
+    # (t, RunningMerges) before and after each merge starts or ends, in log order; the RunningMerges is
+    # updated in place
+    events = pd.DataFrame({'seq': np.concatenate([merges['seq'], merges['endSeq']]),
+                           'isEnd': np.repeat([False, True], len(merges)),
+                           't': np.concatenate([merges['t'], merges['endT']]),
+                           'merge': np.tile(np.arange(len(merges)), 2),
+                           'mb': np.tile(merges['mb'].to_numpy(), 2)})
+    events = events.sort_values(['seq', 'isEnd'], kind='stable')
+    running = RunningMerges()
+    for isEnd, t, merge, mb in zip(events['isEnd'].tolist(), events['t'].tolist(), events['merge'].tolist(),
+                                   events['mb'].tolist()):
+        yield t, running
+        if isEnd:
+            running.end(merge)
+        else:
+            running.start(merge, mb)
+        yield t, running
+
+
+def runningMergeRows(merges, width, points=0):
+    # The running merges chart: each merge's size in a column of its own while it runs, before and
+    # after each merge starts or ends; a finished merge's column is reused.  Past points rows, each
+    # bucket of rows keeps its first and last and those holding each column's min and max.
+    rowCount = 4 * len(merges)
+    decimate = 0 < points < rowCount
+    if decimate:
+        bucketSize = -(-rowCount // max(1, points // (2 * width + 2)))
+    else:
+        bucketSize = ROWS_PER_WRITE
+    rows = []
+    sizes = []
+    for t, running in runningMergeStates(merges):
+        rows.append('%d%s\\n' % (t, running.sizes(width)))
+        if decimate:
+            sizes.append(running.values(width))
+        if len(rows) >= bucketSize:
+            yield bucketRows(rows, sizes) if decimate else ''.join(rows)
+            rows = []
+            sizes = []
+    yield bucketRows(rows, sizes) if decimate and rows else ''.join(rows)
+
+
+def bucketRows(rows, sizes):
+    # The bucket's first and last rows and those holding each column's min and max
+    sizes = np.array(sizes)
+    keep = np.unique(np.concatenate([[0, len(rows) - 1], sizes.argmin(axis=0), sizes.argmax(axis=0)]))
+    return ''.join([rows[i] for i in keep.tolist()])
+
+
+class RunningMerges:
+    # Chart column and size of each merge in flight; a finished merge's column is reused
+
+    def __init__(self):
+        self.merges = {}
+        self.freeIds = []
+        self.idCount = 0
+
+    def start(self, key, mergeMB):
+        if len(self.freeIds) > 0:
+            id = heapq.heappop(self.freeIds)
+        else:
+            id = self.idCount
+            self.idCount += 1
+        self.merges[key] = id, mergeMB
+
+    def end(self, key):
+        heapq.heappush(self.freeIds, self.merges.pop(key)[0])
+
+    def sizes(self, width):
+        l = ['0'] * width
+        for id, size in self.merges.values():
+            l[id] = '%.3f' % (size / 1024.)
+        return ''.join([',' + x for x in l])
+
+    def values(self, width):
+        l = [0.0] * width
+        for id, size in self.merges.values():
+            l[id] = size
+        return l
+
+
+# Upper bound (MB) and name of each size class merges are grouped by
+SIZE_CLASSES = ((1., '<1 MB'), (10., '1-10 MB'), (100., '10-100 MB'), (1024., '100 MB-1 GB'),
+                (10 * 1024., '1-10 GB'), (math.inf, '10+ GB'))
+
+
+def mergeCosts(merges):
+    # The finished merges with their seconds, merged MB per second (NaN when the log shows no time
+    # passing) and index into SIZE_CLASSES
+    sec = (merges['endT'] - merges['t']).to_numpy() / 1000.
+    mb = merges['mb'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mbPerSec = np.where(sec > 0, mb / sec, np.nan)
+    return merges.assign(sec=sec, mbPerSec=mbPerSec,
+                         sizeClass=np.searchsorted([bound for bound, name in SIZE_CLASSES], mb, side='right'))
+
+
+def writeAmpRows(flushSizes, merges):
+    # Times of each flush and merge end in log order, with the MB flushed and merged so far
+    seq = np.concatenate([flushSizes['seq'], merges['endSeq']])
+    order = np.argsort(seq, kind='stable')
+    t = np.concatenate([flushSizes['t'], merges['endT']])[order]
+    flushedMB = np.cumsum(np.concatenate([flushSizes['mb'], np.zeros(len(merges))])[order])
+    mergedMB = np.cumsum(np.concatenate([np.zeros(len(flushSizes)), merges['mb']])[order])
+    return t, flushedMB, mergedMB
+
+
+def stallWindows(stalls):
+    # (shard, t, endT) of each indexing stall the merge scheduler reported
+    windows = pd.DataFrame({'shard': stalls['shard'], 't': stalls['t'] - stalls['msec'], 'endT': stalls['t']})
+    return windows.sort_values('t', kind='stable', ignore_index=True)
+
+
+def saturatedWindows(merges, limit):
+    # (shard, t, endT) of each stretch a shard had limit or more finished merges running, when a merge
+    # scheduler with limit threads has none free and further merges queue up behind them
+    events = pd.DataFrame({'seq': np.concatenate([merges['seq'], merges['endSeq']]),
+                           't': np.concatenate([merges['t'], merges['endT']]),
+                           'shard': np.tile(merges['shard'].to_numpy(), 2),
+                           'step': np.repeat([1, -1], len(merges))})
+    events = events.sort_values('seq', kind='stable', ignore_index=True)
+    atLimit = events.groupby('shard')['step'].cumsum() >= limit
+    wasAtLimit = atLimit.groupby(events['shard']).shift(1, fill_value=False).astype(bool)
+    # Every merge here ends, so each shard's windows close in the order they open:
+    starts = events[atLimit & ~wasAtLimit].sort_values(['shard', 'seq'], kind='stable')
+    ends = events[~atLimit & wasAtLimit].sort_values(['shard', 'seq'], kind='stable')
+    windows = pd.DataFrame({'shard': starts['shard'].to_numpy(), 't': starts['t'].to_numpy(),
+                            'endT': ends['t'].to_numpy()})
+    return windows.sort_values('t', kind='stable', ignore_index=True)
+
+
+def windowCounts(windows):
+    # Times each window opens or closes, with how many are open after it
+    t = np.concatenate([windows['t'], windows['endT']])
+    order = np.argsort(t, kind='stable')
+    return t[order], np.cumsum(np.repeat([1, -1], len(windows))[order])
+
+
+def windowList(windows, shards):
+    windowSec = (windows['endT'] - windows['t']) / 1000.
+    return [{'shard': ':'.join(shards[shard]), 't': t, 'endT': endT, 'sec': sec}
+            for shard, t, endT, sec in zip(windows['shard'].tolist(), windows['t'].tolist(),
+                                           windows['endT'].tolist(), windowSec.tolist())]
+
+
+def percentiles(values):
+    # Summary of the values that are not NaN, or None without any
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return None
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'min': float(values.min()), 'p50': float(p50), 'p90': float(p90), 'p99': float(p99),
+            'max': float(values.max()), 'mean': float(values.mean())}
+
+
+def mergeSummary(costs, flushSizes, stalled, saturated, limit, shards):
+    # What the merges cost, as written to SUMMARY_FILE
+    flushedMB = float(flushSizes['mb'].sum()) if len(flushSizes) > 0 else None
+    mergedMB = float(costs['mb'].sum())
+    sizeClasses = []
+    for i, group in costs.groupby('sizeClass'):
+        sizeClasses.append({'sizeClass': SIZE_CLASSES[i][1],
+                            'count': len(group),
+                            'mb': float(group['mb'].sum()),
+                            'sec': float(group['sec'].sum()),
+                            'mbPerSec': percentiles(group['mbPerSec'].to_numpy())})
+    return {'flushedMB': flushedMB,
+            'mergedMB': mergedMB,
+            'writeAmplification': mergedMB / flushedMB if flushedMB else None,
+            'mergeCount': len(costs),
+            'mergeSec': percentiles(costs['sec'].to_numpy()),
+            'mergeMBPerSec': percentiles(costs['mbPerSec'].to_numpy()),
+            'sizeClasses': sizeClasses,
+            'stallSec': float((stalled['endT'] - stalled['t']).sum() / 1000.),
+            'stalls': windowList(stalled, shards),
+            'mergeThreadLimit': limit,
+            'saturatedSec': None if saturated is None else float((saturated['endT'] - saturated['t']).sum() / 1000.),
+            'saturated': None if saturated is None else windowList(saturated, shards)}
+
+
+# Seconds between -follow updates
+FOLLOW_SECONDS = 5.0
+# Where -follow and -external write each chart's rows, next to iw.html
+DATA_DIR = 'iw-data'
+# Where main() writes what the merges cost, next to iw.html
+SUMMARY_FILE = 'iw-summary.json'
+
+
+class LiveWindow:
+    # windowStarts() of times given one at a time
 
+    def __init__(self, windowTime):
+        self.windowTime = windowTime
+        self.maxTimes = array.array('d')
+
+    def add(self, t):
+        if len(self.maxTimes) > 0 and self.maxTimes[-1] > t:
+            t = self.maxTimes[-1]
+        self.maxTimes.append(t)
+        return bisect.bisect_left(self.maxTimes, t - self.windowTime)
+
+
+class LiveChart:
+    # One chart's rows in the CSV file the -follow page loads, appended to as they come in
+
+    def __init__(self, dataDir, idName, title, headers, firstRow):
+        self.idName = idName
+        self.title = title
+        self.path = os.path.join(dataDir, '%s.csv' % idName)
+        self.width = len(headers) - 1
+        self.rows = []
+        with open(self.path, 'w') as f:
+            f.write('%s\n' % ','.join(headers))
+            if firstRow is not None:
+                f.write('%s\n' % firstRow)
+
+    def add(self, row):
+        self.rows.append(row)
+
+    def widen(self, headers):
+        # Adds zero columns to the rows written so far, so they match the new headers
+        self.flush()
+        extra = ',0' * (len(headers) - 1 - self.width)
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        with open(self.path + '.tmp', 'w') as f:
+            f.write('%s\n' % ','.join(headers))
+            f.write(''.join(['%s%s\n' % (line, extra) for line in lines[1:]]))
+        os.replace(self.path + '.tmp', self.path)
+        self.width = len(headers) - 1
+
+    def flush(self):
+        count = len(self.rows)
+        if count > 0:
+            with open(self.path, 'a') as f:
+                f.write(''.join(self.rows))
+            self.rows = []
+        return count
+
+
+class LiveCharts:
+    # The charts -follow keeps up to date from a TableReader: each update charts only the table rows
+    # added since the last one.  Rows of events that finish out of order wait until every event that
+    # started before them has finished, so each file is in log order, as the batch charts are.
+
+    def __init__(self, reader, dataDir):
+        os.makedirs(dataDir, exist_ok=True)
+        self.minTime = reader.minTime
+        startTime = '%d' % self.minTime
+        self.charts = {}
+        for idName, title, headers, firstRow in (
+                ('indexedDocs60Sec', 'Indexed K docs per sec, avg over past 10 seconds', ['Date', 'KDocsPerSec'],
+                 None),
+                ('segCounts', 'Seg counts', ['Date', 'SegCount', 'MergingSegCount'], '%s,0,0' % startTime),
+                ('segsFullFlush', 'Segments per full flush (client concurrency)', ['Date', 'SegsFullFlush'],
+                 '%s,0' % startTime),
+                ('mergingGB', 'Total Merging GB', ['Date', 'MergingGB'], '%s,%.2f' % (startTime, 0.0)),
+                ('runningMerges', 'Running Merges (GB)', ['Date', 'Merge0'], '%s,0' % startTime),
+                ('runningMergeCount', 'Running Merge Count', ['Date', 'MergeCount'], '%s,0' % startTime),
+                ('indexSizeGB', 'Index Size GB', ['Date', 'IndexSizeGB'], '%s,%.2f' % (startTime, 0.0)),
+                ('pctDel', 'Percent deleted docs', ['Date', 'Deletes %'], '%s,%.2f' % (startTime, 0.0)),
+                ('refreshTimes', 'Time (msec) to refresh', ['Date', 'RefreshMS'], '%s,0' % startTime),
+                ('refreshRate', 'Refreshes in past 10 sec', ['Date', 'RefreshRate'], '%s,0' % startTime),
+                ('commitTime', 'Time (sec) to commit', ['Date', 'CommitSec'], '%s,0.0' % startTime),
+                ('commitRate', 'Commits in past 60 sec', ['Date', 'CommitRate'], '%s,0' % startTime)):
+            self.charts[idName] = LiveChart(dataDir, idName, title, headers, firstRow)
+
+        # Rows of each table already charted:
+        self.done = dict((name, 0) for name in TABLE_COLUMNS)
+        self.docsWindow = LiveWindow(30.0)
+        self.refreshWindow = LiveWindow(10000)
+        self.commitWindow = LiveWindow(60000)
+        self.refreshFirst = 0
+        # Heaps of (seq, ...) rows waiting for the events started before them:
+        self.segCounts = []
+        self.commits = []
+        self.mergeEvents = []
+        self.running = RunningMerges()
+        self.runningCount = 0
+
+    def newRows(self, reader, name):
+        table = reader.tables[name]
+        start = self.done[name]
+        self.done[name] = len(table)
+        return enumerate(table.rows(start), start)
+
+    def update(self, reader):
+        # Appends the new rows to the chart files; returns how many
+        charts = self.charts
+        tables = reader.tables
+
+        secs = tables['indexedDocs'].column('sec')
+        docCounts = tables['indexedDocs'].column('docs')
+        for i, (sec, docs) in self.newRows(reader, 'indexedDocs'):
+            first = self.docsWindow.add(sec)
+            if i - first + 1 > 5:
+                windowSec = sec - secs[first] if first > 0 else sec
+                charts['indexedDocs60Sec'].add('%d,%.2f\n' % (self.minTime + sec * 1000.,
+                                                              np.float64(docs - docCounts[first]) / 1000. / windowSec))
+
+        for i, row in self.newRows(reader, 'segCounts'):
+            heapq.heappush(self.segCounts, row)
+        upto = min([l[0] for l in reader.pendingSegCounts.values()], default=math.inf)
+        while self.segCounts and self.segCounts[0][0] < upto:
+            seq, t, shard, segCount, mergeMB, mergeSegCount, indexMB, indexDocs, delDocs, endSeq = \
+                heapq.heappop(self.segCounts)
+            charts['segCounts'].add('%d,%d,%d\n' % (t, segCount, mergeSegCount))
+            charts['mergingGB'].add('%d,%.2f\n' % (t, mergeMB / 1024.))
+            charts['indexSizeGB'].add('%d,%.2f\n' % (t, indexMB / 1024.))
+            charts['pctDel'].add('%d,%.2f\n' % (t, np.float64(100. * delDocs) / indexDocs))
+
+        # Segments flushed between full flushes (a flush on the full flush's own line counts):
+        flushSeqs = tables['flushes'].column('seq')
+        fullFlushSeqs = tables['fullFlushes'].column('seq')
+        fullFlushTimes = tables['fullFlushes'].column('t')
+        for i, (seq, t) in self.newRows(reader, 'fullFlushes'):
+            if i > 0:
+                count = bisect.bisect_right(flushSeqs, seq) - bisect.bisect_right(flushSeqs, fullFlushSeqs[i - 1])
+                charts['segsFullFlush'].add('%d,%d\n' % (fullFlushTimes[i - 1], count))
+
+        for i, (seq, t, endSeq, endT, mb, shard) in self.newRows(reader, 'merges'):
+            heapq.heappush(self.mergeEvents, (seq, False, i, t, mb))
+            heapq.heappush(self.mergeEvents, (endSeq, True, i, endT, mb))
+        upto = min([seq for seq, t in reader.mergeThreads.values()], default=math.inf)
+        running = self.running
+        runningMerges = charts['runningMerges']
+        while self.mergeEvents and self.mergeEvents[0][0] < upto:
+            seq, isEnd, merge, t, mb = heapq.heappop(self.mergeEvents)
+            runningMerges.add('%d%s\n' % (t, running.sizes(runningMerges.width)))
+            if isEnd:
+                running.end(merge)
+                self.runningCount -= 1
+            else:
+                running.start(merge, mb)
+                self.runningCount += 1
+                if running.idCount > runningMerges.width:
+                    runningMerges.widen(['Date'] + ['Merge%s' % x for x in range(running.idCount)])
+            runningMerges.add('%d%s\n' % (t, running.sizes(runningMerges.width)))
+            charts['runningMergeCount'].add('%d,%d\n' % (t, self.runningCount))
+
+        refreshTimes = tables['refreshes'].column('t')
+        for i, (t, msec) in self.newRows(reader, 'refreshes'):
+            charts['refreshTimes'].add('%d,%d\n' % (t, msec))
+            # Refreshes in the past 10 seconds, charted at the window's start before it slides:
+            first = self.refreshWindow.add(t)
+            charts['refreshRate'].add('%d,%d\n' % (refreshTimes[self.refreshFirst], i - first + 1))
+            self.refreshFirst = first
+
+        for i, row in self.newRows(reader, 'commits'):
+            heapq.heappush(self.commits, row)
+        upto = min([seq for seq, t in reader.runningCommits.values()], default=math.inf)
+        while self.commits and self.commits[0][0] < upto:
+            seq, t, endT = heapq.heappop(self.commits)
+            charts['commitTime'].add('%d,%g\n' % (t, (endT - t) / 1000.))
+
+        for i, (seq, t) in self.newRows(reader, 'commitStarts'):
+            charts['commitRate'].add('%d,%d\n' % (t, i - self.commitWindow.add(t) + 1))
+
+        return sum(chart.flush() for chart in charts.values())
+
+
+def writeLivePage(charts, dataDir):
+    # iw.html for -follow: each chart loads its rows from its data file, again every FOLLOW_SECONDS
     with open('iw.html', 'w') as f:
 
         w = f.write
@@ -266,283 +993,339 @@ def main():
     <head>
     <script type="text/javascript"
       src="http://dygraphs.com/1.0.1/dygraph-combined.js"></script>
+    <script type="text/javascript">
+      var liveCharts = [];
+    </script>
     </head>
     <body>
     ''')
 
         w('<table>')
 
-        if len(indexDocTimes) > 10:
-            startChart(w, 'indexedDocs60Sec', 'Indexed K docs per sec, avg over past 10 seconds')
-
-            # Index rate past 30 seconds
-            headers = ['Date', 'KDocsPerSec']
-            w('    "%s\\n" + \n"' % ','.join(headers))
-
-            r = RollingTimeWindow(30.0)
-
-            for docCount, t in indexDocTimes:
-                # print('%d, %.2f' % (docCount, t))
-                r.add(t, docCount)
-                if len(r.window) > 5:
-                    t0 = globalStartTime + datetime.timedelta(seconds=t)
-                    if r.pruned:
-                        windowTime = r.window[-1][0] - r.window[0][0]
-                    else:
-                        windowTime = r.window[-1][0]
-                    docCount = r.window[-1][1] - r.window[0][1]
-                    # print('count %s, win time %s' % (docCount, windowTime))
-                    w('%s:%02.3f,%.2f\\n' % (
-                    formatTime(t0.year, t0.month, t0.day, t0.hour, t0.minute, t0.second + t0.microsecond / 1000000.),
-                    docCount / 1000. / windowTime))
-
+        for chart in charts.values():
+            url = '%s/%s.csv' % (dataDir, chart.idName)
+            startChart(w, chart.idName, chart.title)
+            w('    "%s' % url)
             endChart(w)
+            w('<script type="text/javascript">liveCharts.push([g, "%s"]);</script>' % url)
 
-        # Segment counts
-        startChart(w, 'segCounts', 'Seg counts')
-
-        headers = ['Date', 'SegCount', 'MergingSegCount']
-        w('    "%s\\n" + \n"' % ','.join(headers))
-
-        w('%s,0,0\\n' % (formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5])))
-        for tup in segCounts:
-            if len(tup) >= 9:
-                year, month, day, hr, min, sec, count, mergeMB, mergeSegCount = tup[:9]
-                w('%s,%d,%d\\n' % (formatTime(year, month, day, hr, min, sec), count, mergeSegCount))
-
-        endChart(w)
-
-        # Segs per full flush
-        startChart(w, 'segsFullFlush', 'Segments per full flush (client concurrency)')
-
-        headers = ['Date', 'SegsFullFlush']
-        w('    "%s\\n" + \n"' % ','.join(headers))
-
-        w('%s,0\\n' % formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5]))
-        for tup in segsPerFullFlush:
-            year, month, day, hr, min, sec, count = tup
-            w('%s,%d\\n' % (formatTime(year, month, day, hr, min, sec), count))
-
-        endChart(w)
-
-        # Merging GB
-        startChart(w, 'mergingGB', 'Total Merging GB')
-
-        headers = ['Date', 'MergingGB']
-        w('    "%s\\n" + \n"' % ','.join(headers))
-
-        w('%s,%.2f\\n' % (formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5]), 0.0))
-        for tup in segCounts:
-            if len(tup) >= 8:
-                year, month, day, hr, min, sec, count, mergeMB = tup[:8]
-                # print("mergeMB %s" % mergeMB)
-                w('%s,%.2f\\n' % (formatTime(year, month, day, hr, min, sec), mergeMB / 1024.))
-
-        endChart(w)
-
-        # Running merges
-        startChart(w, 'runningMerges', 'Running Merges (GB)')
-
-        headers = ['Date'] + ['Merge%s' % x for x in range(maxRunningMerges)]
-        w('    "%s\\n" + \n"' % ','.join(headers))
-
-        # Thread name -> id, size
-        runningMerges = {}
-
-        w('%s,%s\\n' % (formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5]),
-                        ','.join(['0'] * maxRunningMerges)))
-        ids = set(range(maxRunningMerges))
-        for tup in merges:
-            if len(tup) == 9:
-                event, key, year, month, day, hr, min, sec, mergeMB = tup
-                # if mergeMB > 0:
-                #  mergeMB = math.log(mergeMB)/math.log(2.0)
-
-                l = ['0'] * maxRunningMerges
-                for ign, (id, size) in runningMerges.items():
-                    l[id] = '%.3f' % (size / 1024.)
-                w('%s,%s\\n' % (formatTime(year, month, day, hr, min, sec), ','.join(l)))
-
-                if event == 'end':
-                    ids.add(runningMerges[key][0])
-                    del runningMerges[key]
-                else:
-                    id = ids.pop()
-                    runningMerges[key] = id, mergeMB
-
-                l = ['0'] * maxRunningMerges
-                for ign, (id, size) in runningMerges.items():
-                    l[id] = '%.3f' % (size / 1024.)
-                w('%s,%s\\n' % (formatTime(year, month, day, hr, min, sec), ','.join(l)))
-
-        endChart(w)
-
-        # Running merges
-        startChart(w, 'runningMergeCount', 'Running Merge Count')
-
-        headers = ['Date'] + ['MergeCount']
-        w('    "%s\\n" + \n"' % ','.join(headers))
-
-        # Thread name -> id, size
-        runningMerges = {}
-
-        w('%s,0\\n' % formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5]))
-        mergeCount = 0
-        for tup in merges:
-            if len(tup) == 9:
-                event, key, year, month, day, hr, min, sec, mergeMB = tup
-                if event == 'start':
-                    mergeCount += 1
-                elif event == 'end':
-                    mergeCount -= 1
-                else:
-                    raise RuntimeError()
-
-                w('%s,%d\\n' % (formatTime(year, month, day, hr, min, sec), mergeCount))
-
-        endChart(w)
-
-        # Index size GB
-        startChart(w, 'indexSizeGB', 'Index Size GB')
-
-        headers = ['Date', 'IndexSizeGB']
-        w('    "%s\\n" + \n"' % ','.join(headers))
-
-        w('%s,%.2f\\n' % (formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5]), 0.0))
-        for tup in segCounts:
-            if len(tup) >= 10:
-                year, month, day, hr, min, sec, count, mergeMB, mergingSegCount, indexSizeMB = tup[:10]
-                w('%s,%.2f\\n' % (formatTime(year, month, day, hr, min, sec), indexSizeMB / 1024.))
-
-        endChart(w)
-
-        # Pct deletes
-        startChart(w, 'pctDel', 'Percent deleted docs')
-
-        headers = ['Date', 'Deletes %']
-        w('    "%s\\n" + \n"' % ','.join(headers))
-
-        w('%s,%.2f\\n' % (formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5]), 0.0))
-        for tup in segCounts:
-            if len(tup) >= 12:
-                year, month, day, hr, min, sec, count, mergeMB, mergingSegCount, indexSizeMB, indexDocCount, deleteDocCount = tup[
-                                                                                                                              :12]
-                w('%s,%.2f\\n' % (formatTime(year, month, day, hr, min, sec), (100. * deleteDocCount) / indexDocCount))
-
-        endChart(w)
-
-        if False:
-            # Running merge count
-            startChart(w, 'runningMergeCount', 'Segments being merged')
-
-            headers = ['Date'] + ['MergeCount']
-            w('    "%s\\n" + \n"' % ','.join(headers))
-
-            w('%s,0\\n' % formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5]))
-            ids = set(range(maxRunningMerges))
-            for tup in segCounts:
-                if len(tup) >= 9:
-                    year, month, day, hr, min, sec, count, mergeMB, mergingSegCount = tup[:9]
-                    w('%s,%d\\n' % (formatTime(year, month, day, hr, min, sec), mergingSegCount))
-
-            endChart(w)
-
-        if False:
-            # Index size Docs
-            startChart(w, 'indexSizeMDocs', 'Index Size MDocs')
-
-            headers = ['Date', 'IndexSizeMDocs']
-            w('    "%s\\n" + \n"' % ','.join(headers))
-
-            for tup in segCounts:
-                if len(tup) >= 11:
-                    year, month, day, hr, min, sec, count, mergeMB, mergingSegCount, indexSizeMB, indexSizeDocs = tup[
-                                                                                                                  :11]
-                    w('%s,%.2f\\n' % (formatTime(year, month, day, hr, min, sec), indexSizeDocs / 1000000.0))
-            endChart(w)
-
-        # Refresh times
-        startChart(w, 'refreshTimes', 'Time (msec) to refresh')
-
-        headers = ['Date', 'RefreshMS']
-        w('    "%s\\n" + \n"' % ','.join(headers))
-
-        w('%s,0\\n' % formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5]))
-        for tup in getReaderTimes:
-            year, month, day, hr, min, sec, ms = tup
-            w('%s,%d\\n' % (formatTime(year, month, day, hr, min, sec), ms))
-
-        endChart(w)
-
-        if len(getReaderTimes) != 0:
-            startChart(w, 'refreshRate', 'Refreshes in past 10 sec')
-
-            headers = ['Date', 'RefreshRate']
-            w('    "%s\\n" + \n"' % ','.join(headers))
-
-            w('%s,0\\n' % formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5]))
-
-            startIndex = 0
-            l = getReaderTimes[0]
-            startTime = toDateTime(l[:-1])
-
-            for i, tup in enumerate(getReaderTimes):
-                t = toDateTime(tup[:-1])
-                year, month, day, hr, min, sec = l[:-1]
-                ms = tup[-1]
-                # Rolling window of past 10 seconds:
-                while t - startTime > TEN_SEC:
-                    startIndex += 1
-                    l = getReaderTimes[startIndex]
-                    startTime = toDateTime(l[:-1])
+        w('</table>')
 
-                w('%s,%d\\n' % (formatTime(year, month, day, hr, min, sec), i - startIndex + 1))
+        w('''
+    <script type="text/javascript">
+      setInterval(function() {
+        for (var i = 0; i < liveCharts.length; i++) {
+          liveCharts[i][0].updateOptions({file: liveCharts[i][1] + '?' + new Date().getTime()});
+        }
+      }, %d);
+    </script>
+    </body>
+    </html>
+    ''' % (FOLLOW_SECONDS * 1000))
+
+
+def follow(path, onlyShard, jobs):
+    # Charts what the log says so far, then keeps appending what it says next, until interrupted
+    end = logReader.completeEnd(path)
+    reader = TableReader(onlyShard)
+    for records in logReader.mapChunks(path, chunkRecords, jobs, end=end):
+        reader.add(records)
+
+    live = None
+    for data in itertools.chain([b''], logReader.followLog(path, end, FOLLOW_SECONDS)):
+        if len(data) > 0:
+            reader.add(bufferRecords(data, 0, len(data)))
+        if live is None:
+            if reader.minTime is None:
+                continue
+            live = LiveCharts(reader, DATA_DIR)
+            writeLivePage(live.charts, DATA_DIR)
+            print('following %s; serve this directory over HTTP (python3 -m http.server) to view iw.html' % path)
+        count = live.update(reader)
+        print('%s: %d new chart rows' % (logTime.toDateTime(reader.maxTime), count))
 
-            endChart(w)
 
-        # Commit times
-        startChart(w, 'commitTime', 'Time (sec) to commit')
+def main():
+    i = 1
+    onlyShard = None
+    timeFrom = None
+    timeTo = None
+    while i < len(sys.argv):
+        if sys.argv[i] == '-shard':
+            onlyShard = tuple(sys.argv[i + 1].split(':'))
+            del sys.argv[i:i + 2]
+        elif sys.argv[i] == '-from':
+            # YYYY-MM-DD HH:MM:SS[,mmm]
+            timeFrom = logTime.stampMillis(sys.argv[i + 1])
+            del sys.argv[i:i + 2]
+        elif sys.argv[i] == '-to':
+            timeTo = logTime.stampMillis(sys.argv[i + 1])
+            del sys.argv[i:i + 2]
+        else:
+            i += 1
 
-        headers = ['Date', 'CommitSec']
-        w('    "%s\\n" + \n"' % ','.join(headers))
-        w('%s,0.0\\n' % formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5]))
+    useCache = '-nocache' not in sys.argv
+    if not useCache:
+        sys.argv.remove('-nocache')
+
+    # Processes parsing chunks of the log:
+    jobs = os.cpu_count()
+    if '-jobs' in sys.argv:
+        i = sys.argv.index('-jobs')
+        jobs = int(sys.argv[i + 1])
+        del sys.argv[i:i + 2]
+
+    # Rows kept per chart:
+    points = CHART_POINTS
+    if '-points' in sys.argv:
+        i = sys.argv.index('-points')
+        points = int(sys.argv[i + 1])
+        del sys.argv[i:i + 2]
+
+    # Merges a shard runs at once before more queue up, to find when all its merge threads were busy:
+    mergeThreadLimit = None
+    if '-mergeThreads' in sys.argv:
+        i = sys.argv.index('-mergeThreads')
+        mergeThreadLimit = int(sys.argv[i + 1])
+        del sys.argv[i:i + 2]
+
+    # Chart rows in files of their own, loaded by a page that needs no other script:
+    dataDir = None
+    if '-external' in sys.argv:
+        sys.argv.remove('-external')
+        dataDir = DATA_DIR
+        os.makedirs(dataDir, exist_ok=True)
 
-        for i, tup in enumerate(commitTimes):
-            if len(tup) == 7:
-                # print("tup %s" % str(tup))
-                year, month, day, hr, min, sec, (endYear, endMonth, endDay, endHr, endMin, endSec) = tup
-                t0 = toDateTime(tup[:6])
-                t1 = toDateTime(tup[-1])
-                commitSec = (t1 - t0).total_seconds()
-                # print('commitSec %s; %s %s' % (commitSec, t0, t1))
-                w('%s,%g\\n' % (formatTime(year, month, day, hr, min, sec), commitSec))
+    if onlyShard is not None:
+        print('only: %s' % ':'.join(onlyShard))
 
-        endChart(w)
+    if '-follow' in sys.argv:
+        sys.argv.remove('-follow')
+        follow(sys.argv[1], onlyShard, jobs)
+        return
+
+    # Logs (and the files each was rotated to) or globs of them, from one or more nodes:
+    logSets = logReader.findLogSets(sys.argv[1:])
+    if len(logSets) > 1:
+        print('merging %d logs' % len(logSets))
+    tables, minTime, maxTime, shards = readTables(logRecords(logSets, useCache, jobs, timeFrom, timeTo), onlyShard)
+
+    segCounts = tables['segCounts']
+    merges = tables['merges']
+    commits = tables['commits']
+    commitStarts = tables['commitStarts']
+    flushes = tables['flushes']
+    flushSizes = tables['flushSizes']
+    stalls = tables['stalls']
+    fullFlushes = tables['fullFlushes']
+    refreshes = tables['refreshes']
+    indexedDocs = tables['indexedDocs']
+
+    # Merges running, counting every start (even those restarted or never finished) and every end:
+    starts = tables['mergeStarts']['seq'].to_numpy()
+    ends = merges['endSeq'].to_numpy()
+    order = np.lexsort((np.repeat([0, 1], [len(starts), len(ends)]), np.concatenate([starts, ends])))
+    maxRunningMerges = int(np.cumsum(np.repeat([1, -1], [len(starts), len(ends)])[order]).max(initial=0))
+
+    # Last index size seen for each shard:
+    allShards = {}
+    if len(segCounts) > 0:
+        last = segCounts.loc[segCounts.groupby('shard')['endSeq'].idxmax()]
+        for shard, mb in zip(last['shard'].tolist(), last['indexMB'].tolist()):
+            allShards[shards[shard]] = mb
+
+    commitCount = len(commitStarts)
+    flushCount = len(flushes)
+    globalStartTime = logTime.toDateTime(minTime)
+    globalEndTime = logTime.toDateTime(maxTime)
+    totSec = (maxTime - minTime) / 1000.
+    print('elapsed time %s: %s - %s' % (globalEndTime - globalStartTime, globalStartTime, globalEndTime))
+    print('max concurrent merges %s' % maxRunningMerges)
+    # A -from/-to window or -shard may hold no commits or flushes:
+    if commitCount > 0:
+        print('commit count %s (avg every %.1f sec)' % \
+              (commitCount, totSec / commitCount))
+    else:
+        print('commit count 0')
+    if flushCount > 0:
+        print('flush count %s (avg every %.1f sec)' % \
+              (flushCount, totSec / flushCount))
+    else:
+        print('flush count 0')
+    print('total shard count: %s' % len(allShards))
+    l = list(allShards.items())
+    l.sort(key=lambda x: (-x[1], x[0]))
+    for tup, mb in l:
+        print('  %.3f GB: %s' % (mb / 1024., ':'.join(tup)))
 
-        # Commit rate
-        startChart(w, 'commitRate', 'Commits in past 60 sec')
+    costs = mergeCosts(merges)
+    stalled = stallWindows(stalls)
+    saturated = None if mergeThreadLimit is None else saturatedWindows(merges, mergeThreadLimit)
+    summary = mergeSummary(costs, flushSizes, stalled, saturated, mergeThreadLimit, shards)
+    if summary['writeAmplification'] is not None:
+        print('write amplification %.2fx (%.1f MB merged / %.1f MB flushed)' % \
+              (summary['writeAmplification'], summary['mergedMB'], summary['flushedMB']))
+    if summary['mergeMBPerSec'] is not None:
+        print('merge MB/sec p50 %(p50).1f p90 %(p90).1f p99 %(p99).1f' % summary['mergeMBPerSec'])
+    print('indexing stalled on merges %.1f sec, in %d stalls' % (summary['stallSec'], len(stalled)))
+    if saturated is not None:
+        print('%.1f sec with %d+ merges running on a shard, in %d windows' % \
+              (summary['saturatedSec'], mergeThreadLimit, len(saturated)))
+    with open(SUMMARY_FILE, 'w') as f:
+        json.dump(summary, f, indent=2)
 
-        headers = ['Date', 'CommitRate']
-        w('    "%s\\n" + \n"' % ','.join(headers))
-        w('%s,0\\n' % formatTime(minTime[0], minTime[1], minTime[2], minTime[3], minTime[4], minTime[5]))
+    with open('iw.html', 'w') as f:
 
-        startIndex = 0
-        l = commitTimes[0]
-        startTime = toDateTime(l[:-1])
+        w = f.write
 
-        for i, tup in enumerate(commitTimes):
-            if len(tup) >= 6:
-                year, month, day, hr, min, sec = tup[:6]
-                t = toDateTime(tup[:6])
-                # Rolling window of past 60 seconds:
-                while t - startTime > SIXTY_SEC:
-                    startIndex += 1
-                    l = commitTimes[startIndex]
-                    startTime = toDateTime(l[:6])
+        if dataDir is None:
+            w('''
+    <html>
+    <head>
+    <script type="text/javascript"
+      src="http://dygraphs.com/1.0.1/dygraph-combined.js"></script>
+    </head>
+    <body>
+    ''')
+        else:
+            w('''
+    <html>
+    <head>
+    <script type="text/javascript"
+      src="http://dygraphs.com/1.0.1/dygraph-combined.js"></script>
+    <script type="text/javascript">%s</script>
+    </head>
+    <body>
+    ''' % EXTERNAL_CHART_SCRIPT)
 
-                w('%s,%d\\n' % (formatTime(year, month, day, hr, min, sec), i - startIndex + 1))
+        w('<table>')
 
-        endChart(w)
+        startTime = '%d' % minTime
+
+        if len(indexedDocs) > 10:
+            # Docs indexed per second over the past 30 seconds, once there are more than 5; until
+            # the window first slides it is timed from 0
+            sec = indexedDocs['sec'].to_numpy()
+            docs = indexedDocs['docs'].to_numpy()
+            first = windowStarts(sec, 30.0)
+            windowSec = np.where(first > 0, sec - sec[first], sec)
+            show = np.arange(len(sec)) - first + 1 > 5
+            x = (minTime + sec * 1000.)[show]
+            y = ((docs - docs[first]) / 1000. / windowSec)[show]
+            writeChart(f, dataDir, 'indexedDocs60Sec', 'Indexed K docs per sec, avg over past 10 seconds',
+                       ['Date', 'KDocsPerSec'], None,
+                       chartRows('%d,%.2f\\n', x, y, keep=lttb(x, y, points)))
+
+        # Step-shaped series keep each bucket's min and max rows, the rest their LTTB points:
+        t = segCounts['t']
+        writeChart(f, dataDir, 'segCounts', 'Seg counts',
+                   ['Date', 'SegCount', 'MergingSegCount'], '%s,0,0' % startTime,
+                   chartRows('%d,%d,%d\\n', t, segCounts['segCount'], segCounts['mergeSegCount'],
+                             keep=minMaxRows([segCounts['segCount'], segCounts['mergeSegCount']], points)))
+
+        # Segments flushed between full flushes (a flush on the full flush's own line counts):
+        flushesSoFar = np.searchsorted(flushes['seq'], fullFlushes['seq'], side='right')
+        x = fullFlushes['t'][:-1]
+        y = np.diff(flushesSoFar)
+        writeChart(f, dataDir, 'segsFullFlush', 'Segments per full flush (client concurrency)',
+                   ['Date', 'SegsFullFlush'], '%s,0' % startTime,
+                   chartRows('%d,%d\\n', x, y, keep=lttb(x, y, points)))
+        y = segCounts['mergeMB'] / 1024.
+        writeChart(f, dataDir, 'mergingGB', 'Total Merging GB',
+                   ['Date', 'MergingGB'], '%s,%.2f' % (startTime, 0.0),
+                   chartRows('%d,%.2f\\n', t, y, keep=minMaxRows([y], points)))
+        writeChart(f, dataDir, 'runningMerges', 'Running Merges (GB)',
+                   ['Date'] + ['Merge%s' % x for x in range(maxRunningMerges)],
+                   '%s,%s' % (startTime, ','.join(['0'] * maxRunningMerges)),
+                   runningMergeRows(merges, maxRunningMerges, points))
+
+        # Finished merges running after each one starts or ends:
+        order = np.lexsort((np.repeat([0, 1], len(merges)), np.concatenate([merges['seq'], ends])))
+        y = np.cumsum(np.repeat([1, -1], len(merges))[order])
+        writeChart(f, dataDir, 'runningMergeCount', 'Running Merge Count',
+                   ['Date'] + ['MergeCount'], '%s,0' % startTime,
+                   chartRows('%d,%d\\n', np.concatenate([merges['t'], merges['endT']])[order], y,
+                             keep=minMaxRows([y], points)))
+
+        if len(flushSizes) > 0:
+            ampT, flushedMB, mergedMB = writeAmpRows(flushSizes, merges)
+            show = flushedMB > 0
+            x = ampT[show]
+            y = mergedMB[show] / flushedMB[show]
+            writeChart(f, dataDir, 'writeAmp', 'Write amplification (merged MB / flushed MB so far)',
+                       ['Date', 'WriteAmp'], '%s,0.0' % startTime,
+                       chartRows('%d,%.3f\\n', x, y, keep=lttb(x, y, points)))
+
+        # Each merge's MB/sec when it ends:
+        ended = costs.sort_values('endSeq', kind='stable')
+        ended = ended[ended['mbPerSec'].notna()]
+        x = ended['endT'].to_numpy()
+        y = ended['mbPerSec'].to_numpy()
+        writeChart(f, dataDir, 'mergeMBPerSec', 'Merge throughput (MB/sec)',
+                   ['Date', 'MBPerSec'], '%s,0.0' % startTime,
+                   chartRows('%d,%.2f\\n', x, y, keep=lttb(x, y, points)))
+
+        if len(stalled) > 0:
+            x, y = windowCounts(stalled)
+            writeChart(f, dataDir, 'stalledShards', 'Shards with indexing stalled on merges',
+                       ['Date', 'StalledShards'], '%s,0' % startTime,
+                       chartRows('%d,%d\\n', x, y, keep=minMaxRows([y], points)))
+        if saturated is not None:
+            x, y = windowCounts(saturated)
+            writeChart(f, dataDir, 'saturatedShards', 'Shards with %d+ merges running' % mergeThreadLimit,
+                       ['Date', 'SaturatedShards'], '%s,0' % startTime,
+                       chartRows('%d,%d\\n', x, y, keep=minMaxRows([y], points)))
+        y = segCounts['indexMB'] / 1024.
+        writeChart(f, dataDir, 'indexSizeGB', 'Index Size GB',
+                   ['Date', 'IndexSizeGB'], '%s,%.2f' % (startTime, 0.0),
+                   chartRows('%d,%.2f\\n', t, y, keep=lttb(t, y, points)))
+        y = (100. * segCounts['delDocs']) / segCounts['indexDocs']
+        writeChart(f, dataDir, 'pctDel', 'Percent deleted docs',
+                   ['Date', 'Deletes %'], '%s,%.2f' % (startTime, 0.0),
+                   chartRows('%d,%.2f\\n', t, y, keep=lttb(t, y, points)))
+        writeChart(f, dataDir, 'refreshTimes', 'Time (msec) to refresh',
+                   ['Date', 'RefreshMS'], '%s,0' % startTime,
+                   chartRows('%d,%d\\n', refreshes['t'], refreshes['msec'],
+                             keep=lttb(refreshes['t'], refreshes['msec'], points)))
+        if len(refreshes) != 0:
+            # Refreshes in the past 10 seconds, charted at the window's start before it slides:
+            t = refreshes['t'].to_numpy()
+            first = windowStarts(t, 10000)
+            x = t[np.concatenate([[0], first[:-1]])]
+            y = np.arange(len(t)) - first + 1
+            writeChart(f, dataDir, 'refreshRate', 'Refreshes in past 10 sec',
+                       ['Date', 'RefreshRate'], '%s,0' % startTime,
+                       chartRows('%d,%d\\n', x, y, keep=lttb(x, y, points)))
+        y = (commits['endT'] - commits['t']) / 1000.
+        writeChart(f, dataDir, 'commitTime', 'Time (sec) to commit',
+                   ['Date', 'CommitSec'], '%s,0.0' % startTime,
+                   chartRows('%d,%g\\n', commits['t'], y, keep=lttb(commits['t'], y, points)))
+        t = commitStarts['t'].to_numpy()
+        y = np.arange(len(t)) - windowStarts(t, 60000) + 1
+        writeChart(f, dataDir, 'commitRate', 'Commits in past 60 sec',
+                   ['Date', 'CommitRate'], '%s,0' % startTime,
+                   chartRows('%d,%d\\n', t, y, keep=lttb(t, y, points)))
+
+        # Cluster-wide totals with each node's share, when the logs come from several nodes:
+        nodes = sorted(set(shard[0] for shard in shards))
+        if len(nodes) > 1:
+            shardNodes = np.array([nodes.index(shard[0]) for shard in shards])
+            headers = ['Date', 'Total'] + nodes
+            firstRow = '%s%s' % (startTime, ',0' * (len(nodes) + 1))
+            rowNodes = shardNodes[segCounts['shard'].to_numpy()]
+            for idName, title, mb in (('clusterMergingGB', 'Cluster Merging GB', segCounts['mergeMB']),
+                                      ('clusterIndexSizeGB', 'Cluster Index Size GB', segCounts['indexMB'])):
+                # Each findMerges changes its shard's latest value:
+                gb = mb.to_numpy() / 1024.
+                delta = gb - pd.Series(gb).groupby(segCounts['shard']).shift(1, fill_value=0.0).to_numpy()
+                writeChart(f, dataDir, idName, title, headers, firstRow,
+                           clusterRows('%d' + ',%.2f' * (len(nodes) + 1) + '\\n', segCounts['t'], delta, rowNodes,
+                                       len(nodes), points))
+            rowNodes = shardNodes[np.concatenate([merges['shard'], merges['shard']])[order]]
+            writeChart(f, dataDir, 'clusterRunningMergeCount', 'Cluster Running Merge Count', headers, firstRow,
+                       clusterRows('%d' + ',%d' * (len(nodes) + 1) + '\\n',
+                                   np.concatenate([merges['t'], merges['endT']])[order],
+                                   np.repeat([1, -1], len(merges))[order], rowNodes, len(nodes), points))
 
         w('</table>')
 
@@ -552,10 +1335,109 @@ def main():
     ''')
 
 
+# The -external page's charts: each chart's data file is loaded once the chart scrolls into view, and
+# its Float64 columns are handed to dygraphs as rows of a native array
+EXTERNAL_CHART_SCRIPT = '''
+      function iwChartData(id, headers, data) {
+        var bytes = atob(data);
+        var buffer = new Uint8Array(bytes.length);
+        for (var i = 0; i < bytes.length; i++) {
+          buffer[i] = bytes.charCodeAt(i);
+        }
+        var values = new Float64Array(buffer.buffer);
+        var rows = values.length / headers.length;
+        var file = [];
+        for (var i = 0; i < rows; i++) {
+          var row = [];
+          for (var c = 0; c < headers.length; c++) {
+            var value = values[c * rows + i];
+            row.push(isFinite(value) ? value : null);
+          }
+          file.push(row);
+        }
+        new Dygraph(document.getElementById(id), file, {
+          labels: headers,
+          axes: {
+            x: {
+              valueFormatter: Dygraph.dateString_,
+              ticker: Dygraph.dateTicker,
+              axisLabelFormatter: function(msec) {
+              return new Date(msec).strftime('%H:%M:%S');
+              }
+            }
+          }
+        });
+      }
+
+      function iwLoad(div) {
+        if (div.getAttribute('data-loading') == null) {
+          div.setAttribute('data-loading', '1');
+          var script = document.createElement('script');
+          script.src = div.getAttribute('data-src');
+          document.body.appendChild(script);
+        }
+      }
+
+      window.addEventListener('load', function() {
+        var divs = document.querySelectorAll('div.iwChart');
+        if (!('IntersectionObserver' in window)) {
+          Array.prototype.forEach.call(divs, iwLoad);
+          return;
+        }
+        var observer = new IntersectionObserver(function(entries) {
+          entries.forEach(function(entry) {
+            if (entry.isIntersecting) {
+              iwLoad(entry.target);
+            }
+          });
+        });
+        Array.prototype.forEach.call(divs, function(div) {
+          observer.observe(div);
+        });
+      });
+'''
+
+
+def writeChart(f, dataDir, idName, title, headers, firstRow, rows):
+    w = f.write
+    if dataDir is not None:
+        writeChartData(dataDir, idName, headers, firstRow, rows)
+        startCell(w)
+        w('''
+    <br><b>%s</b>
+    <div id="%s" class="iwChart" data-src="%s/%s.js" style="width:500px; height:300px"></div>
+  </td>
+  ''' % (title, idName, dataDir, idName))
+        return
+    startChart(w, idName, title)
+    w('    "%s\\n" + \n"' % ','.join(headers))
+    if firstRow is not None:
+        w('%s\\n' % firstRow)
+    for chunk in rows:
+        w(chunk)
+    endChart(w)
+
+
+def writeChartData(dataDir, idName, headers, firstRow, rows):
+    # The chart's rows as one Float64 array, column after column, in a script of its own that the
+    # -external page loads once the chart scrolls into view.  Values are read back from the formatted
+    # rows, so both kinds of page show the same rounded numbers.
+    blocks = []
+    if firstRow is not None:
+        blocks.append(np.array([firstRow.split(',')], dtype=np.float64))
+    for chunk in rows:
+        if len(chunk) > 0:
+            blocks.append(np.loadtxt(io.StringIO(chunk.replace('\\n', '\n')), delimiter=',', ndmin=2))
+    values = np.concatenate(blocks) if blocks else np.empty((0, len(headers)))
+    data = base64.b64encode(np.ascontiguousarray(values.T, dtype='<f8').tobytes()).decode('ascii')
+    with open(os.path.join(dataDir, '%s.js' % idName), 'w') as f:
+        f.write('iwChartData(%s, %s, "%s");\n' % (json.dumps(idName), json.dumps(headers), data))
+
+
 globalChartCount = 0
 
 
-def startChart(w, idName, title):
+def startCell(w):
     global globalChartCount
     if globalChartCount % 3 == 0:
         if globalChartCount > 0:
@@ -563,6 +1445,11 @@ def startChart(w, idName, title):
         w('<tr>')
 
     w('<td>')
+    globalChartCount += 1
+
+
+def startChart(w, idName, title):
+    startCell(w)
     w('''
     <br><b>%s</b>
     <div id="%s" style="width:500px; height:300px"></div>
@@ -572,7 +1459,6 @@ def startChart(w, idName, title):
         // containing div
         document.getElementById("%s"),
     ''' % (title, idName, idName))
-    globalChartCount += 1
 
 
 def endChart(w):
@@ -595,35 +1481,5 @@ def endChart(w):
   ''')
 
 
-def toDateTime(tup):
-    usec = int((tup[5] % 1) * 1000000)
-    return datetime.datetime(year=tup[0], month=tup[1], day=tup[2],
-                             hour=tup[3], minute=tup[4],
-                             second=int(tup[5]),
-                             microsecond=usec)
-
-
-def utcShift():
-    now = time.time()
-    offset = datetime.datetime.fromtimestamp(now) - datetime.datetime.utcfromtimestamp(now)
-    return offset
-
-
-EPOCH = datetime.datetime(year=1970, month=1, day=1) + utcShift()
-
-
-def formatTime(year, month, day, hr, min, sec):
-    # return %04d-%02d-%02d %02d:%02d % (year, month, day, hr, min, int(sec)
-    usec = int((sec % 1) * 1000000)
-    t = datetime.datetime(year=year, month=month, day=day,
-                          hour=hr, minute=min,
-                          second=int(sec),
-                          microsecond=usec)
-    return int(1000.0 * (t - EPOCH).total_seconds())
-
-
-TEN_SEC = datetime.timedelta(seconds=10.0)
-SIXTY_SEC = datetime.timedelta(seconds=60.0)
-
 if __name__ == '__main__':
     main()
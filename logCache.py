@@ -0,0 +1,165 @@
+import array
+import hashlib
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+"""
+Caches what a parser extracted from one infoStream log file, so re-runs skip the regexes.
+
+The cache lives next to the log as <log>.<parser>.cache: a JSON header followed by each
+column's raw array.  The header keys it to the log's path, size, mtime and a hash of its first
+and last blocks, plus the parser's own parameters; any mismatch means the log is parsed again.
+"""
+
+MAGIC = b'IWLOGCACHE\x01'
+# Bytes hashed at each end of the log for its fingerprint
+BLOCK_SIZE = 64 * 1024
+# Column values buffered in memory, or read at once, per column
+CHUNK_SIZE = 64 * 1024
+
+
+def fingerprint(path):
+    st = os.stat(path)
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        h.update(f.read(BLOCK_SIZE))
+        if st.st_size > BLOCK_SIZE:
+            f.seek(max(BLOCK_SIZE, st.st_size - BLOCK_SIZE))
+            h.update(f.read(BLOCK_SIZE))
+    return {'path': os.path.abspath(path),
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'hash': h.hexdigest()}
+
+
+def cachePath(path, parser):
+    return '%s.%s.cache' % (path, parser)
+
+
+class ColumnSpill:
+    # One column being written; full chunks go to a temp file so memory stays bounded
+
+    def __init__(self, path, typecode):
+        self.path = path
+        self.typecode = typecode
+        self.values = array.array(typecode)
+        self.f = open(path, 'wb')
+        self.count = 0
+
+    def append(self, value):
+        self.values.append(value)
+        if len(self.values) >= CHUNK_SIZE:
+            self.spill()
+
+    def extend(self, values):
+        self.values.extend(values)
+        if len(self.values) >= CHUNK_SIZE:
+            self.spill()
+
+    def spill(self):
+        self.count += len(self.values)
+        self.values.tofile(self.f)
+        del self.values[:]
+
+    def close(self):
+        self.spill()
+        self.f.close()
+
+
+class CacheWriter:
+    # Collects a parser's columns while it reads the log, then writes the cache in one go.
+    # The fingerprint is taken first, so a log that grows meanwhile just misses next time.
+
+    def __init__(self, path, parser, params, columns):
+        self.path = path
+        self.parser = parser
+        self.params = params
+        self.key = fingerprint(path)
+        self.tempDir = tempfile.mkdtemp(prefix='logcache-')
+        self.columns = {}
+        self.names = []
+        for name, typecode in columns:
+            self.columns[name] = ColumnSpill(os.path.join(self.tempDir, name), typecode)
+            self.names.append(name)
+
+    def commit(self, meta):
+        header = {'parser': self.parser,
+                  'params': self.params,
+                  'key': self.key,
+                  'byteorder': sys.byteorder,
+                  'meta': meta,
+                  'columns': []}
+        for name in self.names:
+            column = self.columns[name]
+            column.close()
+            header['columns'].append([name, column.typecode, column.count])
+        header = json.dumps(header).encode('utf-8')
+
+        target = cachePath(self.path, self.parser)
+        try:
+            with open(target + '.tmp', 'wb') as f:
+                f.write(MAGIC)
+                f.write(struct.pack('<Q', len(header)))
+                f.write(header)
+                for name in self.names:
+                    with open(self.columns[name].path, 'rb') as g:
+                        shutil.copyfileobj(g, f)
+            os.replace(target + '.tmp', target)
+        except OSError as e:
+            print('WARNING: could not write cache %s: %s' % (target, e))
+        self.discard()
+
+    def discard(self):
+        for column in self.columns.values():
+            column.f.close()
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+
+class CacheReader:
+
+    def __init__(self, path, header, dataOffset):
+        self.path = path
+        self.meta = header['meta']
+        self.columns = {}
+        offset = dataOffset
+        for name, typecode, count in header['columns']:
+            self.columns[name] = (typecode, count, offset)
+            offset += count * array.array(typecode).itemsize
+
+    def count(self, name):
+        return self.columns[name][1]
+
+    def iterColumn(self, name):
+        # Streams one column's values, a chunk at a time
+        typecode, count, offset = self.columns[name]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while count > 0:
+                values = array.array(typecode)
+                values.fromfile(f, min(count, CHUNK_SIZE))
+                count -= len(values)
+                yield from values
+
+
+def load(path, parser, params):
+    # Returns a CacheReader when an up to date cache exists for this log, else None
+    target = cachePath(path, parser)
+    try:
+        with open(target, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            headerLength, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(headerLength).decode('utf-8'))
+    except (OSError, ValueError, struct.error):
+        return None
+
+    if header['parser'] != parser or header['params'] != params or header['byteorder'] != sys.byteorder:
+        return None
+    if header['key'] != fingerprint(path):
+        return None
+
+    return CacheReader(target, header, len(MAGIC) + 8 + headerLength)
@@ -0,0 +1,123 @@
+import bisect
+import hashlib
+import json
+import os
+
+import logReader
+
+"""
+Sparse sidecar index of an infoStream log's timestamps, so a time window anywhere in a huge log is
+found by reading a few pages instead of scanning from the start.
+
+Every INDEX_BYTES of log the index records the epoch msec of the first timestamped line at or after
+that point, the line's offset, and the offset of the last findMerges line of each shard before it.
+It lives next to the log as <log>.<parser>.index, since each tool reads timestamps its own way, and
+is extended as the log grows; a log that shrank or was replaced by another (as when rotated) is
+indexed again from scratch.
+"""
+
+# Bytes of log between index entries
+INDEX_BYTES = 16 * 1024 * 1024
+# Bytes hashed at the start of the log to recognize it
+BLOCK_SIZE = 64 * 1024
+FIND_MERGES = b': findMerges: '
+
+
+def indexPath(path, parser):
+    return '%s.%s.index' % (path, parser)
+
+
+def firstBlockHash(mm):
+    return hashlib.sha1(mm[:BLOCK_SIZE]).hexdigest()
+
+
+def shardKey(shard):
+    return '' if shard is None else ':'.join(shard)
+
+
+class LogIndex:
+
+    def __init__(self, entries):
+        # (msec, offset, {shard key: last findMerges offset before offset}), in log order
+        self.entries = entries
+        self.times = [entry[0] for entry in entries]
+
+    def bounds(self, t, size, right=False):
+        # Aligned byte range [lo, hi) holding the first line whose time is at or after t (after t with
+        # right=True), for logReader.bisectTime
+        if right:
+            i = bisect.bisect_right(self.times, t)
+        else:
+            i = bisect.bisect_left(self.times, t)
+        lo = self.entries[i - 1][1] if i > 0 else 0
+        hi = self.entries[i][1] if i < len(self.entries) else size
+        return lo, hi
+
+    def findMerges(self, pos):
+        # (offset of the entry at or before pos, {shard key: last findMerges offset before that entry})
+        i = bisect.bisect_right([entry[1] for entry in self.entries], pos)
+        if i == 0:
+            return 0, {}
+        return self.entries[i - 1][1], self.entries[i - 1][2]
+
+
+def load(path, parser, params, parseTime, parseShard):
+    # The log's index, first built or extended to cover what was appended since.  parseTime(line) is the
+    # line's epoch msec or None, parseShard(line) its shard tuple or None.
+    target = indexPath(path, parser)
+    with logReader.mappedLog(path) as mm:
+        key = {'params': params, 'hash': firstBlockHash(mm)}
+        entries = []
+        indexed = 0
+        try:
+            with open(target, 'r') as f:
+                header = json.load(f)
+            if header['key'] == key and header['size'] <= len(mm):
+                entries = [tuple(entry) for entry in header['entries']]
+                indexed = header['size']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        if indexed == len(mm):
+            return LogIndex(entries)
+
+        if indexed:
+            print('Extending index %s' % target)
+        else:
+            print('Indexing %s' % path)
+        extend(mm, entries, parseTime, parseShard)
+        try:
+            with open(target + '.tmp', 'w') as f:
+                json.dump({'key': key, 'size': len(mm), 'entries': entries}, f)
+            os.replace(target + '.tmp', target)
+        except OSError as e:
+            print('WARNING: could not write index %s: %s' % (target, e))
+        return LogIndex(entries)
+
+
+def extend(mm, entries, parseTime, parseShard):
+    # Appends entries for the marks past the last one.  A mark whose first timestamp is not written yet
+    # ends the index, to be picked up again once the log grows.
+    if entries:
+        mark, pos, shards = entries[-1][1], entries[-1][1], dict(entries[-1][2])
+    else:
+        mark, pos, shards = 0, 0, {}
+    while True:
+        if entries:
+            mark = logReader.lineStart(mm, (entries[-1][1] // INDEX_BYTES + 1) * INDEX_BYTES)
+        if mark >= len(mm):
+            return
+        found = logReader.firstLine(mm, mark, len(mm), parseTime)
+        if found is None:
+            return
+
+        # findMerges lines up to the mark:
+        i = mm.find(FIND_MERGES, pos, mark)
+        while i != -1:
+            lineStart = mm.rfind(b'\n', 0, i) + 1
+            nl = logReader.lineStart(mm, i + 1)
+            shards[shardKey(parseShard(mm[lineStart:nl]))] = lineStart
+            i = mm.find(FIND_MERGES, nl, mark)
+        pos = mark
+
+        entries.append((found[2], mark, dict(shards)))
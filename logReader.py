@@ -0,0 +1,236 @@
+import collections
+import contextlib
+import functools
+import glob
+import mmap
+import multiprocessing
+import os
+import re
+import time
+
+"""
+Reads infoStream logs in byte-range chunks aligned to line boundaries, so the stateless
+per-line parsing of one big log can be spread over a pool of processes.
+
+Logs are memory-mapped and searched as bytes: the parsers run their regexes over the mapped
+buffer itself to find the few lines that matter, and decode only the groups they capture.
+"""
+
+# Bytes of log handed to a parse worker at once
+CHUNK_BYTES = 32 * 1024 * 1024
+
+
+def chunkRanges(path, chunkBytes=CHUNK_BYTES, start=0, end=None):
+    # Chunks of the byte range [start, end) of the log, by default all of it
+    size = os.path.getsize(path)
+    if end is None or end > size:
+        end = size
+    return [(pos, min(pos + chunkBytes, end)) for pos in range(start, end, chunkBytes)]
+
+
+@contextlib.contextmanager
+def mappedLog(path):
+    # The log's bytes, memory-mapped (an empty log cannot be mapped, and is just b'')
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def lineStart(mm, pos):
+    # Start of the first line at or after pos
+    if pos <= 0:
+        return 0
+    i = mm.find(b'\n', pos - 1)
+    if i == -1:
+        return len(mm)
+    return i + 1
+
+
+def alignChunk(mm, start, end):
+    # Byte range of the lines that start within [start, end); a line straddling start belongs to the chunk before
+    return lineStart(mm, start), lineStart(mm, min(end, len(mm)))
+
+
+def iterChunkLines(path, start, end):
+    # Lines, as bytes, that start within [start, end)
+    with mappedLog(path) as mm:
+        pos, end = alignChunk(mm, start, end)
+        while pos < end:
+            nl = lineStart(mm, pos + 1)
+            yield mm[pos:nl]
+            pos = nl
+
+
+def iterKeywordLines(mm, start, end, keywords):
+    # (offset, line) of each line in the aligned range [start, end) containing any of the keywords,
+    # in log order.  Each keyword is searched for over the mapped buffer, so the other lines are never
+    # copied, let alone decoded.
+    offsets = set()
+    for keyword in keywords:
+        pos = mm.find(keyword, start, end)
+        while pos != -1:
+            i = mm.rfind(b'\n', start, pos)
+            offsets.add(start if i == -1 else i + 1)
+            pos = mm.find(keyword, lineStart(mm, pos + 1), end)
+    for offset in sorted(offsets):
+        yield offset, mm[offset:min(end, lineStart(mm, offset + 1))]
+
+
+def iterLinesWithout(mm, start, end, needle):
+    # (offset, line) of each line in the aligned range [start, end) not containing needle, found by
+    # one regex over the mapped buffer
+    if start == 0 and end > 0:
+        first = lineStart(mm, 1)
+        if mm.find(needle, 0, first) == -1:
+            yield 0, mm[0:first]
+    pattern = re.compile(b'\n(?![^\n]*' + re.escape(needle) + b')')
+    for m in pattern.finditer(mm, max(start - 1, 0), end):
+        offset = m.end()
+        if offset >= end:
+            break
+        yield offset, mm[offset:lineStart(mm, offset + 1)]
+
+
+def firstLine(mm, start, end, parse):
+    # (offset, next line's offset, parse() of the line) of the first line in the aligned range
+    # [start, end) where parse() is not None, else None
+    while start < end:
+        nl = lineStart(mm, start + 1)
+        result = parse(mm[start:nl])
+        if result is not None:
+            return start, nl, result
+        start = nl
+    return None
+
+
+def bisectTime(mm, t, parseTime, start=0, end=None, right=False):
+    # Offset of the first line in the aligned range [start, end) whose time is at or after t (after t
+    # with right=True), by binary search over byte offsets, for logs whose times never go back.
+    # Lines parseTime() finds no time in, like stack traces, go with the line before.
+    if end is None:
+        end = len(mm)
+    lo, hi = start, end
+    while lo < hi:
+        mid = lineStart(mm, (lo + hi) // 2)
+        if mid >= hi:
+            mid = lo
+        found = firstLine(mm, mid, hi, parseTime)
+        if found is None:
+            hi = mid
+        elif found[2] > t or (found[2] == t and not right):
+            hi = found[0]
+        else:
+            lo = found[1]
+    return lo
+
+
+def lastLine(mm, start, end, parse):
+    # parse() of the last line in the aligned range [start, end) where it is not None, else None
+    while end > start:
+        i = mm.rfind(b'\n', start, end - 1)
+        lineStartPos = start if i == -1 else i + 1
+        result = parse(mm[lineStartPos:end])
+        if result is not None:
+            return result
+        end = lineStartPos
+    return None
+
+
+def completeEnd(path):
+    # Offset just past the log's last complete line
+    with mappedLog(path) as mm:
+        return mm.rfind(b'\n') + 1
+
+
+def followLog(path, start=0, pollSec=5.0):
+    # Yields the whole lines appended to the log since start, as one bytes buffer every pollSec seconds
+    # (b'' when nothing was), forever.  A log rotated away, renamed with a new one created in its place,
+    # is read to its end before the new one is followed from its start; a log truncated in place is
+    # followed from its start again.
+    f = open(path, 'rb')
+    f.seek(start)
+    carry = b''
+    try:
+        while True:
+            time.sleep(pollSec)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                # Between the rename and the new log's creation
+                st = None
+            if st is not None and st.st_ino != os.fstat(f.fileno()).st_ino:
+                yield carry + f.read()
+                f.close()
+                f = open(path, 'rb')
+                carry = b''
+            elif st is not None and st.st_size < f.tell():
+                f.seek(0)
+                carry = b''
+            data = carry + f.read()
+            i = data.rfind(b'\n') + 1
+            carry = data[i:]
+            yield data[:i]
+    finally:
+        f.close()
+
+
+def mapChunks(path, parseChunk, jobs, *args, start=0, end=None, pool=None):
+    # Yields parseChunk(path, start, end, *args) for each chunk of the log's byte range [start, end),
+    # by default all of it, in log order.  Given a pool shared by several logs read at once, at most
+    # jobs chunks of this log are in flight, so one log cannot hold up the others.
+    ranges = chunkRanges(path, start=start, end=end)
+    if pool is not None:
+        pending = collections.deque()
+        for startEnd in ranges:
+            pending.append(pool.apply_async(callChunk, (parseChunk, path, args, startEnd)))
+            if len(pending) >= jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        return
+
+    if jobs <= 1 or len(ranges) <= 1:
+        for start, end in ranges:
+            yield parseChunk(path, start, end, *args)
+        return
+
+    with multiprocessing.Pool(min(jobs, len(ranges))) as pool:
+        yield from pool.imap(functools.partial(callChunk, parseChunk, path, args), ranges)
+
+
+def callChunk(parseChunk, path, args, startEnd):
+    return parseChunk(path, startEnd[0], startEnd[1], *args)
+
+
+def findLogFiles(baseName):
+    # The log and the files it was rotated to (baseName.1, baseName.2, ...), oldest first
+    files = [baseName]
+    i = 1
+
+    while True:
+        n = "{}.{}".format(baseName, i)
+        if not os.path.isfile(n):
+            break
+        files.append(n)
+        i += 1
+
+    return list(reversed(files))
+
+
+def findLogSets(patterns):
+    # findLogFiles() of each log the patterns (paths or globs) name; rotated files a pattern matches
+    # belong to their log's set
+    sets = []
+    seen = set()
+    for pattern in patterns:
+        names = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for name in names:
+            # Skipping the tools' cache and index files next to the logs:
+            if name not in seen and not name.endswith(('.cache', '.index')):
+                files = findLogFiles(name)
+                seen.update(files)
+                sets.append(files)
+    return sets
@@ -0,0 +1,61 @@
+import datetime
+import time
+
+"""
+Decodes infoStream timestamps into float epoch milliseconds, once per line, for both tools.
+
+Logs carry local times without a zone.  Like the charts, which dygraphs draws in the
+browser's local time, they are taken to be at this machine's current UTC offset.
+"""
+
+# Ordinal of 1970-01-01
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+MSEC_PER_DAY = 86400 * 1000
+
+# Epoch msec of each day's local midnight seen so far, by its YYYY-MM-DD str or bytes
+dayMillisCache = {}
+# This machine's UTC offset, once first needed
+utcOffset = None
+
+
+def utcShift():
+    now = time.time()
+    offset = datetime.datetime.fromtimestamp(now) - datetime.datetime.utcfromtimestamp(now)
+    return offset
+
+
+def utcOffsetMillis():
+    global utcOffset
+    if utcOffset is None:
+        utcOffset = utcShift() // datetime.timedelta(milliseconds=1)
+    return utcOffset
+
+
+def dayMillis(year, month, day):
+    # Epoch msec of the day's local midnight
+    return (datetime.date(year, month, day).toordinal() - EPOCH_ORDINAL) * MSEC_PER_DAY - utcOffsetMillis()
+
+
+def stampMillis(stamp):
+    # Epoch msec of a fixed width 'YYYY-MM-DD HH:MM:SS' timestamp, str or bytes, optionally
+    # followed by ',mmm' or '.mmm'
+    day = stamp[0:10]
+    ms = dayMillisCache.get(day)
+    if ms is None:
+        ms = dayMillisCache[day] = dayMillis(int(day[0:4]), int(day[5:7]), int(day[8:10]))
+    ms += int(stamp[11:13]) * 3600000 + int(stamp[14:16]) * 60000 + int(stamp[17:19]) * 1000
+    if len(stamp) >= 23:
+        ms += int(stamp[20:23])
+    return float(ms)
+
+
+def dateTimeMillis(dt):
+    # Epoch msec of a local datetime parsed some other way
+    return float(dayMillis(dt.year, dt.month, dt.day) + (dt.hour * 3600 + dt.minute * 60 + dt.second) * 1000
+                 + dt.microsecond / 1000.0)
+
+
+def toDateTime(ms):
+    # Local datetime of epoch msec, for printing
+    days, ms = divmod(ms + utcOffsetMillis(), MSEC_PER_DAY)
+    return datetime.datetime.fromordinal(EPOCH_ORDINAL + int(days)) + datetime.timedelta(milliseconds=ms)
@@ -0,0 +1,529 @@
+import argparse
+import collections
+import heapq
+import itertools
+import json
+import math
+import multiprocessing
+import os
+
+import logReader
+import mergeViz
+
+"""
+Replays the flushes and deletes of an infoStream log through simulated merge policies, to tune merge
+settings offline: for each combination of settings it reports the write amplification, peak segment
+count and peak merging MB the policy would have caused, next to what the real policy did.  Write
+amplification is MB written by merges over MB flushed, as iwLogsToGraph reports it.
+
+The replayed trace is taken from mergeViz.parse(): flushes are replayed at the time and size their
+lines log, sized by the first snapshot holding them when the size isn't logged.  Without flush
+lines, a segment first seen in a findMerges snapshot is a flush unless it is a merge's output, as
+named by the merge's lines, or else the new segment closest in size to the inputs of a merge that
+just finished.  Deletes are the share of live MB the surviving segments lost between snapshots,
+applied to every simulated segment alike.  Merges run on merge_threads threads at merge_mb_per_sec
+MB of input per second; flushes never stall.  Each shard is an index of its own.
+"""
+
+# Trace events:
+FLUSH = 0
+DELETES = 1
+
+# Sweep parameters of the simulation itself; the rest belong to the merge policy:
+SIM_DEFAULTS = {'merge_threads': 2, 'merge_mb_per_sec': 50.0}
+
+
+class Trace:
+    # One shard's replayable events, (FLUSH, t, MB) and (DELETES, t, fraction of live MB deleted), in
+    # time order once read_traces() is done, the live MB of the segments it started with, and what the
+    # real merge policy did
+
+    def __init__(self, segNames):
+        self.events = []
+        self.initial = None
+        self.actual = mergeViz.MergeState(segNames)
+        # Segment id to [t, MB or None] of the flushes logged, until seen in a snapshot; those with a
+        # size are replayed already:
+        self.flushes = {}
+        # Segment id to MB (None until the merge's end is logged) of the merge outputs the log named,
+        # until seen in a snapshot:
+        self.outputs = {}
+        # The real merges neither named nor finished yet, by their merged segment ids:
+        self.pending = mergeViz.PendingMerges()
+        # Segment id to (full MB, delete fraction) in the last snapshot:
+        self.prev = None
+        self.t = 0.0
+        self.flushedMB = 0.0
+        self.mergedMB = 0.0
+        self.peakSegCount = 0
+        self.peakMergingMB = 0.0
+
+    def index(self, t, segs):
+        if t is not None:
+            self.t = t
+        cur = dict(zip(segs.ids, zip(segs.mb, segs.delPct)))
+        prev = self.prev
+        if prev is None:
+            self.initial = [mb * (1.0 - delPct) for mb, delPct in zip(segs.mb, segs.delPct)]
+        else:
+            # Deletes the segments in both snapshots took:
+            before = 0.0
+            after = 0.0
+            for seg, (mb, delPct) in cur.items():
+                if seg in prev:
+                    before += mb * (1.0 - prev[seg][1])
+                    after += mb * (1.0 - delPct)
+            if after < before:
+                self.events.append((DELETES, self.t, (before - after) / before))
+
+            def live_mb(seg):
+                return cur[seg][0] * (1.0 - cur[seg][1])
+
+            # New segments without flush or merge lines:
+            new = []
+            for seg in segs.ids:
+                if seg in prev:
+                    continue
+                if seg in self.outputs:
+                    if self.outputs.pop(seg) is None:
+                        self.mergedMB += live_mb(seg)
+                elif seg in self.flushes:
+                    flushT, mb = self.flushes.pop(seg)
+                    if mb is None:
+                        self.add_flush(flushT, live_mb(seg))
+                else:
+                    new.append(seg)
+            done = self.pending.finish(cur, new,
+                                       lambda merge, merged: sum(prev[seg][0] * (1.0 - prev[seg][1])
+                                                                 for seg in merged if seg in prev),
+                                       live_mb)
+            for merge, result in done:
+                if result is not None:
+                    self.mergedMB += live_mb(result)
+            for seg in new:
+                self.add_flush(self.t, live_mb(seg))
+        self.prev = cur
+
+        self.actual.index(segs)
+        self.update_peaks()
+
+    def merge(self, t, merged):
+        if self.prev is None:
+            # Merges of segments before the first snapshot can't be followed
+            return
+        if t is not None:
+            self.t = t
+        self.pending.add(frozenset(merged), merged)
+        self.actual.merge(merged)
+        self.update_peaks()
+
+    def output(self, seg, merged):
+        if self.prev is not None:
+            self.pending.remove(frozenset(merged))
+            self.outputs[seg] = None
+
+    def merge_end(self, seg, mb):
+        if seg in self.outputs:
+            self.outputs[seg] = mb
+            self.mergedMB += mb
+
+    def flush(self, t, seg, mb):
+        if self.prev is None:
+            # Flushed before the first snapshot, so among the segments the trace starts with
+            return
+        flush = self.flushes.setdefault(seg, [t, None])
+        if mb is not None and flush[1] is None:
+            flush[1] = mb
+            self.add_flush(flush[0], mb)
+
+    def add_flush(self, t, mb):
+        self.flushedMB += mb
+        self.events.append((FLUSH, t, mb))
+
+    def update_peaks(self):
+        actual = self.actual
+        actual.end_merges()
+        segs = actual.segs
+        self.peakSegCount = max(self.peakSegCount, len(segs))
+        mergingMB = sum(mb for seg, mb in zip(segs.ids, segs.mb) if seg in actual.mergeToColor)
+        self.peakMergingMB = max(self.peakMergingMB, mergingMB)
+
+
+def read_traces(log_files, timeformat, use_cache=True, jobs=1, log_slice=None):
+    # Trace of each shard of the logs, by shard (None for logs without shard names)
+    segNames = []
+    traces = {}
+    for ev in mergeViz.parse(log_files, timeformat, use_cache, jobs, segNames, log_slice, by_shard=True,
+                             flushes=True, outputs=True):
+        trace = traces.get(ev.shard)
+        if trace is None:
+            trace = traces[ev.shard] = Trace(segNames)
+        if ev.kind == 'index':
+            trace.index(ev.t, ev.segs)
+        elif ev.kind == 'merge':
+            trace.merge(ev.t, ev.merged)
+        elif ev.kind == 'output':
+            trace.output(ev.seg, ev.merged)
+        elif ev.kind == 'merged':
+            trace.merge_end(ev.seg, ev.mb)
+        else:
+            trace.flush(ev.t, ev.seg, ev.mb)
+    traces = dict((shard, trace) for shard, trace in traces.items() if trace.initial is not None)
+    for trace in traces.values():
+        # Flushes sized by a later snapshot were recorded after the deletes before it
+        trace.events.sort(key=lambda event: event[1])
+    return traces
+
+
+class Segment:
+    __slots__ = ('liveMB', 'delMB', 'merging')
+
+    def __init__(self, liveMB):
+        self.liveMB = liveMB
+        self.delMB = 0.0
+        self.merging = False
+
+    def full_mb(self):
+        return self.liveMB + self.delMB
+
+
+class TieredMergePolicy:
+    # Lucene's TieredMergePolicy.findMerges, simplified: the index may hold segments_per_tier segments
+    # per tier of sizes growing max_merge_at_once fold from floor_segment_mb; past that, or past
+    # deletes_pct_allowed deleted MB, it merges the best scoring run of segments by size, favoring
+    # equal sizes, small results and reclaimed deletes.  Sizes are live MB.
+
+    DEFAULTS = {'segments_per_tier': 10.0, 'max_merge_at_once': 10, 'max_merged_segment_mb': 5 * 1024.0,
+                'floor_segment_mb': 2.0, 'deletes_pct_allowed': 33.0}
+
+    def __init__(self, **params):
+        for name in params:
+            if name not in self.DEFAULTS:
+                raise ValueError('unknown %s setting %s' % (type(self).__name__, name))
+        for name, value in self.DEFAULTS.items():
+            setattr(self, name, params.get(name, value))
+
+    def find_merges(self, segments):
+        maxMergedMB = self.max_merged_segment_mb
+        maxMergeAtOnce = int(self.max_merge_at_once)
+
+        def too_big(seg):
+            # Segments near the maximum merged size are left alone, unless they hold too many deletes
+            return seg.liveMB > maxMergedMB / 2 and 100 * seg.delMB <= self.deletes_pct_allowed * seg.full_mb()
+
+        sized = [seg for seg in segments if not too_big(seg)]
+        allowed = self.allowed_seg_count(sized)
+        totFullMB = sum(seg.full_mb() for seg in segments)
+        totDelMB = sum(seg.delMB for seg in segments)
+        eligible = sorted([seg for seg in sized if not seg.merging], key=lambda seg: seg.liveMB, reverse=True)
+
+        merges = []
+        while True:
+            tooManySegs = len(eligible) > allowed
+            tooManyDels = 100 * totDelMB > self.deletes_pct_allowed * totFullMB
+            if not tooManySegs and not tooManyDels:
+                break
+
+            best = None
+            bestScore = None
+            if tooManySegs:
+                starts = range(len(eligible) - maxMergeAtOnce + 1)
+            else:
+                starts = range(len(eligible))
+            for start in starts:
+                candidate = []
+                candidateMB = 0.0
+                hitTooLarge = False
+                for seg in eligible[start:]:
+                    if len(candidate) >= maxMergeAtOnce:
+                        break
+                    if candidateMB + seg.liveMB > maxMergedMB:
+                        hitTooLarge = True
+                        continue
+                    candidate.append(seg)
+                    candidateMB += seg.liveMB
+                if not candidate or (not tooManySegs and sum(seg.delMB for seg in candidate) == 0):
+                    continue
+                if len(candidate) == 1 and candidate[0].delMB == 0:
+                    continue
+                score = self.score(candidate, hitTooLarge)
+                if best is None or score < bestScore:
+                    best = candidate
+                    bestScore = score
+
+            if best is None:
+                break
+            merges.append(best)
+            for seg in best:
+                eligible.remove(seg)
+                totFullMB -= seg.delMB
+                totDelMB -= seg.delMB
+        return merges
+
+    def allowed_seg_count(self, segments):
+        floorMB = self.floor_segment_mb
+        levelMB = max(min([seg.liveMB for seg in segments], default=floorMB), floorMB)
+        leftMB = sum(seg.liveMB for seg in segments)
+        allowed = 0
+        while True:
+            levelCount = leftMB / levelMB
+            if levelCount < self.segments_per_tier or levelMB >= self.max_merged_segment_mb:
+                allowed += math.ceil(levelCount)
+                break
+            allowed += self.segments_per_tier
+            leftMB -= self.segments_per_tier * levelMB
+            levelMB = min(self.max_merged_segment_mb, levelMB * self.max_merge_at_once)
+        return max(allowed, self.segments_per_tier)
+
+    def score(self, candidate, hitTooLarge):
+        # Lower is better
+        beforeMB = sum(seg.full_mb() for seg in candidate)
+        afterMB = sum(seg.liveMB for seg in candidate)
+        if hitTooLarge:
+            skew = 1.0 / self.max_merge_at_once
+        else:
+            flooredMB = sum(max(seg.liveMB, self.floor_segment_mb) for seg in candidate)
+            skew = max(candidate[0].liveMB, self.floor_segment_mb) / flooredMB
+        nonDelRatio = afterMB / beforeMB if beforeMB > 0 else 1.0
+        return skew * afterMB ** 0.05 * nonDelRatio ** 2
+
+
+class LogByteSizeMergePolicy:
+    # Lucene's LogByteSizeMergePolicy.findMerges: segments, in index order, are put into levels by the
+    # log of their live MB in base merge_factor, and every merge_factor adjacent segments of the top
+    # level still unmerged are merged, unless one is merge_max_mb or bigger
+
+    DEFAULTS = {'merge_factor': 10, 'min_merge_mb': 1.6, 'max_merge_mb': 2048.0}
+
+    # Levels within this of the top one count as the same level
+    LEVEL_LOG_SPAN = 0.75
+
+    def __init__(self, **params):
+        for name in params:
+            if name not in self.DEFAULTS:
+                raise ValueError('unknown %s setting %s' % (type(self).__name__, name))
+        for name, value in self.DEFAULTS.items():
+            setattr(self, name, params.get(name, value))
+
+    def find_merges(self, segments):
+        mergeFactor = int(self.merge_factor)
+        norm = math.log(mergeFactor)
+        levels = [math.log(max(seg.liveMB, 1e-6)) / norm for seg in segments]
+        levelFloor = math.log(self.min_merge_mb) / norm
+
+        merges = []
+        start = 0
+        while start < len(segments):
+            maxLevel = max(levels[start:])
+            if maxLevel <= levelFloor:
+                # Everything left is at the floor level
+                levelBottom = -math.inf
+            else:
+                levelBottom = max(maxLevel - self.LEVEL_LOG_SPAN, levelFloor)
+
+            upto = len(segments) - 1
+            while levels[upto] < levelBottom:
+                upto -= 1
+
+            end = start + mergeFactor
+            while end <= 1 + upto:
+                window = segments[start:end]
+                if not any(seg.merging or seg.liveMB >= self.max_merge_mb for seg in window):
+                    merges.append(window)
+                start = end
+                end = start + mergeFactor
+            start = 1 + upto
+        return merges
+
+
+POLICIES = {'tiered': TieredMergePolicy, 'logbytesize': LogByteSizeMergePolicy}
+
+
+class Simulation:
+    # One shard's trace replayed through a merge policy, with merges running on merge_threads threads
+
+    def __init__(self, trace, policy, merge_threads=2, merge_mb_per_sec=50.0):
+        self.policy = policy
+        self.mergeThreads = int(merge_threads)
+        self.mergeMBPerSec = merge_mb_per_sec
+        self.segments = [Segment(mb) for mb in trace.initial]
+        # (end time, order, merge, its full MB) of the merges running, and the merges waiting for a thread:
+        self.running = []
+        self.queued = collections.deque()
+        self.order = itertools.count()
+        self.flushedMB = 0.0
+        # MB written by the merges finished:
+        self.mergedMB = 0.0
+        self.mergeCount = 0
+        self.mergingMB = 0.0
+        self.peakSegCount = len(self.segments)
+        self.peakMergingMB = 0.0
+
+        for kind, t, value in trace.events:
+            self.finish_merges(t)
+            if kind == FLUSH:
+                self.segments.append(Segment(value))
+                self.flushedMB += value
+                self.find_merges(t)
+            else:
+                for seg in self.segments:
+                    deleted = seg.liveMB * value
+                    seg.liveMB -= deleted
+                    seg.delMB += deleted
+            self.peakSegCount = max(self.peakSegCount, len(self.segments))
+
+    def find_merges(self, t):
+        for merge in self.policy.find_merges(self.segments):
+            fullMB = 0.0
+            for seg in merge:
+                seg.merging = True
+                fullMB += seg.full_mb()
+            self.mergeCount += 1
+            self.mergingMB += fullMB
+            self.queued.append((merge, fullMB))
+        self.peakMergingMB = max(self.peakMergingMB, self.mergingMB)
+        self.start_merges(t)
+
+    def start_merges(self, t):
+        while self.queued and len(self.running) < self.mergeThreads:
+            merge, fullMB = self.queued.popleft()
+            endT = t + 1000.0 * fullMB / self.mergeMBPerSec
+            heapq.heappush(self.running, (endT, next(self.order), merge, fullMB))
+
+    def finish_merges(self, t):
+        # Commits the merges done by t, in the order they finish, each freeing its thread and letting
+        # the policy look for more merges, as IndexWriter does
+        while self.running and self.running[0][0] <= t:
+            endT, order, merge, fullMB = heapq.heappop(self.running)
+            merged = Segment(sum(seg.liveMB for seg in merge))
+            self.mergedMB += merged.liveMB
+            mergedIds = set(id(seg) for seg in merge)
+            # The merged segment takes the place of the first one merged:
+            i = self.segments.index(merge[0])
+            self.segments = [seg for seg in self.segments[:i] if id(seg) not in mergedIds] + [merged] + \
+                            [seg for seg in self.segments[i + 1:] if id(seg) not in mergedIds]
+            self.mergingMB -= fullMB
+            self.start_merges(endT)
+            self.find_merges(endT)
+
+
+def summary(flushedMB, mergedMB, peakSegCount, peakMergingMB, **extra):
+    # Totals of the shards, peaks of the worst one
+    result = {'flushedMB': flushedMB,
+              'mergedMB': mergedMB,
+              'writeAmplification': mergedMB / flushedMB if flushedMB > 0 else 0.0,
+              'peakSegCount': peakSegCount,
+              'peakMergingMB': peakMergingMB}
+    result.update(extra)
+    return result
+
+
+def actual_summary(traces):
+    # What the real merge policy did, for comparison
+    traces = traces.values()
+    return summary(sum(trace.flushedMB for trace in traces), sum(trace.mergedMB for trace in traces),
+                   max([trace.peakSegCount for trace in traces], default=0),
+                   max([trace.peakMergingMB for trace in traces], default=0.0))
+
+
+traces = None
+
+
+def init_worker(shardTraces):
+    global traces
+    traces = shardTraces
+
+
+def run(task):
+    # The summary of one policy and settings over every shard's trace
+    policyName, params = task
+    simParams = dict((name, params.get(name, value)) for name, value in SIM_DEFAULTS.items())
+    policyParams = dict((name, value) for name, value in params.items() if name not in SIM_DEFAULTS)
+    sims = [Simulation(trace, POLICIES[policyName](**policyParams), **simParams) for trace in traces.values()]
+    return summary(sum(sim.flushedMB for sim in sims), sum(sim.mergedMB for sim in sims),
+                   max([sim.peakSegCount for sim in sims], default=0),
+                   max([sim.peakMergingMB for sim in sims], default=0.0),
+                   mergeCount=sum(sim.mergeCount for sim in sims), policy=policyName, params=params)
+
+
+def sweep(shardTraces, policyName, grid, jobs=1):
+    # run() of every combination of the grid's {setting: [values]}, on up to jobs processes
+    names = sorted(grid)
+    tasks = [(policyName, dict(zip(names, values))) for values in itertools.product(*[grid[name] for name in names])]
+    # Fails early on settings the policy doesn't have:
+    POLICIES[policyName](**dict((name, grid[name][0]) for name in names if name not in SIM_DEFAULTS))
+    if jobs <= 1 or len(tasks) <= 1:
+        init_worker(shardTraces)
+        return [run(task) for task in tasks]
+    with multiprocessing.Pool(min(jobs, len(tasks)), init_worker, (shardTraces,)) as pool:
+        return pool.map(run, tasks, chunksize=1)
+
+
+def parse_setting(setting):
+    # name=v1,v2,... as (name, [values])
+    name, sep, values = setting.partition('=')
+    if not sep or not values:
+        raise ValueError('expected name=value[,value...], got %s' % setting)
+    return name, [float(value) if any(c in value for c in '.eE') else int(value) for value in values.split(',')]
+
+
+def print_results(actual, results):
+    print('%-48s %10s %10s %8s %9s %12s' % ('', 'flushed MB', 'merged MB', 'write amp', 'peak segs', 'peak merging'))
+    rows = [('actual', actual)] + [(' '.join('%s=%s' % item for item in sorted(result['params'].items()))
+                                    or 'defaults', result) for result in results]
+    for label, result in rows:
+        print('%-48s %10.1f %10.1f %8.2fx %9d %10.1f MB' % (label, result['flushedMB'], result['mergedMB'],
+                                                              result['writeAmplification'], result['peakSegCount'],
+                                                              result['peakMergingMB']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Replays the flushes in IW infoStream output through simulated merge policies and reports '
+                    'the write amplification (MB written by merges over MB flushed, as iwLogsToGraph reports it), '
+                    'peak segment count and peak merging MB of each setting.'
+    )
+    parser.add_argument('log_file', type=str, help='Log file')
+    parser.add_argument('--timeformat', type=str, default='%Y-%m-%d %H:%M:%S.%f',
+                        help='Time format of the log lines, as for mergeViz')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='Processes parsing the log and running simulations, by default one per CPU')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='Always parse the logs, without reading or writing the parsed-event cache next to them')
+    parser.add_argument('--shard', type=str, required=False,
+                        help='Only replay this shard, as index:shard or node:index:shard')
+    parser.add_argument('--policy', type=str, choices=sorted(POLICIES), default='tiered',
+                        help='Merge policy to simulate')
+    parser.add_argument('--set', dest='settings', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help='Values of a policy setting (or of %s) to sweep; every combination is simulated'
+                             % ', '.join(sorted(SIM_DEFAULTS)))
+    parser.add_argument('--json', type=str, required=False,
+                        help='Also write the results to this file as JSON')
+
+    args = parser.parse_args()
+
+    grid = {}
+    for setting in args.settings:
+        try:
+            name, values = parse_setting(setting)
+        except ValueError as e:
+            parser.error(str(e))
+        if name not in SIM_DEFAULTS and name not in POLICIES[args.policy].DEFAULTS:
+            parser.error('unknown %s setting %s; known: %s' % (
+                args.policy, name, ', '.join(sorted(list(POLICIES[args.policy].DEFAULTS) + list(SIM_DEFAULTS)))))
+        grid[name] = values
+
+    log_files = logReader.findLogFiles(args.log_file)
+    log_slice = mergeViz.LogSlice(shard=None if args.shard is None else tuple(args.shard.split(':')))
+    shardTraces = read_traces(log_files, args.timeformat, args.use_cache, args.jobs, log_slice)
+    print('%d shards, %d flushes' % (len(shardTraces), sum(
+        sum(1 for event in trace.events if event[0] == FLUSH) for trace in shardTraces.values())))
+
+    actual = actual_summary(shardTraces)
+    results = sweep(shardTraces, args.policy, grid, args.jobs)
+    results.sort(key=lambda result: result['writeAmplification'])
+    print_results(actual, results)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'actual': actual, 'runs': results}, f, indent=2)
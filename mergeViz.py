@@ -19,11 +19,24 @@
 # Read about it at http://blog.mikemccandless.com/2011/02/visualizing-lucenes-segment-merges.html
 
 import argparse
+import array
+import collections
+import http.server
+import io
+import itertools
 import math
+import multiprocessing
 import os
 import re
+import shutil
 import subprocess
+import threading
+import time
 
+import logCache
+import logIndex
+import logReader
+import logTime
 from datetime import datetime
 # You need Pillow for this: http://pillow.readthedocs.io/en/stable/
 from PIL import Image, ImageDraw, ImageFont
@@ -41,6 +54,10 @@ LIMIT = None
 LOG_BASE_MB = 10.0
 LOG_BASE = math.log(LOG_BASE_MB)
 FPS = 24
+# Seconds between reads of a followed log
+FOLLOW_SECONDS = 0.5
+# Frames handed to a render worker at once
+FRAME_CHUNK = 8
 
 FONT = ImageFont.load_default()
 
@@ -61,266 +78,1318 @@ MERGE_COLORS = (
 )
 
 
+# Timestamps in these formats are decoded by slicing instead of strptime:
+FIXED_WIDTH_TIMEFORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S,%f')
+
+
 def parse_time(l, timeformat):
+    # Float epoch msec of the line's timestamp
     m = reTime.search(l)
+    return stamp_time(m.group(1), timeformat)
+
+
+def line_time(l, timeformat):
+    # parse_time(), or None for a line without a timestamp
+    try:
+        return parse_time(l, timeformat)
+    except (AttributeError, ValueError):
+        return None
+
+
+def stamp_time(stamp, timeformat):
+    # Float epoch msec of a timestamp, str or bytes, in timeformat (fixed width ones may leave off the msec)
+    if timeformat in FIXED_WIDTH_TIMEFORMATS and len(stamp) in (19, 23):
+        return logTime.stampMillis(stamp)
+    if isinstance(stamp, bytes):
+        stamp = stamp.decode('utf-8')
     # Expects these datetimes: 07 Jul 12:54:12.554
-    dt = datetime.strptime(m.group(1), timeformat)
-    return dt.timestamp()
+    dt = datetime.strptime(stamp, timeformat)
+    return logTime.dateTimeMillis(dt)
 
 
-def main(log_files, output_file, temp_directory, timeformat):
+def main(log_files, output_file, temp_directory, timeformat, jobs=1, pipe='ffmpeg', use_cache=True, speedup=None,
+         log_slice=None, by_shard=False):
     global MAX_SEG_COUNT
     global MAX_SEG_SIZE_MB
 
-    merges, segToFullMB = parse(log_files, timeformat)
-
-    MAX_SEG_COUNT = 1
-    MAX_SEG_SIZE_MB = 0.0
-    for i, ev in enumerate(merges):
-        if ev[0] == 'index':
-            segs = ev[2]
-            MAX_SEG_COUNT = max(MAX_SEG_COUNT, len(segs))
-            for seg, mb, delPct in segs:
-                MAX_SEG_SIZE_MB = max(MAX_SEG_SIZE_MB, mb)
+    # First pass only sizes the canvas, so nothing but the maxima (of each shard, with by_shard) is kept:
+    peaks = {}
+    eventCount = 0
+    for ev in parse(log_files, timeformat, use_cache, jobs, log_slice=log_slice, by_shard=by_shard):
+        eventCount += 1
+        if ev.kind == 'index' and len(ev.segs) > 0:
+            peak = peaks.setdefault(ev.shard, [1, 0.0])
+            peak[0] = max(peak[0], len(ev.segs))
+            peak[1] = max(peak[1], max(ev.segs.mb))
 
-    MAX_SEG_COUNT += 2
-    MAX_SEG_SIZE_MB = 100 * math.ceil((MAX_SEG_SIZE_MB * 1.1) / 100.0) + 50.0
+    MAX_SEG_COUNT = max([count for count, mb in peaks.values()], default=1) + 2
+    MAX_SEG_SIZE_MB = canvas_size_mb(max([mb for count, mb in peaks.values()], default=0.0))
 
     print('MAX seg MB %s' % MAX_SEG_SIZE_MB)
-    print('%d events' % len(merges))
-
-    mergeToColor = {}
-    segToMBAndDel = {}
-    segs = None
+    print('%d events' % eventCount)
+
+    panels = None
+    if by_shard:
+        shards = sorted(peaks, key=lambda shard: () if shard is None else shard)
+        panels = shard_panels([(shard, peaks[shard]) for shard in shards])
+        print('%d shards' % len(shards))
+        scheduled = schedule(shard_frames(log_files, timeformat, eventCount, shards, use_cache, jobs, log_slice),
+                             speedup, shard_frame_key)
+        draw_frame = draw_shards
+    else:
+        scheduled = schedule(frames(log_files, timeformat, eventCount, use_cache, jobs, log_slice), speedup)
+        draw_frame = draw
+
+    init_renderer(MAX_SEG_COUNT, MAX_SEG_SIZE_MB, panels)
+
+    # Without a PNG directory, raw frames are piped to the encoder while they are rendered:
+    encoder = None
+    if temp_directory is None:
+        encoder = subprocess.Popen(encoder_command(pipe, output_file), stdin=subprocess.PIPE)
+
+    # Rasterizing is the slow part, so frames are rendered in chunks by a pool of processes
+    # while this process keeps advancing the merge state:
+    pool = None
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, init_renderer, (MAX_SEG_COUNT, MAX_SEG_SIZE_MB, panels))
+    pending = collections.deque()
     upto = 0
-    totMergeMB = 0
-    newestSeg = ''
+    renderCount = 0
+    chunk = []
+    for frame, count in itertools.islice(scheduled, LIMIT):
+        chunk.append((frame, count))
+        renderCount += 1
+        if len(chunk) == FRAME_CHUNK:
+            render_chunk(pool, pending, jobs, temp_directory, upto, chunk, encoder, draw_frame)
+            upto += sum(count for frame, count in chunk)
+            chunk = []
+    if chunk:
+        render_chunk(pool, pending, jobs, temp_directory, upto, chunk, encoder, draw_frame)
+        upto += sum(count for frame, count in chunk)
+    while pending:
+        write_frames(encoder, pending.popleft().get())
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    if encoder is None:
+        subprocess.call(encoder_command('mencoder', output_file, temp_directory))
+    else:
+        encoder.stdin.close()
+        encoder.wait()
+    print('%d frames, %d rendered' % (upto, renderCount))
+    print('DONE')
+
+
+def schedule(frames, speedup=None, key=None):
+    # Yields (frame, count) for frames(), where count is how many video frames in a row show it.
+    # With a speedup, speedup seconds of log take one second of video: each frame is held until the
+    # next one's time, and frames landing in the same video frame collapse into the last of them.
+    # Otherwise every frame gets one video frame.  Either way a frame that would draw the same image
+    # as the one before is not rendered again, the earlier one is just shown for longer.  key gives
+    # what a frame draws, by default frame_key().
+    if key is None:
+        key = frame_key
+    run = None
+    runKey = None
+    runCount = 0
+    for frame, count in held_frames(frames, speedup):
+        if count == 0:
+            continue
+        frameKey = key(*frame)
+        if run is not None and frameKey == runKey:
+            runCount += count
+            continue
+        if run is not None:
+            yield run, runCount
+        run, runKey, runCount = frame, frameKey, count
+    if run is not None:
+        yield run, runCount
+
+
+def held_frames(frames, speedup):
+    # (frame, video frames until the next frame's time), the last one shown once
+    prev = None
+    prevSlot = 0
+    for i, frame in enumerate(frames):
+        if speedup is None:
+            slot = i
+        else:
+            slot = int(frame[0] * FPS / speedup)
+        if prev is not None:
+            # Log time can step back across rotated files; such a frame just isn't held
+            yield prev, max(0, slot - prevSlot)
+        prev = frame
+        prevSlot = max(prevSlot, slot)
+    if prev is not None:
+        yield prev, 1
+
+
+def frame_key(sec, segs, mergeToColor, rightSegment, totMergeMB):
+    # Everything draw() shows, so frames with equal keys render the same image
+    return ('%d' % sec,) + state_key(segs, mergeToColor, rightSegment, totMergeMB)
+
+
+def shard_frame_key(sec, states):
+    # frame_key() of a shard_frames() frame
+    return ('%d' % sec,) + tuple(None if state is None else state_key(*state) for state in states)
+
+
+def state_key(segs, mergeToColor, rightSegment, totMergeMB):
+    fills = tuple(mergeToColor.get(seg) for seg in segs.ids)
+    return segs.mb.tobytes(), segs.delPct.tobytes(), fills, rightSegment, '%.2f' % totMergeMB
+
+
+def frames(log_files, timeformat, eventCount, use_cache=True, jobs=1, log_slice=None, follow=False):
+    # Yields the draw() arguments of each frame: seconds since the first frame, live segments,
+    # colors of the segments being merged (by segment id), newest segment and total merged MB.
+    # eventCount is None when following, as there is no end to count to.
+    segNames = []
+    state = MergeState(segNames)
     minT = None
-    for i, ev in enumerate(merges):
-        t = ev[1]
+    tMin = None
+    for i, (ev, nextEv) in enumerate(with_next(parse(log_files, timeformat, use_cache, jobs, segNames, log_slice,
+                                                                 follow))):
+        t = ev.t
         if minT is None:
             minT = t
 
-        print('%s: %s/%s' % (t - minT, i, len(merges)))
+        if eventCount is not None:
+            print('%s: %s/%s' % ((t - minT) / 1000., i, eventCount))
 
-        if ev[0] == 'index':
-            segs = ev[2]
-            for seg, fullMB, delPCT in segs:
-                if seg not in segToMBAndDel:
-                    newestSeg = seg
-                segToMBAndDel[seg] = (fullMB, delPct)
-            if i < len(merges) - 1 and merges[1 + i][0] == 'merge':
+        if ev.kind == 'index':
+            state.index(ev.segs)
+            if nextEv is not None and nextEv.kind == 'merge':
                 continue
-        elif ev[0] == 'merge':
-            seen = set()
-            for seg, color in mergeToColor.items():
-                seen.add(color)
-            for color in MERGE_COLORS:
-                if color not in seen:
-                    for seg in ev[2]:
-                        totMergeMB += segToFullMB[seg] * (2.0 - segToMBAndDel[seg][1])
-                        mergeToColor[seg] = color
-                    break
-            else:
-                raise RuntimeError('ran out of colors')
+        elif ev.kind == 'merge':
+            if state.segs is None:
+                # The segments before the log or time window starts are not known
+                continue
+            state.merge(ev.merged)
         else:
-            raise RuntimeError('unknown event %s' % ev[0])
-
-        img, mergeToColor = draw(t, segs, mergeToColor, newestSeg, totMergeMB)
-        img.save('%s/%08d.png' % (temp_directory, upto))
-        upto += 1
-        if LIMIT is not None and upto >= LIMIT:
-            break
-
-    cmd = ['mencoder',
-           'mf://%s/*.png' % temp_directory,
-           '-mf',
-           'type=png:w=%s:h=%s:fps=%s' % (WIDTH, HEIGHT, FPS),
-           '-ovc',
-           'lavc',
-           '-lavcopts',
-           'vcodec=mjpeg',
-           '-oac',
-           'copy',
-           '-o',
-           '%s' % output_file]
-    subprocess.call(cmd)
-    print('DONE')
+            raise RuntimeError('unknown event %s' % ev.kind)
+
+        if tMin is None:
+            tMin = t
 
+        state.end_merges()
 
-tMin = None
+        yield ((t - tMin) / 1000.,) + state.frame()
 
 
-def draw(t, segs, mergeToColor, rightSegment, totMergeMB):
-    global tMin
-    if tMin is None:
-        tMin = t
+def shard_frames(log_files, timeformat, eventCount, shards, use_cache=True, jobs=1, log_slice=None):
+    # Yields (seconds since the first frame, the rest of frames()' frame for each of the shards, or
+    # None until the shard's first snapshot), each shard keeping its own segments, merge colors and
+    # merged MB
+    segNames = []
+    states = dict((shard, MergeState(segNames)) for shard in shards)
+    minT = None
+    tMin = None
+    for i, (ev, nextEv) in enumerate(with_next(parse(log_files, timeformat, use_cache, jobs, segNames, log_slice,
+                                                                 by_shard=True))):
+        t = ev.t
+        if minT is None:
+            minT = t
+
+        print('%s: %s/%s' % ((t - minT) / 1000., i, eventCount))
+
+        state = states[ev.shard]
+        if ev.kind == 'index':
+            state.index(ev.segs)
+            if nextEv is not None and nextEv.kind == 'merge' and nextEv.shard == ev.shard:
+                continue
+        elif ev.kind == 'merge':
+            if state.segs is None:
+                # The shard's segments before a time window opens are not known
+                continue
+            state.merge(ev.merged)
+        else:
+            raise RuntimeError('unknown event %s' % ev.kind)
+
+        if tMin is None:
+            tMin = t
+
+        state.end_merges()
+
+        yield (t - tMin) / 1000., tuple(None if states[shard].segs is None else states[shard].frame()
+                                        for shard in shards)
+
+
+class MergeState:
+    # One index as frames() follows it: the live segments, the colors of those being merged (by segment
+    # id), the newest segment's name and the MB merged so far
+
+    def __init__(self, segNames):
+        self.segNames = segNames
+        self.segs = None
+        self.segToIndex = {}
+        self.mergeToColor = {}
+        self.newestSeg = ''
+        self.totMergeMB = 0
+
+    def index(self, segs):
+        self.segs = segs
+        # Segments never come back once merged away, so only the live ones are kept:
+        added = [seg for seg in segs.ids if seg not in self.segToIndex]
+        if added:
+            self.newestSeg = self.segNames[added[-1]]
+        self.segToIndex = dict(zip(segs.ids, range(len(segs))))
+
+    def merge(self, merged):
+        segs = self.segs
+        seen = set()
+        for seg, color in self.mergeToColor.items():
+            seen.add(color)
+        for color in MERGE_COLORS:
+            if color not in seen:
+                for seg in merged:
+                    idx = self.segToIndex.get(seg)
+                    if idx is None:
+                        # Not in the snapshot, as when another shard's lines are interleaved
+                        continue
+                    self.totMergeMB += segs.mb[idx] * (2.0 - segs.delPct[idx])
+                    self.mergeToColor[seg] = color
+                break
+        else:
+            raise RuntimeError('ran out of colors')
+
+    def end_merges(self):
+        # Merges whose segments are gone are done, freeing their color:
+        self.mergeToColor = dict((seg, color) for seg, color in self.mergeToColor.items() if seg in self.segToIndex)
 
-    i = Image.new('RGB', (WIDTH, HEIGHT), 'white')
+    def frame(self):
+        return self.segs, dict(self.mergeToColor), self.newestSeg, self.totMergeMB
 
-    segsAlive = set([s[0] for s in segs])
-    # print 'alive: %s' % segsAlive
 
-    newMergeToColor = {}
-    for seg, color in mergeToColor.items():
-        if seg in segsAlive:
-            newMergeToColor[seg] = color
+class PendingMerges:
+    # Merges started but not seen finishing yet, to tell the segments they write from flushed ones in
+    # logs that don't name them (see OutputEvent): a merge is done once none of its segments is in a
+    # snapshot, and wrote the new segment whose live MB is nearest its inputs'
 
-    maxLog = math.log(LOG_BASE_MB + MAX_SEG_SIZE_MB) - LOG_BASE
-    yPerLog = (HEIGHT - 20) / maxLog
+    def __init__(self):
+        self.merges = []
 
-    xPerSeg = int(WIDTH / MAX_SEG_COUNT)
+    def add(self, merge, merged):
+        # merge is whatever the caller knows the merge by, merged its segment ids
+        self.merges.append((merge, set(merged)))
 
-    d = ImageDraw.Draw(i)
+    def remove(self, merge):
+        # Once the log names the segment the merge writes
+        self.merges = [(m, merged) for m, merged in self.merges if m != merge]
 
-    for sz in (10.0, 50.0, 100.0, 500.0, 1024, 5 * 1024):
-        y = HEIGHT - 10 - yPerLog * (math.log(LOG_BASE_MB + sz) - LOG_BASE)
-        d.line(((0, y), (WIDTH, y)), fill='#cccccc')
-        if sz >= 1024:
-            s = '%d GB' % (sz / 1024)
+    def finish(self, live, new, input_mb, seg_mb):
+        # (merge, segment it wrote, or None once new runs out) of each merge done by the snapshot of
+        # the live segment ids; the segments written are taken out of new.  input_mb(merge, merged)
+        # and seg_mb(seg) give the live MB to match.
+        done = []
+        pending = []
+        for merge, merged in self.merges:
+            if any(seg in live for seg in merged):
+                pending.append((merge, merged))
+                continue
+            result = None
+            if new:
+                inputMB = input_mb(merge, merged)
+                result = min(new, key=lambda seg: abs(seg_mb(seg) - inputMB))
+                new.remove(result)
+            done.append((merge, result))
+        self.merges = pending
+        return done
+
+
+def live(log_files, timeformat, port, jobs=1, use_cache=True, log_slice=None):
+    # Follows the logs, serving the latest merge state as an MJPEG stream on http://localhost:port/,
+    # at most FPS frames per second.  States that come faster than that are never drawn.
+    viewer = LiveViewer()
+    threading.Thread(target=viewer.render_loop, daemon=True).start()
+    server = http.server.ThreadingHTTPServer(('localhost', port), viewer.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print('Serving http://localhost:%d/' % port)
+    try:
+        for frame in frames(log_files, timeformat, None, use_cache, jobs, log_slice, follow=True):
+            viewer.publish(frame)
+    finally:
+        server.shutdown()
+
+
+class LiveViewer:
+    # The latest frame published, and the JPEG of the latest one drawn, handed between the thread
+    # following the logs, the one drawing and those streaming to viewers
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.frame = None
+        self.version = 0
+        self.jpeg = None
+        self.jpegVersion = 0
+        init_renderer(1, 0.0)
+
+    def publish(self, frame):
+        with self.cond:
+            self.frame = frame
+            self.version += 1
+            self.cond.notify_all()
+
+    def render_loop(self):
+        drawn = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.version != drawn)
+                frame = self.frame
+                drawn = self.version
+            t0 = time.time()
+            fit_canvas(frame[1])
+            buffer = io.BytesIO()
+            draw(*frame).save(buffer, 'JPEG')
+            with self.cond:
+                self.jpeg = buffer.getvalue()
+                self.jpegVersion = drawn
+                self.cond.notify_all()
+            time.sleep(max(0.0, 1.0 / FPS - (time.time() - t0)))
+
+    def stream(self):
+        # Yields each newly drawn JPEG, skipping those drawn while the previous one was sent
+        sent = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.jpegVersion != sent)
+                jpeg = self.jpeg
+                sent = self.jpegVersion
+            yield jpeg
+
+    def handler(self):
+        viewer = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path == '/':
+                    page = b'<html><body style="margin:0"><img src="/stream"></body></html>'
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html')
+                    self.send_header('Content-Length', str(len(page)))
+                    self.end_headers()
+                    self.wfile.write(page)
+                elif self.path == '/stream':
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.end_headers()
+                    try:
+                        for jpeg in viewer.stream():
+                            self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+                                             % len(jpeg))
+                            self.wfile.write(jpeg)
+                            self.wfile.write(b'\r\n')
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass
+                else:
+                    self.send_error(404)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def fit_canvas(segs):
+    # Grows the canvas, as main() would have sized it, once a live frame no longer fits
+    count = len(segs) + 2
+    mb = max(segs.mb, default=0.0)
+    if count > MAX_SEG_COUNT or mb > MAX_SEG_SIZE_MB:
+        init_renderer(max(MAX_SEG_COUNT, count), max(MAX_SEG_SIZE_MB, canvas_size_mb(mb)))
+
+
+def canvas_size_mb(mb):
+    # Segment size at the top of the canvas for segments up to mb, with some headroom
+    return 100 * math.ceil((mb * 1.1) / 100.0) + 50.0
+
+
+def shard_panels(peaks):
+    # Panels of a grid filling the canvas, one per (shard, [peak segment count, peak segment MB]) in
+    # that order, each scaled to its own shard's peaks: (x, y, width, height, maxSegCount, maxSegSizeMB,
+    # title)
+    cols = max(1, math.ceil(math.sqrt(len(peaks))))
+    rows = max(1, math.ceil(len(peaks) / cols))
+    width = WIDTH // cols
+    height = HEIGHT // rows
+    panels = []
+    for i, (shard, (count, mb)) in enumerate(peaks):
+        panels.append(((i % cols) * width, (i // cols) * height, width, height, count + 2, canvas_size_mb(mb),
+                       '' if shard is None else ':'.join(shard)))
+    return panels
+
+
+def init_renderer(maxSegCount, maxSegSizeMB, panels=None):
+    # Pool workers don't see the canvas size main() computed unless they were forked after it,
+    # and the cached background depends on it
+    global MAX_SEG_COUNT
+    global MAX_SEG_SIZE_MB
+    global SHARD_PANELS
+    global renderer
+    MAX_SEG_COUNT = maxSegCount
+    MAX_SEG_SIZE_MB = maxSegSizeMB
+    SHARD_PANELS = panels
+    renderer = None
+
+
+def render_frames(temp_directory, upto, frames, draw_frame=None):
+    # Saves numbered PNGs, or returns the raw RGB buffers and their repeat counts when there is
+    # no directory.  Frames are drawn by draw_frame, by default draw().
+    if draw_frame is None:
+        draw_frame = draw
+    buffers = []
+    for frame, count in frames:
+        img = draw_frame(*frame)
+        if temp_directory is None:
+            buffers.append((img.tobytes(), count))
         else:
-            s = '%d MB' % sz
-        d.text((WIDTH - 80, y - 20), s, fill='black', font=FONT)
-
-    totMB = 0
-    mergingMB = 0
-    for idx, (seg, mb, delPct) in enumerate(segs):
-        totMB += mb * (1.0 - delPct)
-        x0 = idx * (xPerSeg) + 1
-        x1 = x0 + xPerSeg - 2
-        y0 = HEIGHT - 10 - yPerLog * (math.log(LOG_BASE_MB + mb) - LOG_BASE)
-        y1 = HEIGHT - 10
-
-        if seg in mergeToColor:
-            fill = mergeToColor[seg]
-            mergingMB += mb
+            path = '%s/%08d.png' % (temp_directory, upto)
+            img.save(path)
+            for i in range(1, count):
+                shutil.copyfile(path, '%s/%08d.png' % (temp_directory, upto + i))
+        upto += count
+    return buffers
+
+
+def render_chunk(pool, pending, jobs, temp_directory, upto, chunk, encoder, draw_frame=None):
+    if pool is None:
+        write_frames(encoder, render_frames(temp_directory, upto, chunk, draw_frame))
+        return
+    pending.append(pool.apply_async(render_frames, (temp_directory, upto, chunk, draw_frame)))
+    # Bounds how many parsed or rendered frames wait in memory; chunks finish in order:
+    while len(pending) > 2 * jobs:
+        write_frames(encoder, pending.popleft().get())
+
+
+def write_frames(encoder, buffers):
+    for buffer, count in buffers:
+        for i in range(count):
+            encoder.stdin.write(buffer)
+
+
+def encoder_command(encoder, output_file, temp_directory=None):
+    # Reads the numbered PNGs from temp_directory, or raw RGB frames from stdin without one
+    if encoder == 'ffmpeg':
+        return ['ffmpeg',
+                '-y',
+                '-f',
+                'rawvideo',
+                '-pix_fmt',
+                'rgb24',
+                '-s',
+                '%sx%s' % (WIDTH, HEIGHT),
+                '-r',
+                '%s' % FPS,
+                '-i',
+                '-',
+                '-vcodec',
+                'mjpeg',
+                '%s' % output_file]
+
+    if temp_directory is None:
+        source = ['-',
+                  '-demuxer',
+                  'rawvideo',
+                  '-rawvideo',
+                  'w=%s:h=%s:fps=%s:format=rgb24' % (WIDTH, HEIGHT, FPS)]
+    else:
+        source = ['mf://%s/*.png' % temp_directory,
+                  '-mf',
+                  'type=png:w=%s:h=%s:fps=%s' % (WIDTH, HEIGHT, FPS)]
+    return ['mencoder'] + source + ['-ovc',
+                                    'lavc',
+                                    '-lavcopts',
+                                    'vcodec=mjpeg',
+                                    '-oac',
+                                    'copy',
+                                    '-o',
+                                    '%s' % output_file]
+
+
+renderer = None
+# Layout of the per-shard panels, see shard_panels(); None draws one index over the whole canvas
+SHARD_PANELS = None
+
+
+def draw(sec, segs, mergeToColor, rightSegment, totMergeMB):
+    # The returned image is reused by the next call, so save or copy it first
+    global renderer
+    if renderer is None:
+        renderer = FrameRenderer()
+    return renderer.draw(sec, segs, mergeToColor, rightSegment, totMergeMB)
+
+
+def draw_shards(sec, states):
+    # draw() of a shard_frames() frame, each shard in its SHARD_PANELS panel
+    global renderer
+    if renderer is None:
+        renderer = FrameRenderer(SHARD_PANELS)
+    return renderer.draw_panels(sec, states)
+
+
+class Panel:
+    # Where one index is drawn on the canvas and how its segments are scaled, and what of it the
+    # last frame showed
+
+    def __init__(self, x, y, width, height, maxSegCount, maxSegSizeMB, title=None):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.title = title
+
+        maxLog = math.log(LOG_BASE_MB + maxSegSizeMB) - LOG_BASE
+        self.yPerLog = (height - 20) / maxLog
+
+        self.xPerSeg = int(width / maxSegCount)
+
+        if title is None:
+            # Alone on the canvas, the text goes just below the 500 MB line:
+            self.textX = x + width - 220
+            self.textY = y + height - 10 - self.yPerLog * (math.log(LOG_BASE_MB + 500) - LOG_BASE) + 15
+            self.lineHeight = 20
         else:
-            fill = '#dddddd'
+            self.textX = x + width - 160
+            self.textY = y + 4
+            self.lineHeight = 12
+
+        self.columnStates = []
+        self.textBox = None
+
+    def draw_background(self, img):
+        # Size grid lines and their labels, clipped to the panel
+        background = Image.new('RGB', (self.width, self.height), 'white')
+        d = ImageDraw.Draw(background)
+
+        for sz in (10.0, 50.0, 100.0, 500.0, 1024, 5 * 1024):
+            y = self.height - 10 - self.yPerLog * (math.log(LOG_BASE_MB + sz) - LOG_BASE)
+            d.line(((0, y), (self.width, y)), fill='#cccccc')
+            if sz >= 1024:
+                s = '%d GB' % (sz / 1024)
+            else:
+                s = '%d MB' % sz
+            d.text((self.width - 80, y - 20), s, fill='black', font=FONT)
 
-        d.rectangle(((x0, y0), (x1, y1)), outline='black', fill=fill)
+        if self.title is not None:
+            d.rectangle(((0, 0), (self.width - 1, self.height - 1)), outline='#888888')
 
-        if delPct > 0.0:
-            y2 = y0 + (y1 - y0) * delPct
-            d.rectangle(((x0, y0), (x1, y2)), outline='black', fill='gray')
+        img.paste(background, (self.x, self.y))
 
-    baseY = HEIGHT - 10 - yPerLog * (math.log(LOG_BASE_MB + 500) - LOG_BASE) + 15
-    baseX = WIDTH - 220
 
-    d.text((baseX, baseY), '%d sec' % (t - tMin), fill='black', font=FONT)
+class FrameRenderer:
+    # Keeps the static grid and labels, the segment columns drawn over them and the previous frame,
+    # so each frame only repaints the columns whose segment size, deletes or merge color changed,
+    # plus the text panel.  Columns never overlap, so the result matches drawing from scratch.  The
+    # canvas is one panel, or a grid of them (see shard_panels()) all drawn in one pass.
 
-    if totMB < 1024:
-        sz = '%4.1f MB' % totMB
-    else:
-        sz = '%4.2f GB' % (totMB / 1024.)
-    d.text((baseX, 20 + baseY), '%s' % sz, fill='black', font=FONT)
+    def __init__(self, panels=None):
+        if panels is None:
+            self.panels = [Panel(0, 0, WIDTH, HEIGHT, MAX_SEG_COUNT, MAX_SEG_SIZE_MB)]
+        else:
+            self.panels = [Panel(*panel) for panel in panels]
+
+        self.background = Image.new('RGB', (WIDTH, HEIGHT), 'white')
+        for panel in self.panels:
+            panel.draw_background(self.background)
+
+        # Background plus columns, without the text panel:
+        self.columns = self.background.copy()
+        self.frame = self.background.copy()
+
+    def draw(self, sec, segs, mergeToColor, rightSegment, totMergeMB):
+        return self.draw_panels(sec, [(segs, mergeToColor, rightSegment, totMergeMB)])
+
+    def draw_panels(self, sec, states):
+        # states holds each panel's (segs, mergeToColor, rightSegment, totMergeMB), or None to leave it
+        # empty
+        texts = []
+        for panel, state in zip(self.panels, states):
+            if state is None:
+                self.draw_columns(panel, (), {})
+                texts.append([panel.title])
+            else:
+                texts.append(self.draw_columns(panel, *state, sec=sec))
+
+        # Erase the previous panel text, then draw this frame's over the columns:
+        for panel in self.panels:
+            if panel.textBox is not None:
+                self.frame.paste(self.columns.crop(panel.textBox), panel.textBox)
+
+        d = ImageDraw.Draw(self.frame)
+        for panel, panelTexts in zip(self.panels, texts):
+            self.draw_text(d, panel, panelTexts)
+
+        return self.frame
+
+    def draw_columns(self, panel, segs, mergeToColor, rightSegment=None, totMergeMB=None, sec=None):
+        # Repaints the panel's changed columns; returns the lines of its text panel
+        yPerLog = panel.yPerLog
+        xPerSeg = panel.xPerSeg
+        bottom = panel.y + panel.height
+
+        d = ImageDraw.Draw(self.columns)
+
+        totMB = 0
+        mergingMB = 0
+        columnStates = []
+        count = len(segs)
+        for idx in range(max(count, len(panel.columnStates))):
+            if idx < count:
+                seg, mb, delPct = segs.ids[idx], segs.mb[idx], segs.delPct[idx]
+                totMB += mb * (1.0 - delPct)
+
+                if seg in mergeToColor:
+                    fill = mergeToColor[seg]
+                    mergingMB += mb
+                else:
+                    fill = '#dddddd'
+
+                state = (mb, delPct, fill)
+                columnStates.append(state)
+            else:
+                state = None
 
-    d.text((baseX, 40 + baseY), '%d segs; %s' % (len(segs), rightSegment), fill='black', font=FONT)
+            if idx < len(panel.columnStates) and panel.columnStates[idx] == state:
+                continue
 
-    if mergingMB < 1024:
-        sz = '%.1f MB' % mergingMB
-    else:
-        sz = '%.2f GB' % (mergingMB / 1024.)
-    d.text((baseX, 60 + baseY), '%s merging' % sz, fill='black', font=FONT)
+            box = (panel.x + idx * xPerSeg, panel.y, panel.x + (idx + 1) * xPerSeg, bottom)
+            self.columns.paste(self.background.crop(box), box)
 
-    if totMergeMB >= 1024:
-        s = '%4.2f GB' % (totMergeMB / 1024)
-    else:
-        s = '%4.1f MB' % totMergeMB
+            if state is not None:
+                x0 = panel.x + idx * (xPerSeg) + 1
+                x1 = x0 + xPerSeg - 2
+                y0 = bottom - 10 - yPerLog * (math.log(LOG_BASE_MB + mb) - LOG_BASE)
+                y1 = bottom - 10
 
-    d.text((baseX, 80 + baseY), '%s merged' % s, fill='black', font=FONT)
+                d.rectangle(((x0, y0), (x1, y1)), outline='black', fill=fill)
 
-    return i, newMergeToColor
+                if delPct > 0.0:
+                    y2 = y0 + (y1 - y0) * delPct
+                    d.rectangle(((x0, y0), (x1, y2)), outline='black', fill='gray')
 
+            self.frame.paste(self.columns.crop(box), box)
 
-reSeg1 = re.compile(r'\*?(_.*?)\(.*?\):[cC]v?([0-9]+)(/[0-9]+)?')
-reSeg2 = re.compile(r'seg=\*?(_.*?)\(.*?\):[cC]v?([0-9]+)(/[0-9]+)?.*?size=([0-9.]+) MB')
-reTime = re.compile(r'^(.*?) +[A-Z]+ +')
+        panel.columnStates = columnStates
 
+        if sec is None:
+            return None
 
-def parse(log_files, timeformat):
-    events = []
-    segs = []
-    segsToFullMB = {}
+        texts = []
+        if panel.title is not None:
+            texts.append(panel.title)
+        texts.append('%d sec' % sec)
 
-    for log_file in log_files:
-        with open(log_file, 'r') as f:
-            for l in f.readlines():
-                if l == '':
-                    break
-                i = l.find('seg=')
-                if i != -1:
-                    l = l[i:]
-                    m2 = reSeg2.search(l)
-                    if m2 is not None:
-                        seg = m2.group(1)
-                        # print 'matches %s' % str(m2.groups())
-                        del_count = m2.group(3)
-                        if del_count is not None:
-                            del_count = int(del_count[1:])
-                        else:
-                            del_count = 0
-                        docCount = int(m2.group(2))
-
-                        undelSize = float(m2.group(4))
-                        if seg not in segsToFullMB:
-                            if del_count != 0:
-                                del_ratio = float(del_count) / docCount
-                                if del_ratio < 1.0:
-                                    full_size = undelSize / (
-                                                1.0 - del_ratio)
-                                else:
-                                    # total guess!
-                                    print('WARNING: total guess!')
-                                    full_size = 0.1
-                            else:
-                                full_size = undelSize
-                            segsToFullMB[seg] = full_size
-
-                        # seg name, fullMB, delPct
-                        assert del_count <= docCount, 'docCount %s delCount %s line %s' % (
-                        docCount, del_count, l)
-                        segs.append((seg, segsToFullMB[seg],
-                                     float(del_count) / docCount))
-                        continue
+        if totMB < 1024:
+            sz = '%4.1f MB' % totMB
+        else:
+            sz = '%4.2f GB' % (totMB / 1024.)
+        texts.append('%s' % sz)
 
-                if segs and (l.find('allowedSegmentCount=') != -1 or l.find('LMP:   level ') != -1):
-                    events.append(('index', t, segs))
-                    segs = []
-                    continue
+        texts.append('%d segs; %s' % (len(segs), rightSegment))
 
-                i = l.find('   add merge=')
-                if i != -1:
-                    t = parse_time(l, timeformat)
-                    l = l[i:]
-                    merged = []
-                    for tup in reSeg1.findall(l):
-                        seg = tup[0]
-                        merged.append(seg)
-                    events.append(('merge', t, merged))
-                    continue
+        if mergingMB < 1024:
+            sz = '%.1f MB' % mergingMB
+        else:
+            sz = '%.2f GB' % (mergingMB / 1024.)
+        texts.append('%s merging' % sz)
 
-                if l.find(': findMerges: ') != -1:
-                    t = parse_time(l, timeformat)
-                    if segs:
-                        events.append(('index', t, segs))
-                    segs = []
-                    continue
+        if totMergeMB >= 1024:
+            s = '%4.2f GB' % (totMergeMB / 1024)
+        else:
+            s = '%4.1f MB' % totMergeMB
+        texts.append('%s merged' % s)
+        return texts
+
+    def draw_text(self, d, panel, texts):
+        textBox = None
+        for i, text in enumerate(texts):
+            xy = (panel.textX, panel.lineHeight * i + panel.textY)
+            d.text(xy, text, fill='black', font=FONT)
+            x0, y0, x1, y1 = d.textbbox(xy, text, font=FONT)
+            if textBox is None:
+                textBox = [x0, y0, x1, y1]
+            else:
+                textBox = [min(textBox[0], x0), min(textBox[1], y0), max(textBox[2], x1), max(textBox[3], y1)]
+        x0, y0 = max(panel.x, int(math.floor(textBox[0]))), max(panel.y, int(math.floor(textBox[1])))
+        x1 = min(panel.x + panel.width, int(math.ceil(textBox[2])) + 1)
+        y1 = min(panel.y + panel.height, int(math.ceil(textBox[3])) + 1)
+        if x0 < x1 and y0 < y1:
+            panel.textBox = (x0, y0, x1, y1)
+        else:
+            # Text is off the canvas for small maximum segment sizes
+            panel.textBox = None
+
+
+# Lines are matched as bytes, straight from the mapped log; only captured groups are decoded:
+reSeg1 = re.compile(rb'\*?(_.*?)\(.*?\):[cC]v?([0-9]+)(/[0-9]+)?')
+reSeg2 = re.compile(rb'seg=\*?(_.*?)\(.*?\):[cC]v?([0-9]+)(/[0-9]+)?.*?size=([0-9.]+) MB')
+reTime = re.compile(rb'^(.*?) +[A-Z]+ +')
+reShard = re.compile(rb'\[lucene.iw\s*\] \[(.*?)\]\[(.*?)\]\[(\d+)\]')
+reFlush = re.compile(rb'flush postings as segment (_\S+)')
+reFlushedSize = re.compile(rb'flushed: segment=(_\S+) .*?newFlushedSize(?:\(includes docstores\))?=([0-9.]+) MB')
+reMergeOutput = re.compile(rb': merge seg=(_[^\s(]+)(.*)')
+reMergeInput = re.compile(rb' \*?(_[^\s(]+)')
+reMergeEnd = re.compile(rb'merged segment size=([0-9.]+) MB')
+# The thread a line was logged from, to pair a merge's start and end lines: the Elasticsearch or
+# Lucene thread name as iwLogsToGraph finds it, else the bracketed one before the IW component
+reThreads = (re.compile(rb' elasticsearch\[.*?\]\[\[.*?\]\[.*?\]: (.*?)\] '), re.compile(rb'^IW \d+ \[.*?; (.*?)\]:'),
+             re.compile(rb'\] \[([^\[\]]*)\] IW: '))
+
+
+def with_next(events):
+    # Pairs each event with the one after it (None for the last, and for the last before an idle
+    # event, so a followed log's latest state isn't held back), without materializing the stream:
+    prev = None
+    for ev in events:
+        if ev.kind == 'idle':
+            if prev is not None:
+                yield prev, None
+            prev = None
+            continue
+        if prev is not None:
+            yield prev, ev
+        prev = ev
+    if prev is not None:
+        yield prev, None
+
+
+class Segments:
+    # One index snapshot as parallel arrays: interned segment id, full MB (including deletes) and
+    # fraction of deleted docs of each segment, in log order
+    __slots__ = ('ids', 'mb', 'delPct')
+
+    def __init__(self):
+        self.ids = array.array('i')
+        self.mb = array.array('d')
+        self.delPct = array.array('d')
+
+    def append(self, seg, mb, delPct):
+        self.ids.append(seg)
+        self.mb.append(mb)
+        self.delPct.append(delPct)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class IndexEvent:
+    kind = 'index'
+    __slots__ = ('t', 'segs', 'shard')
+
+    def __init__(self, t, segs, shard=None):
+        self.t = t
+        self.segs = segs
+        # (node, index, shard) when parsed by shard, else None
+        self.shard = shard
+
+
+class MergeEvent:
+    kind = 'merge'
+    __slots__ = ('t', 'merged', 'shard')
+
+    def __init__(self, t, merged, shard=None):
+        self.t = t
+        # array of the merged segments' ids
+        self.merged = merged
+        self.shard = shard
+
+
+class FlushEvent:
+    kind = 'flush'
+    __slots__ = ('t', 'seg', 'mb', 'shard')
+
+    def __init__(self, t, seg, mb, shard=None):
+        self.t = t
+        self.seg = seg
+        # Flushed MB, or None when only the flush's start was logged
+        self.mb = mb
+        self.shard = shard
+
+
+class IdleEvent:
+    # A followed log's lines appended so far are all parsed
+    kind = 'idle'
+    __slots__ = ()
+    t = None
+    shard = None
+
+
+class OutputEvent:
+    kind = 'output'
+    __slots__ = ('t', 'seg', 'merged', 'shard')
+
+    def __init__(self, t, seg, merged, shard=None):
+        # A merge started writing segment seg out of the merged segment ids
+        self.t = t
+        self.seg = seg
+        self.merged = merged
+        self.shard = shard
+
+
+class MergedEvent:
+    kind = 'merged'
+    __slots__ = ('t', 'seg', 'mb', 'shard')
+
+    def __init__(self, t, seg, mb, shard=None):
+        # The merge writing segment seg finished, writing mb MB
+        self.t = t
+        self.seg = seg
+        self.mb = mb
+        self.shard = shard
+
+
+# Per-line records, extracted without any parse state so they can be cached per log file:
+SEG = 0
+SNAPSHOT_END = 1
+MERGE = 2
+FIND_MERGES = 3
+FLUSH = 4
+MERGE_OUTPUT = 5
+MERGE_END = 6
+# Only ever yielded by log_records() following a log, once the lines appended so far are read:
+IDLE = 7
+
+CACHE_COLUMNS = (('kind', 'b'), ('t', 'd'), ('seg', 'i'), ('docs', 'q'), ('dels', 'q'), ('mb', 'd'),
+                 ('thread', 'i'), ('shard', 'i'), ('merged', 'i'))
+CACHE_VERSION = 5
+
+
+def parse_records(log_file, timeformat, jobs=1, start=0, end=None):
+    # Yields (SEG, seg, docCount, delCount, undelSizeMB, shard), (SNAPSHOT_END, shard),
+    # (MERGE, t, merged, shard), (FIND_MERGES, t, shard), (FLUSH, t, seg, flushedMB or -1, shard),
+    # (MERGE_OUTPUT, t, seg, merged, thread, shard) and (MERGE_END, t, mergedMB, thread, shard)
+    # records, parsing chunks of the log's
+    # byte range [start, end) in up to jobs processes.  shard is the line's (node, index, shard),
+    # or None when the line has none, and thread its thread name, or None:
+    for records in logReader.mapChunks(log_file, chunk_records, jobs, timeformat, start=start, end=end):
+        yield from records
+
+
+# A line must contain one of these to yield a record:
+LINE_KEYWORDS = (b'seg=', b'allowedSegmentCount=', b'LMP:   level ', b'   add merge=', b': findMerges: ',
+                 b'flush postings as segment ', b'newFlushedSize', b'merged segment size=')
+
+
+def chunk_records(log_file, start, end, timeformat):
+    with logReader.mappedLog(log_file) as mm:
+        start, end = logReader.alignChunk(mm, start, end)
+        lines = (line for offset, line in logReader.iterKeywordLines(mm, start, end, LINE_KEYWORDS))
+        return list(line_records(lines, timeformat))
+
+
+def line_shard(l):
+    m = reShard.search(l)
+    if m is None:
+        return None
+    return tuple(x.decode('utf-8', 'replace') for x in m.groups())
+
+
+def line_thread(l):
+    for r in reThreads:
+        m = r.search(l)
+        if m is not None:
+            return m.group(1).decode('utf-8', 'replace')
+    return None
+
+
+def line_records(lines, timeformat):
+    for l in lines:
+        shard = line_shard(l)
+        # A merge's thread names the segment it writes, and logs its size when done:
+        if l.find(b': merge seg=') != -1:
+            m = reMergeOutput.search(l)
+            if m is not None:
+                merged = [seg.decode('utf-8') for seg in reMergeInput.findall(m.group(2))]
+                yield MERGE_OUTPUT, parse_time(l, timeformat), m.group(1).decode('utf-8'), merged, line_thread(l), shard
+            continue
+
+        if l.find(b'merged segment size=') != -1:
+            m = reMergeEnd.search(l)
+            if m is not None:
+                yield MERGE_END, parse_time(l, timeformat), float(m.group(1)), line_thread(l), shard
+            continue
+
+        i = l.find(b'seg=')
+        if i != -1:
+            l = l[i:]
+            m2 = reSeg2.search(l)
+            if m2 is not None:
+                seg = m2.group(1).decode('utf-8')
+                # print 'matches %s' % str(m2.groups())
+                del_count = m2.group(3)
+                if del_count is not None:
+                    del_count = int(del_count[1:])
+                else:
+                    del_count = 0
+                docCount = int(m2.group(2))
+
+                undelSize = float(m2.group(4))
+
+                # seg name, fullMB, delPct
+                assert del_count <= docCount, 'docCount %s delCount %s line %s' % (
+                docCount, del_count, l)
+                yield SEG, seg, docCount, del_count, undelSize, shard
+                continue
+
+        if l.find(b'allowedSegmentCount=') != -1 or l.find(b'LMP:   level ') != -1:
+            yield SNAPSHOT_END, shard
+            continue
+
+        i = l.find(b'   add merge=')
+        if i != -1:
+            t = parse_time(l, timeformat)
+            l = l[i:]
+            merged = []
+            for tup in reSeg1.findall(l):
+                seg = tup[0].decode('utf-8')
+                merged.append(seg)
+            yield MERGE, t, merged, shard
+            continue
+
+        if l.find(b': findMerges: ') != -1:
+            yield FIND_MERGES, parse_time(l, timeformat), shard
+            continue
+
+        # A flush starts with DWPT naming its segment, and ends with its size when DWPT's sizes are logged:
+        m = reFlush.search(l)
+        if m is not None:
+            yield FLUSH, parse_time(l, timeformat), m.group(1).decode('utf-8'), -1.0, shard
+            continue
+
+        m = reFlushedSize.search(l)
+        if m is not None:
+            yield FLUSH, parse_time(l, timeformat), m.group(1).decode('utf-8'), float(m.group(2)), shard
+
+
+def cached_records(log_file, timeformat, use_cache=True, jobs=1):
+    # Same records as parse_records, replayed from the log's cache when it is up to date
+    if not use_cache:
+        yield from parse_records(log_file, timeformat, jobs)
+        return
+
+    params = {'version': CACHE_VERSION, 'timeformat': timeformat}
+    cache = logCache.load(log_file, 'mergeViz', params)
+    if cache is not None:
+        print('Using cache for {}'.format(log_file))
+        yield from replay_records(cache)
+        return
+
+    writer = logCache.CacheWriter(log_file, 'mergeViz', params, CACHE_COLUMNS)
+    try:
+        cols = writer.columns
+        segIds = {}
+        shardIds = {}
+        threadIds = {}
+        for rec in parse_records(log_file, timeformat, jobs):
+            kind = rec[0]
+            cols['kind'].append(kind)
+            shard = rec[-1]
+            cols['shard'].append(-1 if shard is None else shardIds.setdefault(shard, len(shardIds)))
+            if kind in (MERGE_OUTPUT, MERGE_END):
+                thread = rec[-2]
+                cols['thread'].append(-1 if thread is None else threadIds.setdefault(thread, len(threadIds)))
+            else:
+                cols['thread'].append(-1)
+            if kind == SEG:
+                cols['t'].append(0.0)
+                cols['seg'].append(segIds.setdefault(rec[1], len(segIds)))
+                cols['docs'].append(rec[2])
+                cols['dels'].append(rec[3])
+                cols['mb'].append(rec[4])
+            elif kind == FLUSH:
+                cols['t'].append(rec[1])
+                cols['seg'].append(segIds.setdefault(rec[2], len(segIds)))
+                cols['docs'].append(0)
+                cols['dels'].append(0)
+                cols['mb'].append(rec[3])
+            elif kind == MERGE_OUTPUT:
+                # docs holds how many merged segment ids follow
+                cols['t'].append(rec[1])
+                cols['seg'].append(segIds.setdefault(rec[2], len(segIds)))
+                cols['docs'].append(len(rec[3]))
+                cols['dels'].append(0)
+                cols['mb'].append(0.0)
+                cols['merged'].extend([segIds.setdefault(seg, len(segIds)) for seg in rec[3]])
+            elif kind == MERGE_END:
+                cols['t'].append(rec[1])
+                cols['seg'].append(0)
+                cols['docs'].append(0)
+                cols['dels'].append(0)
+                cols['mb'].append(rec[2])
+            else:
+                cols['t'].append(rec[1] if kind != SNAPSHOT_END else 0.0)
+                if kind == MERGE:
+                    cols['seg'].append(len(rec[2]))
+                    cols['merged'].extend([segIds.setdefault(seg, len(segIds)) for seg in rec[2]])
+                else:
+                    cols['seg'].append(0)
+                cols['docs'].append(0)
+                cols['dels'].append(0)
+                cols['mb'].append(0.0)
+            yield rec
+    except BaseException:
+        writer.discard()
+        raise
+    writer.commit({'segs': list(segIds), 'shards': list(shardIds), 'threads': list(threadIds)})
+
+
+def replay_records(cache):
+    names = cache.meta['segs']
+    shards = [tuple(shard) for shard in cache.meta['shards']]
+    threads = cache.meta['threads']
+    merged = cache.iterColumn('merged')
+    for kind, t, seg, docs, dels, mb, thread, shard in zip(*[cache.iterColumn(name)
+                                                             for name, typecode in CACHE_COLUMNS[:-1]]):
+        shard = None if shard == -1 else shards[shard]
+        thread = None if thread == -1 else threads[thread]
+        if kind == SEG:
+            yield SEG, names[seg], docs, dels, mb, shard
+        elif kind == SNAPSHOT_END:
+            yield SNAPSHOT_END, shard
+        elif kind == MERGE:
+            # seg holds how many merged segment ids follow
+            yield MERGE, t, [names[next(merged)] for i in range(seg)], shard
+        elif kind == FLUSH:
+            yield FLUSH, t, names[seg], mb, shard
+        elif kind == MERGE_OUTPUT:
+            yield MERGE_OUTPUT, t, names[seg], [names[next(merged)] for i in range(docs)], thread, shard
+        elif kind == MERGE_END:
+            yield MERGE_END, t, mb, thread, shard
+        else:
+            yield FIND_MERGES, t, shard
 
-    return events, segsToFullMB
 
+def record_time(rec):
+    # The record's time, or None for those of snapshot lines, which have none
+    if rec[0] in (SEG, SNAPSHOT_END):
+        return None
+    return rec[1]
 
-def find_log_files(base_name):
-    files = [base_name]
-    i = 1
 
-    while True:
-        n = "{}.{}".format(base_name, i)
-        if not os.path.isfile(n):
-            break
-        files.append(n)
-        i += 1
+def log_records(log_files, timeformat, use_cache=True, jobs=1, log_slice=None, follow=False):
+    # Records of the logs, or only of the ranges log_slice selects.  With follow, the records of
+    # what is appended to the current log follow, each batch of them ending with (IDLE, None), until
+    # log_slice's window closes, or else forever.
+    if not follow:
+        for log_file, start, end in log_slice.ranges(log_files, timeformat):
+            if start is None:
+                yield from cached_records(log_file, timeformat, use_cache, jobs)
+            else:
+                # Only part of the log is read, so there is nothing to cache
+                yield from parse_records(log_file, timeformat, jobs, start, end)
+        return
+
+    current = log_files[-1]
+    complete = logReader.completeEnd(current)
+    # Whether the window is open by the end of what the logs hold now:
+    opened = log_slice.time_from is None
+    for log_file, start, end in log_slice.ranges(log_files, timeformat):
+        if log_file != current:
+            if start is None:
+                yield from cached_records(log_file, timeformat, use_cache, jobs)
+            else:
+                yield from parse_records(log_file, timeformat, jobs, start, end)
+            continue
+        # The current log's last line may still be being written, and is read once followed:
+        end = complete if end is None else min(end, complete)
+        yield from parse_records(current, timeformat, jobs, start or 0, end)
+        opened = True
+    if log_slice.closed(current, complete, timeformat):
+        return
+
+    yield IDLE, None
+    for data in logReader.followLog(current, complete, FOLLOW_SECONDS):
+        lines = (line for offset, line in logReader.iterKeywordLines(data, 0, len(data), LINE_KEYWORDS))
+        for rec in line_records(lines, timeformat):
+            t = record_time(rec)
+            if not opened:
+                # The window opens at the first line in it, whose snapshot lines follow
+                if t is None or t < log_slice.time_from:
+                    continue
+                opened = True
+            if t is not None and log_slice.time_to is not None and t > log_slice.time_to:
+                yield IDLE, None
+                return
+            yield rec
+        yield IDLE, None
+
+
+def parse(log_files, timeformat, use_cache=True, jobs=1, seg_names=None, log_slice=None, follow=False,
+          by_shard=False, flushes=False, outputs=False):
+    # Yields IndexEvent and MergeEvent as they are found, only within log_slice if one is given, and
+    # with follow also as they are appended to the current log.  With by_shard each shard's snapshots
+    # are collected apart and its events carry the shard.  With flushes, FlushEvent too, and with
+    # outputs OutputEvent and MergedEvent, a merge's end paired with its start by the thread logging
+    # both.  Segment names are interned to ids, the index into seg_names:
+    if seg_names is None:
+        seg_names = []
+    segIds = {}
+    # Snapshot being read and full MB of its segments, by shard (all under None unless by_shard):
+    segs = {}
+    segsToFullMB = {}
+    # Segment being written by each (shard, thread)'s merge:
+    mergeThreads = {}
+    t = None
+
+    def intern(name):
+        seg = segIds.get(name)
+        if seg is None:
+            seg = segIds[name] = len(seg_names)
+            seg_names.append(name)
+        return seg
+
+    if log_slice is None:
+        log_slice = LogSlice()
+
+    for rec in log_records(log_files, timeformat, use_cache, jobs, log_slice, follow):
+        if rec[0] == IDLE:
+            yield IdleEvent()
+            continue
+        lineShard = shard = rec[-1]
+        if not log_slice.has_shard(shard):
+            continue
+        if not by_shard:
+            shard = None
+        kind = rec[0]
+        if kind == SEG:
+            seg = intern(rec[1])
+            docCount, del_count, undelSize = rec[2:5]
+            shardSegs = segs.get(shard)
+            if shardSegs is None:
+                shardSegs = segs[shard] = Segments()
+            fullMB = segsToFullMB.setdefault(shard, {})
+            if seg not in fullMB:
+                if del_count != 0:
+                    del_ratio = float(del_count) / docCount
+                    if del_ratio < 1.0:
+                        full_size = undelSize / (
+                                    1.0 - del_ratio)
+                    else:
+                        # total guess!
+                        print('WARNING: total guess!')
+                        full_size = 0.1
+                else:
+                    full_size = undelSize
+                fullMB[seg] = full_size
+
+            # seg id, fullMB, delPct
+            shardSegs.append(seg, fullMB[seg], float(del_count) / docCount)
+
+        elif kind == SNAPSHOT_END:
+            if segs.get(shard):
+                segsToFullMB[shard] = live_full_mb(segs[shard], segsToFullMB[shard])
+                yield IndexEvent(t, segs.pop(shard), shard)
+
+        elif kind == MERGE:
+            t = rec[1]
+            yield MergeEvent(t, array.array('i', [intern(name) for name in rec[2]]), shard)
+
+        elif kind == FLUSH:
+            if flushes:
+                yield FlushEvent(rec[1], intern(rec[2]), None if rec[3] < 0 else rec[3], shard)
+
+        elif kind == MERGE_OUTPUT:
+            if outputs:
+                seg = intern(rec[2])
+                thread = rec[4]
+                if thread is not None:
+                    mergeThreads[(lineShard, thread)] = seg
+                yield OutputEvent(rec[1], seg, array.array('i', [intern(name) for name in rec[3]]), shard)
+
+        elif kind == MERGE_END:
+            if outputs:
+                seg = mergeThreads.pop((lineShard, rec[3]), None)
+                if seg is not None:
+                    yield MergedEvent(rec[1], seg, rec[2], shard)
 
-    return list(reversed(files))
+        else:
+            t = rec[1]
+            if segs.get(shard):
+                segsToFullMB[shard] = live_full_mb(segs[shard], segsToFullMB[shard])
+                yield IndexEvent(t, segs.pop(shard), shard)
+
+
+def live_full_mb(segs, segsToFullMB):
+    # Drops sizes of segments that were merged away since the previous snapshot:
+    return dict((seg, segsToFullMB[seg]) for seg in segs.ids)
+
+
+class LogSlice:
+    # The part of the logs to show: a time window and one shard, each optional.  The window is found
+    # through the logs' sidecar indexes and a binary search over byte offsets between their entries,
+    # so only its bytes are parsed, starting a little earlier at the last findMerges before it to pick
+    # up the segments alive when it opens.
+
+    def __init__(self, time_from=None, time_to=None, shard=None):
+        # Times in epoch msec; shard is (node, index, shard) or any suffix of it, like (index, shard)
+        self.time_from = time_from
+        self.time_to = time_to
+        self.shard = shard
+
+    def has_shard(self, shard):
+        if self.shard is None:
+            return True
+        return shard is not None and shard[len(shard) - len(self.shard):] == self.shard
+
+    def ranges(self, log_files, timeformat):
+        # Yields (log_file, start, end) byte ranges to parse, start None meaning the whole log
+        if self.time_from is None and self.time_to is None:
+            for log_file in log_files:
+                yield log_file, None, None
+            return
+
+        def time_of(l):
+            return line_time(l, timeformat)
+
+        opened = False
+        for log_file in log_files:
+            with logReader.mappedLog(log_file) as mm:
+                first = logReader.firstLine(mm, 0, len(mm), time_of)
+                if first is None:
+                    continue
+                if self.time_to is not None and first[2] > self.time_to:
+                    break
+                start = 0
+                if not opened and self.time_from is not None:
+                    last = logReader.lastLine(mm, 0, len(mm), time_of)
+                    if last < self.time_from:
+                        # Entirely before the window
+                        continue
+                index = logIndex.load(log_file, 'mergeViz', {'timeformat': timeformat}, time_of, line_shard)
+                if not opened and self.time_from is not None:
+                    lo, hi = index.bounds(self.time_from, len(mm))
+                    pos = logReader.bisectTime(mm, self.time_from, time_of, lo, hi)
+                    start = self.snapshot_start(mm, pos, index)
+                opened = True
+                end = len(mm)
+                if self.time_to is not None:
+                    lo, hi = index.bounds(self.time_to, len(mm), right=True)
+                    end = logReader.bisectTime(mm, self.time_to, time_of, max(lo, start), max(hi, start), right=True)
+            yield log_file, start, end
+
+    def closed(self, log_file, end, timeformat):
+        # Whether the window closes before byte end of the log
+        if self.time_to is None:
+            return False
+        with logReader.mappedLog(log_file) as mm:
+            last = logReader.lastLine(mm, 0, end, lambda l: line_time(l, timeformat))
+        return last is not None and last > self.time_to
+
+    def snapshot_start(self, mm, pos, index):
+        # Start of the last findMerges line of the shard before pos, or of the log if there is none.
+        # Only the bytes since the index entry before pos are searched, the entry knows the rest.
+        floor, shards = index.findMerges(pos)
+        while True:
+            i = mm.rfind(logIndex.FIND_MERGES, floor, pos)
+            if i == -1:
+                break
+            pos = mm.rfind(b'\n', 0, i) + 1
+            if self.has_shard(line_shard(mm[pos:logReader.lineStart(mm, i + 1)])):
+                return pos
+        offsets = [offset for key, offset in shards.items() if self.has_shard(tuple(key.split(':')) if key else None)]
+        return max(offsets, default=0)
 
 
 if __name__ == '__main__':
@@ -328,16 +1397,51 @@ if __name__ == '__main__':
         description="Parses infoStream output from IW and draws an movie showing the merges over time."
     )
     parser.add_argument('log_file', type=str, help='Log file or pattern')
-    parser.add_argument('output_file', type=str, help='Output mov file')
+    parser.add_argument('output_file', type=str, nargs='?', help='Output mov file')
     parser.add_argument('--timeformat', type=str, default='%Y-%m-%d %H:%M:%S.%f', nargs='?',
                         help='Time format, by default uses %d %b %H:%M:%S.%f which expects 07 Jul 12:54:12.554',
                         required=False)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='Processes parsing the logs and rendering frames, by default one per CPU')
+    parser.add_argument('--pipe', type=str, choices=('ffmpeg', 'mencoder'), required=False,
+                        help='Pipe raw frames into this encoder instead of writing PNGs to a temporary directory')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='Always parse the logs, without reading or writing the parsed-event cache next to them')
+    parser.add_argument('--speedup', type=float, required=False,
+                        help='Seconds of log per second of video, e.g. 60 shows an hour of log in a minute; '
+                             'by default each event gets one frame')
+    parser.add_argument('--from', dest='time_from', type=str, required=False,
+                        help='Start the video at this time, in the log\'s time format')
+    parser.add_argument('--to', dest='time_to', type=str, required=False,
+                        help='End the video at this time, in the log\'s time format')
+    parser.add_argument('--shard', type=str, required=False,
+                        help='Only show this shard, as index:shard or node:index:shard')
+    parser.add_argument('--by-shard', dest='by_shard', action='store_true',
+                        help='Draw each shard in a panel of its own, all in a grid filling the frame')
+    parser.add_argument('--live', type=int, metavar='PORT', required=False,
+                        help='Follow the log, streaming the merges as they happen to http://localhost:PORT/ '
+                             'instead of writing a movie')
 
     args = parser.parse_args()
 
-    log_files = find_log_files(args.log_file)
+    log_files = logReader.findLogFiles(args.log_file)
     for file in log_files:
         print('Found {}'.format(file))
 
-    with TemporaryDirectory(prefix="mergeimages-") as temp_directory:
-        main(log_files, args.output_file, temp_directory, args.timeformat)
\ No newline at end of file
+    log_slice = LogSlice(None if args.time_from is None else stamp_time(args.time_from, args.timeformat),
+                         None if args.time_to is None else stamp_time(args.time_to, args.timeformat),
+                         None if args.shard is None else tuple(args.shard.split(':')))
+
+    if args.live is not None:
+        if args.by_shard:
+            parser.error('--by-shard is not supported with --live')
+        live(log_files, args.timeformat, args.live, args.jobs, args.use_cache, log_slice)
+    elif args.output_file is None:
+        parser.error('output_file is required unless --live is given')
+    elif args.pipe is not None:
+        main(log_files, args.output_file, None, args.timeformat, args.jobs, args.pipe, args.use_cache, args.speedup,
+             log_slice, args.by_shard)
+    else:
+        with TemporaryDirectory(prefix="mergeimages-") as temp_directory:
+            main(log_files, args.output_file, temp_directory, args.timeformat, args.jobs,
+                 use_cache=args.use_cache, speedup=args.speedup, log_slice=log_slice, by_shard=args.by_shard)
\ No newline at end of file
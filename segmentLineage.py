@@ -0,0 +1,402 @@
+import argparse
+import array
+import math
+import os
+
+import logCache
+import logReader
+import mergeViz
+
+"""
+Keeps every segment's life, from its flush (or the merge that wrote it) through the deletes it took
+to the merge that consumed it and the segment that merge wrote, so segment ages, how many times the
+index's bytes were rewritten, and any one segment's history can be looked up without reading the log
+again.
+
+Segments are rows of parallel arrays, with their names and shards interned; merges and deletion
+ratio histories are arrays of their own that rows point into.  The lineage is worked out from
+mergeViz.parse()'s flushes, findMerges snapshots and merges.  A segment takes its birth time and size
+from its flush lines, or from the lines of the merge that wrote it, which name it.  In logs without
+those lines, a segment first seen in a snapshot was written by a merge when mergeViz.PendingMerges
+matches it to one that just finished, else it is taken as flushed at the snapshot.  The lineage is
+cached next to the log, keyed to every file of it.
+"""
+
+# How a segment came to be:
+BORN_BEFORE = -1  # already in the log's first snapshot of its shard
+MERGED = 0
+FLUSHED = 1
+
+# Rows are segments, merges, merge inputs (segment rows) and deletion ratio changes, in that order;
+# each column has its own length
+COLUMNS = (('shard', 'i'), ('name', 'i'), ('born', 'b'), ('t', 'd'), ('mb', 'd'), ('lastT', 'd'),
+           ('lastMB', 'd'), ('alive', 'b'), ('parent', 'i'), ('merge', 'i'), ('historyStart', 'q'),
+           ('mergeT', 'd'), ('mergeEndT', 'd'), ('mergeResult', 'i'), ('inputStart', 'q'),
+           ('inputs', 'i'),
+           ('historyT', 'd'), ('historyDelPct', 'd'))
+CACHE_VERSION = 3
+
+# Upper bounds (seconds) and names of the age buckets
+AGE_BUCKETS = ((60, '<1 min'), (600, '1-10 min'), (3600, '10-60 min'), (6 * 3600, '1-6 hours'),
+               (24 * 3600, '6-24 hours'), (math.inf, '1+ days'))
+
+
+class SegmentLineage:
+    # Segment rows, found by name in O(1); t, mb are when a segment was flushed and its flushed MB
+    # (when first seen and its live MB then, without flush lines), lastT, lastMB when it was last
+    # seen, parent the merge that wrote it and merge the one that consumed it (-1 for none)
+
+    def __init__(self, names, shards, columns):
+        self.names = names
+        self.shards = shards
+        for name, typecode in COLUMNS:
+            setattr(self, name, columns[name])
+        self.byName = {}
+        for row, name in enumerate(self.name):
+            self.byName.setdefault(name, []).append(row)
+        self.nameIds = dict((name, i) for i, name in enumerate(names))
+        # Times of each shard's last snapshot, when the segments still alive were last seen:
+        self.endT = {}
+        for row in range(len(self.shard)):
+            if self.alive[row]:
+                self.endT[self.shard[row]] = self.lastT[row]
+
+    def __len__(self):
+        return len(self.shard)
+
+    def find(self, name, shard=None):
+        # Rows of the segments with this name, in any shard or the one shard given as (node, index,
+        # shard) or a suffix of it like (index, shard)
+        rows = self.byName.get(self.nameIds.get(name), [])
+        if shard is None:
+            return list(rows)
+        return [row for row in rows if self.shards[self.shard[row]][-len(shard):] == tuple(shard)]
+
+    def history(self, row):
+        # (t, fraction of deleted docs) each time the segment's deletes changed, from its birth on
+        start = self.historyStart[row]
+        end = self.historyStart[row + 1] if row + 1 < len(self.historyStart) else len(self.historyT)
+        return list(zip(self.historyT[start:end], self.historyDelPct[start:end]))
+
+    def merge_inputs(self, merge):
+        start = self.inputStart[merge]
+        end = self.inputStart[merge + 1] if merge + 1 < len(self.inputStart) else len(self.inputs)
+        return self.inputs[start:end]
+
+    def describe(self, row):
+        # One segment's whole life, for drilling down
+        def merge_info(merge):
+            if merge == -1:
+                return None
+            result = self.mergeResult[merge]
+            return {'t': self.mergeT[merge],
+                    'endT': None if math.isnan(self.mergeEndT[merge]) else self.mergeEndT[merge],
+                    'inputs': [self.names[self.name[seg]] for seg in self.merge_inputs(merge)],
+                    'result': None if result == -1 else self.names[self.name[result]]}
+
+        return {'name': self.names[self.name[row]],
+                'shard': ':'.join(self.shards[self.shard[row]]),
+                'born': {BORN_BEFORE: 'before the log', MERGED: 'merged', FLUSHED: 'flushed'}[self.born[row]],
+                't': self.t[row],
+                'mb': self.mb[row],
+                'lastT': self.lastT[row],
+                'lastMB': self.lastMB[row],
+                'alive': bool(self.alive[row]),
+                'rewrites': self.rewrites(row),
+                'deletes': self.history(row),
+                'mergedFrom': merge_info(self.parent[row]),
+                'mergedInto': merge_info(self.merge[row])}
+
+    def ages(self):
+        # (age in seconds, live MB) of each segment alive at the end of its shard's log
+        return [((self.endT[self.shard[row]] - self.t[row]) / 1000., self.lastMB[row])
+                for row in range(len(self)) if self.alive[row]]
+
+    def rewrites(self, row, memo=None):
+        # {times rewritten by merges: share of the segment's bytes}, following its merges back to the
+        # flushes (or segments from before the log) its bytes came from, each input weighted by its
+        # live MB when last seen
+        if memo is None:
+            memo = {}
+        shares = memo.get(row)
+        if shares is not None:
+            return shares
+        parent = self.parent[row]
+        shares = {}
+        inputs = [] if parent == -1 else self.merge_inputs(parent)
+        totMB = sum(self.lastMB[seg] for seg in inputs)
+        if totMB <= 0:
+            shares[0] = 1.0
+        else:
+            for seg in inputs:
+                for count, share in self.rewrites(seg, memo).items():
+                    shares[count + 1] = shares.get(count + 1, 0.0) + share * self.lastMB[seg] / totMB
+        memo[row] = shares
+        return shares
+
+    def rewrite_histogram(self):
+        # {times rewritten by merges: live MB} over the segments alive at the end
+        memo = {}
+        histogram = {}
+        for row in range(len(self)):
+            if self.alive[row]:
+                for count, share in self.rewrites(row, memo).items():
+                    histogram[count] = histogram.get(count, 0.0) + share * self.lastMB[row]
+        return dict(sorted(histogram.items()))
+
+
+class LineageBuilder:
+    # Follows parse()'s events shard by shard, growing the lineage's columns
+
+    def __init__(self, segNames):
+        self.segNames = segNames
+        self.columns = dict((name, array.array(typecode)) for name, typecode in COLUMNS)
+        # Per shard: segment id to row of the segments in its last snapshot, its merges not finished,
+        # segment id to [t, MB or None] of its flushes not in a snapshot yet, merged segment ids to the
+        # merge of those whose output isn't named yet, and output segment id to [merge, MB or None] of
+        # those named, until the output is in a snapshot:
+        self.shardIds = {}
+        self.live = []
+        self.pending = []
+        self.flushes = []
+        self.starts = []
+        self.outputs = []
+        # Each segment row's (t, fraction of deleted docs) changes, and each merge's input rows:
+        self.histories = []
+        self.mergeInputs = []
+
+    def add(self, ev):
+        shard = self.shardIds.get(ev.shard)
+        if shard is None:
+            shard = self.shardIds[ev.shard] = len(self.shardIds)
+            self.live.append(None)
+            self.pending.append(mergeViz.PendingMerges())
+            self.flushes.append({})
+            self.starts.append({})
+            self.outputs.append({})
+        if ev.kind == 'index':
+            self.index(shard, ev.t, ev.segs)
+        elif ev.kind == 'flush':
+            flush = self.flushes[shard].setdefault(ev.seg, [ev.t, None])
+            if ev.mb is not None:
+                flush[1] = ev.mb
+        elif self.live[shard] is None:
+            # Merges before the shard's first snapshot can't be followed
+            pass
+        elif ev.kind == 'merge':
+            self.merge(shard, ev.t, ev.merged)
+        elif ev.kind == 'output':
+            merge = self.starts[shard].pop(frozenset(ev.merged), None)
+            if merge is None:
+                # The merge's start wasn't logged by the merge policy
+                merge = self.merge(shard, ev.t, ev.merged)
+                del self.starts[shard][frozenset(ev.merged)]
+            self.pending[shard].remove(merge)
+            self.outputs[shard][ev.seg] = [merge, None]
+        elif ev.kind == 'merged':
+            output = self.outputs[shard].get(ev.seg)
+            if output is not None:
+                self.columns['mergeEndT'][output[0]] = ev.t
+                output[1] = ev.mb
+
+    def index(self, shard, t, segs):
+        cols = self.columns
+        prev = self.live[shard]
+        flushes = self.flushes[shard]
+        outputs = self.outputs[shard]
+        live = {}
+        # New segments without flush or merge lines, some of which merges wrote:
+        new = []
+        for seg, mb, delPct in zip(segs.ids, segs.mb, segs.delPct):
+            liveMB = mb * (1.0 - delPct)
+            row = None if prev is None else prev.get(seg)
+            if row is None:
+                row = len(cols['shard'])
+                cols['shard'].append(shard)
+                cols['name'].append(seg)
+                flush = flushes.pop(seg, None)
+                output = outputs.pop(seg, None)
+                if output is not None:
+                    merge, outputMB = output
+                    if math.isnan(cols['mergeEndT'][merge]):
+                        cols['mergeEndT'][merge] = t
+                    cols['born'].append(MERGED)
+                    cols['t'].append(cols['mergeEndT'][merge])
+                    cols['mb'].append(liveMB if outputMB is None else outputMB)
+                    cols['mergeResult'][merge] = row
+                elif flush is not None:
+                    cols['born'].append(FLUSHED)
+                    cols['t'].append(t if flush[0] is None else flush[0])
+                    cols['mb'].append(liveMB if flush[1] is None else flush[1])
+                else:
+                    cols['born'].append(BORN_BEFORE if prev is None else FLUSHED)
+                    cols['t'].append(t)
+                    cols['mb'].append(liveMB)
+                    if prev is not None:
+                        new.append(row)
+                cols['lastT'].append(t)
+                cols['lastMB'].append(liveMB)
+                cols['alive'].append(0)
+                cols['parent'].append(-1 if output is None else output[0])
+                cols['merge'].append(-1)
+                self.histories.append([(t, delPct)])
+            else:
+                cols['lastT'][row] = t
+                cols['lastMB'][row] = liveMB
+                history = self.histories[row]
+                if history[-1][1] != delPct:
+                    history.append((t, delPct))
+            live[seg] = row
+        self.live[shard] = live
+
+        done = self.pending[shard].finish(live, new,
+                                          lambda merge, merged: sum(cols['lastMB'][row]
+                                                                    for row in self.mergeInputs[merge]),
+                                          lambda row: cols['mb'][row])
+        for merge, row in done:
+            cols['mergeEndT'][merge] = t
+            if row is not None:
+                cols['born'][row] = MERGED
+                cols['parent'][row] = merge
+                cols['mergeResult'][merge] = row
+
+    def merge(self, shard, t, merged):
+        cols = self.columns
+        live = self.live[shard]
+        merge = len(cols['mergeT'])
+        cols['mergeT'].append(t)
+        cols['mergeEndT'].append(float('nan'))
+        cols['mergeResult'].append(-1)
+        inputs = []
+        for seg in merged:
+            row = live.get(seg)
+            if row is not None:
+                # A merge restarted after an abort consumes the segment instead:
+                cols['merge'][row] = merge
+                inputs.append(row)
+        self.mergeInputs.append(inputs)
+        self.pending[shard].add(merge, merged)
+        self.starts[shard][frozenset(merged)] = merge
+        return merge
+
+    def finish(self):
+        cols = self.columns
+        for live in self.live:
+            for row in live.values():
+                cols['alive'][row] = 1
+        for history in self.histories:
+            cols['historyStart'].append(len(cols['historyT']))
+            for t, delPct in history:
+                cols['historyT'].append(t)
+                cols['historyDelPct'].append(delPct)
+        for inputs in self.mergeInputs:
+            cols['inputStart'].append(len(cols['inputs']))
+            cols['inputs'].extend(inputs)
+        # Segment ids are mergeViz's interned names already; only the ones used are kept
+        used = sorted(set(cols['name']))
+        nameIds = dict((seg, i) for i, seg in enumerate(used))
+        cols['name'] = array.array('i', [nameIds[seg] for seg in cols['name']])
+        shards = [None] * len(self.shardIds)
+        for shard, i in self.shardIds.items():
+            shards[i] = () if shard is None else tuple(shard)
+        return SegmentLineage([self.segNames[seg] for seg in used], shards, cols)
+
+
+def build(log_files, timeformat, use_cache=True, jobs=1):
+    segNames = []
+    builder = LineageBuilder(segNames)
+    for ev in mergeViz.parse(log_files, timeformat, use_cache, jobs, segNames, by_shard=True, flushes=True,
+                               outputs=True):
+        builder.add(ev)
+    return builder.finish()
+
+
+def cache_params(log_files, timeformat):
+    # The cache lives next to the newest file; the older ones it was rotated to are keyed here
+    return {'version': CACHE_VERSION, 'timeformat': timeformat,
+            'rotated': [logCache.fingerprint(log_file) for log_file in log_files[:-1]]}
+
+
+def load(log_files, timeformat, use_cache=True, jobs=1):
+    # The logs' lineage, from its cache when that is up to date, else built and cached
+    if not use_cache:
+        return build(log_files, timeformat, use_cache, jobs)
+
+    params = cache_params(log_files, timeformat)
+    cache = logCache.load(log_files[-1], 'segmentLineage', params)
+    if cache is not None:
+        print('Using lineage cache for {}'.format(log_files[-1]))
+        columns = dict((name, array.array(typecode, cache.iterColumn(name))) for name, typecode in COLUMNS)
+        return SegmentLineage(cache.meta['names'], [tuple(shard) for shard in cache.meta['shards']], columns)
+
+    writer = logCache.CacheWriter(log_files[-1], 'segmentLineage', params, COLUMNS)
+    try:
+        lineage = build(log_files, timeformat, use_cache, jobs)
+        for name, typecode in COLUMNS:
+            writer.columns[name].extend(getattr(lineage, name))
+    except BaseException:
+        writer.discard()
+        raise
+    writer.commit({'names': lineage.names, 'shards': lineage.shards})
+    return lineage
+
+
+def age_histogram(ages):
+    # [(bucket name, segment count, live MB)] of AGE_BUCKETS
+    counts = [0] * len(AGE_BUCKETS)
+    mbs = [0.0] * len(AGE_BUCKETS)
+    for sec, mb in ages:
+        for i, (bound, name) in enumerate(AGE_BUCKETS):
+            if sec < bound:
+                counts[i] += 1
+                mbs[i] += mb
+                break
+    return [(name, count, mb) for (bound, name), count, mb in zip(AGE_BUCKETS, counts, mbs)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Tracks every segment in IW infoStream output from birth to the merge that consumed it, '
+                    'reporting segment ages and how many times the index was rewritten.'
+    )
+    parser.add_argument('log_file', type=str, help='Log file')
+    parser.add_argument('--timeformat', type=str, default='%Y-%m-%d %H:%M:%S.%f',
+                        help='Time format of the log lines, as for mergeViz')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='Processes parsing the log, by default one per CPU')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='Always parse the logs, without reading or writing the caches next to them')
+    parser.add_argument('--segment', type=str, required=False,
+                        help='Show the life of the segments with this name, like _jpik')
+    parser.add_argument('--shard', type=str, required=False,
+                        help='Only show the segment in this shard, as index:shard or node:index:shard')
+
+    args = parser.parse_args()
+
+    lineage = load(logReader.findLogFiles(args.log_file), args.timeformat, args.use_cache, args.jobs)
+
+    if args.segment is not None:
+        rows = lineage.find(args.segment, None if args.shard is None else args.shard.split(':'))
+        if not rows:
+            parser.error('no segment %s' % args.segment)
+        for row in rows:
+            life = lineage.describe(row)
+            print('%s %s: %s at %d, %.3f MB' % (life['shard'], life['name'], life['born'], life['t'], life['mb']))
+            for t, delPct in life['deletes']:
+                print('  %d: %.1f%% deleted' % (t, 100. * delPct))
+            for label, merge in ('merged from', life['mergedFrom']), ('merged into', life['mergedInto']):
+                if merge is not None:
+                    print('  %s %s at %d: %s' % (label, merge['result'], merge['t'], ' '.join(merge['inputs'])))
+            print('  last seen at %d, %.3f MB%s' % (life['lastT'], life['lastMB'], ' (alive)' if life['alive'] else ''))
+            print('  bytes rewritten: %s' % ', '.join('%d times %.0f%%' % (count, 100. * share)
+                                                      for count, share in sorted(life['rewrites'].items())))
+    else:
+        alive = sum(lineage.alive)
+        print('%d segments, %d flushed, %d merges, %d alive at the end' % (
+            len(lineage), sum(1 for born in lineage.born if born == FLUSHED), len(lineage.mergeT), alive))
+        print('age of the segments alive at the end:')
+        for name, count, mb in age_histogram(lineage.ages()):
+            print('  %-10s %5d segments %10.1f MB' % (name, count, mb))
+        print('live MB by times rewritten by merges:')
+        for count, mb in lineage.rewrite_histogram().items():
+            print('  %3d %10.1f MB' % (count, mb))